@@ -28,6 +28,43 @@ class API:
     def get_mode(self) -> dict:
         return {'mode': self.controller.mode, 'mode_text': self.controller.mode_text}
 
+    def get_pio_allocation(self) -> list:
+        """Returns the state machines and programs allocated per PIO block."""
+        return self.controller.pio_allocator.getStatusData()
+
+    def get_irq_event_stats(self) -> dict:
+        """Returns the statistics of the deferred interrupt handling (latency and duration of the handlers)."""
+        return self.controller.event_queue.getStatusData()
+
+    def get_cadence_report(self) -> dict:
+        """Returns the achieved ball cadence compared with the theoretical limit of the ball feeders."""
+        return self.controller.get_cadence_report()
+
+    def get_power_status(self) -> dict:
+        """Returns the planned start sequence of the motors with its current estimates and the supply budget."""
+        return self.controller.power_sequencer.getStatusData()
+
+    def set_power_config(self, data: dict, save: bool = True) -> dict:
+        """Changes the supply budget and the current estimates (see PowerSequencer.setConfigData()) and returns the resulting config.
+           With save=True the settings file is updated.
+        """
+        self.controller.power_sequencer.setConfigData(data)
+        if save:
+            self.controller._save_settings()
+        return self.controller.power_sequencer.getConfigData()
+
+    def get_critical_path_report(self) -> dict:
+        """Returns how long the aim, the ball driver and the feeder held back the recent ball releases."""
+        return self.controller.get_critical_path_report()
+
+    def get_aiming(self) -> dict:
+        """Returns the range and resolution of the aiming table in use."""
+        return self.controller.aiming.getStatusData()
+
+    def set_aiming_table(self, path: str, save: bool = True) -> dict:
+        """Loads the aiming table from the given file (built on the host), an empty path restores the direct aiming."""
+        return self.controller.set_aiming_table(path, save)
+
 
     def start_playing(self):
         self.controller._start_playing()
@@ -144,6 +181,19 @@ class API:
         return self.controller.ball_drivers[bd_index].getStatusData()
     
     # TODO: Ball stirrers and feeders are currently hardcoded as stepMotors. Motor type must be flexible!
+    def bs_get_policy_status(self) -> dict:
+        """Returns the stirrer policy with the runtime and the estimated energy of the stirrers."""
+        return self.controller.stirrer_policy.getStatusData()
+
+    def bs_set_policy(self, data: dict, save: bool = True) -> dict:
+        """Changes the stirrer policy (see StirrerPolicy.setConfigData()) and returns the resulting config.
+           With save=True the settings file is updated.
+        """
+        self.controller.stirrer_policy.setConfigData(data)
+        if save:
+            self.controller._save_settings()
+        return self.controller.stirrer_policy.getConfigData()
+
     def bs_get_config(self, bs_index: int):
         """Get the configuration data of a ball stirrer.
         Parameters:
@@ -255,6 +305,19 @@ class API:
         """
         return self.controller.ball_feeders[bf_index].motors[motor_index].setConfigData(data)
 
+    def bf_tune(self, bf_index: int, trials: int = 3, save: bool = True):
+        """
+        Calibrate the fastest reliable cycle of a ball feeder by dispensing with increasing motor speeds.
+        The machine must be idle and the feeder loaded with balls.
+        Parameters:
+        bf_index: index of the ball feeder (int)
+        trials: number of cycles per probed speed (int)
+        save: save the resulting settings to the settings file (bool)
+        Returns:
+        dict: The adopted settings and the log of the probed speeds.
+        """
+        return self.controller.tune_ball_feeder(bf_index, trials, save)
+
     def bf_motor_rotate(self, bf_index: int, motor_index: int, angle_deg: float):
         """
         Rotate a motor in a ball feeder by a given angle. This should be used e.g. during calibration.
@@ -265,6 +328,36 @@ class API:
         """
         self.controller.ball_feeders[bf_index].motors[motor_index].rotate_by_angle(angle_deg)
     
+    def bf_get_motor_position(self, bf_index: int, motor_index: int):
+        """
+        Get the live position of a ball feeder motor, also while it is moving.
+        Parameters:
+        bf_index: index of the ball feeder (int)
+        motor_index: index of the motor within the feeder (int)
+        Returns:
+        dict: Absolute position in steps and degrees, as well as the progress of the running move.
+        """
+        mot = self.controller.ball_feeders[bf_index].motors[motor_index]
+        steps = mot.read_position_steps()
+        done, total = mot.get_move_progress()
+        return {'position_steps': steps, 'position_angle': steps * mot.angle_per_step, 'move_steps_done': done, 'move_steps_total': total}
+
+    def bf_get_sensor_status(self, bf_index: int):
+        """
+        Get the metrics of the light barriers of a ball feeder.
+        Parameters:
+        bf_index: index of the ball feeder (int)
+        Returns:
+        dict: Balls counted at outlet and driver entry, transit times (us), misses and retries. None if the feeder has no sensor.
+        """
+        bf = self.controller.ball_feeders[bf_index]
+        if bf.ball_sensor is None:
+            return None
+        status = bf.ball_sensor.getStatusData()
+        status['misses'] = bf.misses
+        status['retries'] = bf.retries
+        return status
+
     def bf_motor_stop(self, bf_index: int, motor_index: int):
         """
         Stop a motor in a ball feeder.
@@ -296,12 +389,18 @@ class API:
 
     def mr_rotate(self, mr_index: int, angle_deg: float):
         """
-        Rotates the machine rotator by a given angle.
+        Rotates the machine rotator to a given angle. All motors of the rotator arrive at the same time.
         Parameters:
         mr_index: index of the machine rotator (int)
-        angle_deg: angle in degrees (negative value moves into opposite direction)
+        angle_deg: absolute angle in degrees (0 is the home position, negative values are on the opposite side)
+        Returns:
+        dict: The planned duration of the rotation in ms (0 if it was queued behind a running rotation).
         """
-        self.controller.machine_rotators[mr_index].rotate(angle_deg)
+        return {'planned_ms': self.controller.machine_rotators[mr_index].rotate(angle_deg)}
+
+    def mr_get_status(self, mr_index: int):
+        """Get the status of a machine rotator: current and target angle, whether it is settled, planned and measured duration."""
+        return self.controller.machine_rotators[mr_index].getStatusData()
 
     def mr_motor_rotate_max(self, mr_index: int, motor_index: int):
         """
@@ -0,0 +1,166 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List, Union
+from array import array
+import struct
+from RobbyExceptions import ConfigurationException
+
+AXIS_PAN = 'pan'
+AXIS_TILT = 'tilt'
+AXES = (AXIS_PAN, AXIS_TILT)
+"""output axes of the table, in this order"""
+MAGIC = b'AIM1'
+HEADER = '<4shHHhHHH'
+"""magic, h_min, h_step, nh, v_min, v_step, nv, axes (angles in 0.1 degrees)"""
+
+class AimingTable:
+    """Maps the aim of a shot (horizontal and vertical angle of the ball's direction) to the targets of the machine axes
+       (pan: machine rotator, tilt: tilt axis), which are not the same in general due to the geometry of the machine.
+       The mapping is a grid of precalculated targets, which is interpolated bilinearly. The grid is built on the host
+       (see build() and calibration_solver()) and stored as a compact binary file, which is loaded on the device.
+       All angles in the table are given in 0.1 degrees.
+    """
+    def __init__(self, h_min: int, h_step: int, nh: int, v_min: int, v_step: int, nv: int, values=None) -> None:
+        """Parameters:
+           h_min, h_step, nh: first horizontal angle, distance and number of the grid columns (0.1 degrees).
+           v_min, v_step, nv: the same for the vertical angle (grid rows).
+           values:            array('h') with the targets of all axes per grid point, row by row (nh * nv * len(AXES)).
+        """
+        if nh < 2 or nv < 2 or h_step <= 0 or v_step <= 0:
+            raise ConfigurationException(f"AimingTable: the grid needs at least 2 x 2 points and positive steps ({nh=}, {nv=}, {h_step=}, {v_step=}).")
+        self.h_min = h_min
+        self.h_step = h_step
+        self.nh = nh
+        self.v_min = v_min
+        self.v_step = v_step
+        self.nv = nv
+        n = nh * nv * len(AXES)
+        if values is None:
+            values = array('h', [0] * n)
+        if len(values) != n:
+            raise ConfigurationException(f"AimingTable: {len(values)} values given, but the grid needs {n}.")
+        self.values = values
+
+    def lookup(self, h_angle: float, v_angle: float) -> tuple:
+        """Returns the targets (pan, tilt) in 0.1 degrees for the aim given in degrees. Aims outside of the grid are clamped."""
+        fx = (h_angle * 10 - self.h_min) / self.h_step
+        fy = (v_angle * 10 - self.v_min) / self.v_step
+        fx = min(max(fx, 0.0), self.nh - 1.0)
+        fy = min(max(fy, 0.0), self.nv - 1.0)
+        i = min(int(fx), self.nh - 2)
+        j = min(int(fy), self.nv - 2)
+        tx = fx - i
+        ty = fy - j
+        axes = len(AXES)
+        row = self.nh * axes
+        k00 = j * row + i * axes
+        k10 = k00 + axes
+        k01 = k00 + row
+        k11 = k01 + axes
+        v = self.values
+        ret = []
+        for a in range(axes):
+            top = v[k00 + a] + (v[k10 + a] - v[k00 + a]) * tx
+            bottom = v[k01 + a] + (v[k11 + a] - v[k01 + a]) * tx
+            x = top + (bottom - top) * ty
+            ret.append(int(x + 0.5) if x >= 0 else -int(0.5 - x))
+        return tuple(ret)
+
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as f:
+            f.write(struct.pack(HEADER, MAGIC, self.h_min, self.h_step, self.nh, self.v_min, self.v_step, self.nv, len(AXES)))
+            f.write(bytes(self.values))
+
+    def getStatusData(self) -> dict:
+        return {
+            'h_range': [self.h_min / 10, (self.h_min + (self.nh - 1) * self.h_step) / 10],
+            'v_range': [self.v_min / 10, (self.v_min + (self.nv - 1) * self.v_step) / 10],
+            'grid': [self.nh, self.nv],
+        }
+
+class IdentityAiming:
+    """Used as long as no aiming table is calibrated: the axes are moved to the angles of the shot directly."""
+    def lookup(self, h_angle: float, v_angle: float) -> tuple:
+        return (int(round(h_angle * 10)), int(round(v_angle * 10)))
+
+    def getStatusData(self) -> dict:
+        return {'grid': None}
+
+def load(path: str) -> AimingTable:
+    """Loads a table written by AimingTable.save()."""
+    with open(path, 'rb') as f:
+        header = f.read(struct.calcsize(HEADER))
+        magic, h_min, h_step, nh, v_min, v_step, nv, axes = struct.unpack(HEADER, header)
+        if magic != MAGIC or axes != len(AXES):
+            raise ConfigurationException(f"'{path}' is not a valid aiming table.")
+        values = array('h', [0] * (nh * nv * axes))
+        f.readinto(values)
+    return AimingTable(h_min, h_step, nh, v_min, v_step, nv, values)
+
+def create_from_config(data: dict):
+    """Returns the aiming table given by the settings ({'table_file': path}) or the identity mapping, if there is none."""
+    path = data.get('table_file') if data else None
+    if not path:
+        return IdentityAiming()
+    return load(path)
+
+def build(solver, h_min: float, h_max: float, v_min: float, v_max: float, step: float) -> AimingTable:
+    """Host tool: builds the table by calling solver(h_angle, v_angle) -> (pan, tilt) (in degrees) for every grid point.
+       The solver can be an inverse kinematics of the machine or the calibration_solver().
+    """
+    nh = int(round((h_max - h_min) / step)) + 1
+    nv = int(round((v_max - v_min) / step)) + 1
+    table = AimingTable(int(round(h_min * 10)), int(round(step * 10)), nh, int(round(v_min * 10)), int(round(step * 10)), nv)
+    k = 0
+    for j in range(nv):
+        v = v_min + j * step
+        for i in range(nh):
+            h = h_min + i * step
+            targets = solver(h, v)
+            for a in range(len(AXES)):
+                table.values[k] = int(round(targets[a] * 10))
+                k += 1
+    return table
+
+def calibration_solver(points: list, power: float = 2.0):
+    """Host tool: returns a solver interpolating calibration measurements by inverse distance weighting.
+       points: list of (h_angle, v_angle, pan, tilt), i.e. the axis targets found to hit the aim (h_angle, v_angle).
+    """
+    if not points:
+        raise ConfigurationException("calibration_solver() needs at least one calibration point.")
+    def solver(h: float, v: float) -> tuple:
+        weights = 0.0
+        pan = 0.0
+        tilt = 0.0
+        for p in points:
+            d2 = (p[0] - h) ** 2 + (p[1] - v) ** 2
+            if d2 < 1e-9:
+                return (p[2], p[3])
+            w = 1.0 / d2 ** (power / 2)
+            weights += w
+            pan += w * p[2]
+            tilt += w * p[3]
+        return (pan / weights, tilt / weights)
+    return solver
+
+def run_aiming_test(path: str = 'aiming_test.tbl') -> bool:
+    """Host test: builds a table from a linear mapping, stores and reloads it and checks the interpolation."""
+    solver = lambda h, v: (1.2 * h + 0.1 * v, 0.8 * v - 2.0)
+    table = build(solver, -45.0, 45.0, -10.0, 30.0, 5.0)
+    table.save(path)
+    table = load(path)
+    ok = True
+    for h, v in ((0.0, 0.0), (12.3, 7.7), (-44.0, 29.0), (33.3, -9.9)):
+        pan, tilt = table.lookup(h, v)
+        exp_pan, exp_tilt = solver(h, v)
+        if abs(pan - exp_pan * 10) > 1 or abs(tilt - exp_tilt * 10) > 1:
+            print(f"Aiming ({h}, {v}): got ({pan}, {tilt}), expected ({exp_pan * 10:.1f}, {exp_tilt * 10:.1f}).")
+            ok = False
+    # clamped outside of the grid
+    ok = ok and table.lookup(90.0, 0.0) == table.lookup(45.0, 0.0)
+    print(f"Aiming table test {'passed' if ok else 'FAILED'} ({table.getStatusData()}).")
+    return ok
@@ -5,12 +5,17 @@
 import sys
 if 'micropython' not in sys.version.lower():
     from typing import List, Union
-import math
+from array import array
 import time
 from DcMotor import DcMotor
+from MotorDynamics import MotorDynamics, identify_time_constant
 from Pca9685 import PCA9685, PIN_SDA, I2C_CHANNEL
-from RobbyExceptions import InputDataException
+from RobbyExceptions import InputDataException, ConfigurationException, InvalidOperationException
+from MotorSettingsCache import MotorSettingsCache
+from MotorSpeedSolver import MotorSpeedSolver
 from Shot import Shot
+from SpeedController import SpeedController
+from Tachometer import Tachometer
 
 class BallDriver():
     """BallDriver controls the DC motors used to accelerate the ball."""
@@ -42,13 +47,30 @@ class BallDriver():
         except OSError as e:
             raise OSError(f"ERROR: BallDriver #{bd_number} could not initialize PCA9685 motor driver on {sda_pin} channel {i2c_channel} (please check the wiring): {e}")
         self.motorDriver.setPWMFreq(50)
-        self.motor_angles = [a for a in motor_angles if a is not None]
+        self._solver: Union[MotorSpeedSolver, None] = None
+        self._settings_cache = MotorSettingsCache()
+        """Motor speeds per quantised shot, so that repeated shots are not recalculated."""
+        self.geometry_version = 0
+        """Incremented on every geometry or motor config change, so that precalculated motor settings can be identified as outdated."""
+        self._wheel_diameters = []
+        self.motor_angles = motor_angles
         self.motors = [DcMotor(self.motorDriver, i_mot, 1, self.debug) for i_mot in range(len(self.motor_angles))]
+        self._compiled_speeds = [0 for _ in self.motors]
+        """Preallocated buffer for apply_motor_speeds()"""
+        self._speed_buf = array('h', [0] * len(self.motors))
+        """Preallocated buffer for the fixed-point speed calculation"""
         self.wheel_diameters = [0.04 for _ in self.motors] # wheel diameters in m
         self.motor_speeds = [0 for _ in self.motors] # configured motor speeds (normalized to 100)
         """The motor speeds for the current shot (regardless of the current status!), normalized to 100% (-100 to +100)"""
         self.current_shot = (0.0, 0.0, 0.0)
         """(v_ball_norm, w_h_norm, w_v_norm)"""
+        self.speed_controller: Union[SpeedController, None] = None
+        """Optional closed-loop speed control, only available if the wheels are equipped with tachometers."""
+        self.ready_callback = None
+        """Optional 1-parameter function, called with the driver when its wheels reached the target speeds (speed control only).
+           The check cannot be polled from a timer callback, since the control loop is a timer itself."""
+        self.dynamics = MotorDynamics(len(self.motors))
+        """Response model of the motors, used to predict the spin-up time between shots."""
 
     def update_from_shot(self, shot: Shot) -> None:
         """
@@ -58,17 +80,33 @@ class BallDriver():
         """
         if self.debug:
             print(f"update_from_shot({shot})")
-        if shot.MotorSettings is None:
-            self.update_current_shot(shot.BallSpeed, shot.Topspin, shot.Sidespin) 
-            # this calculated the motor speeds, so let's store them in the Shot object
-            shot.MotorSettings = self.motor_speeds
-        else:
-            self.current_shot = (float(shot.BallSpeed), float(shot.Topspin), float(shot.Sidespin))
-            self.motor_speeds = shot.MotorSettings
+        speeds = shot.MotorSettings
+        if speeds is not None and shot.MotorSettingsVersion == self.geometry_version and len(speeds) == len(self.motors):
+            # calculated before with the current geometry: neither calculation nor cache lookup needed
+            self.current_shot = (shot.BallSpeed, shot.Topspin, shot.Sidespin)
+            self.motor_speeds = speeds
             if self._status == 1: # only set speeds if the driver is active
-                self._set_motor_speeds(self.motor_speeds)
+                self._set_motor_speeds(speeds)
+            return
+        self.update_current_shot(shot.BallSpeed, shot.Topspin, shot.Sidespin)
+        shot.MotorSettings = self.motor_speeds
+        shot.MotorSettingsVersion = self.geometry_version
 
 
+    def apply_motor_speeds(self, pwm_table, offset: int) -> None:
+        """
+        Applies precalculated motor speeds from a table (e.g. of a CompiledShotCycle) without any calculation or allocation.
+        Parameters:
+        pwm_table: array with motor speeds in % (-100 to +100)
+        offset: index of the speed for the first motor of this driver in pwm_table
+        """
+        speeds = self._compiled_speeds
+        for i in range(len(speeds)):
+            speeds[i] = pwm_table[offset + i]
+        self.motor_speeds = speeds
+        if self._status == 1: # only set speeds if the driver is active
+            self._set_motor_speeds(speeds)
+
     def update_current_shot(self, v_ball_norm: Union[float, None]=None, w_h_norm: Union[float, None]=None, w_v_norm: Union[float, None]=None) -> None:
         """
         Updates  the specified components of the current shot and applies them directly if the motors are currently active.
@@ -87,11 +125,24 @@ class BallDriver():
         if w_v_norm is None:
             w_v_norm = self.current_shot[2]
         self.current_shot = (v_ball_norm, w_h_norm, w_v_norm)
-        self.motor_speeds = self._calc_motor_speeds(float(v_ball_norm), float(w_h_norm), float(w_v_norm))
+        self.motor_speeds = self.get_motor_speeds(v_ball_norm, w_h_norm, w_v_norm)
         if self._status == 1: # only set speeds if the driver is active
             self._set_motor_speeds(self.motor_speeds)
 
 
+    def get_motor_speeds(self, v_ball_norm: float, w_h_norm: float, w_v_norm: float) -> List[int]:
+        """
+        Returns the motor speeds for the specified ball parameters, taking them from the cache if the shot has been calculated before.
+        The returned list is shared with the cache and must not be modified!
+        It DOES NOT have any impact on the motors or the current state of the ball driver.
+        """
+        key = self._settings_cache.key(v_ball_norm, w_h_norm, w_v_norm)
+        speeds = self._settings_cache.get(key)
+        if speeds is None:
+            speeds = self._calc_motor_speeds(float(v_ball_norm), float(w_h_norm), float(w_v_norm))
+            self._settings_cache.put(key, speeds)
+        return speeds
+
     def _calc_motor_speeds(self, v_ball_norm = 0.75, w_h_norm = 0.0, w_v_norm = 0.0) -> List[int]:
         """
         Calculates and returns the motor speeds for the specified ball parameters.  
@@ -123,50 +174,14 @@ class BallDriver():
         elif w_v_norm < -1.0:
             w_v_norm = -1.0
         
-        if len(self.motors) != 2:
-            raise NotImplementedError(f"Having {len(self.motors)} motors is currently not supported!")
+        if len(self.motors) != len(self.motor_angles):
+            raise ConfigurationException(f"BallDriver #{self.bd_number}: {len(self.motors)} motors configured, but {len(self.motor_angles)} motor angles!")
 
-        # Due to restriction on two motors (up and down), a simplified calculation is possible
-        # and sidespin is completely neglected.
-        eff_top = [math.cos(a/180.0*math.pi) for a in self.motor_angles]
-        if self.debug:
-            print(f"{self.motor_angles=}")
-            print(f"{eff_top=}")
-        # default to requested ball speed
-        speeds = [v_ball_norm for _ in self.motors]
-        if self.debug:
-            print(f"after speed init: {speeds=}")
-        # calculate motor1 speed dependent on requested horiz. speed and motor0 speed 
-        speeds[1] = (sum([abs(e) for e in eff_top]) * w_h_norm - eff_top[0] * speeds[0])/eff_top[1]
-        if self.debug:
-            print(f"after rotation calc: {speeds=}")
-        # ensure requested ball speed (keeping the absolute rotation)
-        avg = sum(speeds)/len(speeds) 
-        delta = v_ball_norm - avg
-        for i in range(len(speeds)):
-            speeds[i] = speeds[i] + delta
-        if self.debug:
-            print(f"after ball speed calc: {speeds=}")
-        # normalize to top speed (=1)
-        # this linear scaling changes rotation and speed, but might be the best compromise
-        max_spd = max(speeds)
-        if max_spd > 1.0:
-            for i in range(len(speeds)):
-                speeds[i] = speeds[i]/max_spd
-        if self.debug:
-            print(f"after max speed calc: {speeds=}")
-        # normalize to min speed (=-1)
-        # this linear scaling changes rotation and speed, but might be the best compromise
-        max_spd = -min(speeds)
-        if max_spd > 1.0:
-            for i in range(len(speeds)):
-                speeds[i] = speeds[i]/max_spd
-        if self.debug:
-            print(f"after min speed calc: {speeds=}")
-        
-        # convert to percentage
-        speeds = [int(s * 100.0) for s in speeds]
+        # the geometry has been solved already when it was configured, so this is only a matrix-vector product (in fixed-point)
+        self._solver.solve_fixed(self._speed_buf, int(v_ball_norm * 1000), int(w_h_norm * 1000), int(w_v_norm * 1000))
+        speeds = list(self._speed_buf)
         if self.debug:
+            print(f"{self.motor_angles=}, {self._solver.controllable=}")
             print(f"after percentage conversion: {speeds=}")
 
         self.current_shot = (v_ball_norm, w_h_norm, w_v_norm)
@@ -174,30 +189,6 @@ class BallDriver():
             print(f"current shot updated to: {self.current_shot}")
         return speeds
 
-        # self.v_ball = v_ball_norm * self.v_ball_max # m/s
-        # self.w_h = w_h_norm * self.w_h_max * 2 * math.pi # arc/s
-        # self.w_v = w_v_norm * self.w_v_max * 2 * math.pi # arc/s
-
-        # print(f"requested ball speed: {self.v_ball} m/s")
-        # print(f"requested topspin: {self.w_h / 2 / math.pi} 1/s")
-        # print(f"requested sidespin: {self.w_v / 2 / math.pi} 1/s")
-
-        # # Calculate the surface speeds
-        # v = [0.0, 0.0, 0.0]
-        # v[2] = self.v_ball - 1/3*self.r_ball*self.w_h - math.sqrt(3)/6*self.r_ball*self.w_v
-        # v[1] = math.sqrt(3)/2*self.r_ball*self.w_v + v[2]
-        # v[0] = self.r_ball*self.w_h + (v[1]+v[2])/2
-
-        # for i in range(len(self.motorSpeeds)):
-        #     print(f"surface speed {i}: {v[i]} m/s")
-
-        # # Calculate motor speeds
-        # for i in range(len(self.motorSpeeds)):
-        #     self.motorSpeeds[i] = v[i] / (self.d_wheel[i] * math.pi)
-        #     print(f"motor speed {i}: {self.motorSpeeds[i]} 1/s")
-
-        # for i in range(len(self.motors)):
-        #     self.motors[i].SetSpeed(self.motorSpeeds[i])
 
     def _set_motor_speeds(self, motor_speeds: List[int]) -> None:
         """
@@ -211,17 +202,21 @@ class BallDriver():
             print(f"set_motor_speeds({motor_speeds=})")
         if self._status == 0:
             raise InputDataException("BallDriver is not started! Please call start() before setting motor speeds.")
-        if len(motor_speeds) != len(self.motor_speeds):
+        if len(motor_speeds) != len(self.motors):
             raise InputDataException("Invalid number of values in motor_speeds!")
+        # the list may be shared with the settings cache, so it is only referenced and never modified
+        self.motor_speeds = motor_speeds
         i = 0
         for spd in motor_speeds:
             if self.debug:
                 print(f"motor speed {i}: {spd} %")
-            self.motor_speeds[i] = spd
             # only set the actual speed if the driver is active
-            if self.status == 1:
+            if self.status == 1 and self.speed_controller is None:
                 self.motors[i].set_speed(spd)
             i += 1
+        if self.status == 1 and self.speed_controller is not None:
+            # the speed controller takes care of the PWM settings
+            self.speed_controller.set_targets(self.motor_speeds)
 
     def start(self):
         """This will start motor operation with the last configured motor speeds.
@@ -229,10 +224,52 @@ class BallDriver():
         """
         self.status = 1 # started
 
+    def start_motor(self, motor_index: int):
+        """Starts a single motor with its configured speed, so that the inrush currents of the motors can be staggered (see PowerSequencer).
+           The driver counts as started with its first motor, the others keep still until they are started or new speeds are set.
+           With speed control, the controller drives all motors together, so the whole driver is started.
+        """
+        if self.speed_controller is not None:
+            if self._status == 0:
+                self.start()
+            return
+        self._status = 1
+        self.motors[motor_index].set_speed(self.motor_speeds[motor_index])
+
     def stop(self):
         """This will halt motor operation without changing the configured motor speeds."""
         self.status = 0 # halted
 
+    @property
+    def motor_angles(self) -> List[float]:
+        """Orientation of the connected motors (by index), see constructor."""
+        return self._motor_angles
+    @motor_angles.setter
+    def motor_angles(self, value: List[float]):
+        self._motor_angles = [a for a in value if a is not None]
+        self._update_geometry()
+
+    @property
+    def wheel_diameters(self) -> List[float]:
+        """Wheel diameters in m (by motor index)."""
+        return self._wheel_diameters
+    @wheel_diameters.setter
+    def wheel_diameters(self, value: List[float]):
+        self._wheel_diameters = [float(d) for d in value]
+        self._update_geometry()
+
+    def _update_geometry(self):
+        """Solves the wheel geometry once, so that shots only need a matrix-vector product."""
+        diameters = self._wheel_diameters if len(self._wheel_diameters) == len(self._motor_angles) else None
+        if self._solver is None:
+            self._solver = MotorSpeedSolver(self._motor_angles, diameters)
+        else:
+            self._solver.update_geometry(self._motor_angles, diameters)
+        self._settings_cache.invalidate()
+        self.geometry_version += 1
+        if self.debug:
+            print(f"BallDriver #{self.bd_number}: geometry updated to {self._solver.getConfigData()}")
+
     @property
     def status(self) -> int:
         return self._status
@@ -240,12 +277,124 @@ class BallDriver():
     def status(self, value: int):
         if value == 0:
             self._status = 0
+            if self.speed_controller:
+                self.speed_controller.stop()
             for motor in self.motors:
                 motor.stop()
         else:
             self._status = 1
             self._set_motor_speeds(self.motor_speeds)
+            if self.speed_controller:
+                self.speed_controller.start()
 
+    def is_ready(self) -> bool:
+        """Returns True if the wheels run at the speeds of the current shot, i.e. the next ball can be released.
+           Without closed-loop speed control this cannot be measured, so the driver is always considered ready.
+        """
+        if self.speed_controller is None:
+            return True
+        return self.speed_controller.is_ready()
+
+    def _speed_ready(self) -> None:
+        if self.ready_callback is not None:
+            self.ready_callback(self)
+
+    def configure_speed_control(self, data: Union[dict, None]) -> None:
+        """Sets up closed-loop speed control from a serialized config, or disables it if data is None or not enabled.
+           The config requires one tachometer per motor and the wheel speed (rpm) each motor reaches at 100%.
+        """
+        if self.speed_controller:
+            self.speed_controller.stop()
+            for tacho in self.speed_controller.tachometers:
+                tacho.stop()
+            self.speed_controller = None
+        if not data or not data.get('enabled', True):
+            return
+        tacho_cfgs = data.get('tachometers', [])
+        max_rpm = data.get('max_rpm', [])
+        if len(tacho_cfgs) != len(self.motors) or len(max_rpm) != len(self.motors):
+            raise ConfigurationException(f"BallDriver #{self.bd_number}: speed control requires one tachometer and one max_rpm value per motor ({len(self.motors)}).")
+        tachometers = []
+        for cfg in tacho_cfgs:
+            tachometers.append(Tachometer(
+                input_pin=int(cfg['input_pin']),
+                pulses_per_rev=int(cfg.get('pulses_per_rev', 1)),
+                pio_block_index=int(cfg.get('pio_block_index', 0)),
+                sm_index=int(cfg.get('sm_index', 3)),
+                debug=self.debug))
+        self.speed_controller = SpeedController(
+            self.motors, tachometers, max_rpm,
+            kp=float(data.get('kp', 0.02)),
+            ki=float(data.get('ki', 0.05)),
+            tick_ms=int(data.get('tick_ms', 50)),
+            tolerance_pct=float(data.get('tolerance_pct', 5.0)),
+            settle_ticks=int(data.get('settle_ticks', 3)),
+            window_ticks=int(data.get('window_ticks', 6)),
+            debug=self.debug)
+        self.speed_controller.ready_callback = self._speed_ready
+        if self._status == 1:
+            self.speed_controller.set_targets(self.motor_speeds)
+            self.speed_controller.start()
+
+    def calibrate_dynamics(self, speed_pct: int = 80, duration_ms: int = 3000) -> dict:
+        """Identifies the time constants of all motors from a step response (up to speed_pct and back to 0).
+           Requires tachometers (speed control config), the control loop is suspended during the calibration run.
+           The driver must be stopped, as the motors are driven directly. Returns the new dynamics config.
+        """
+        if self.speed_controller is None:
+            raise ConfigurationException(f"BallDriver #{self.bd_number}: calibrating the motor dynamics requires tachometers (speed control).")
+        if self._status != 0:
+            raise InvalidOperationException(f"BallDriver #{self.bd_number} must be stopped for calibration.")
+        tick_ms = self.speed_controller.tick_ms
+        tau_up = []
+        tau_down = []
+        for target in (speed_pct, 0):
+            times, rpms = self._record_step_response(target, duration_ms, tick_ms)
+            for i in range(len(self.motors)):
+                tau = identify_time_constant(times, rpms[i])
+                (tau_up if target != 0 else tau_down).append(tau)
+        for motor in self.motors:
+            motor.stop()
+        self.dynamics.setConfigData({'tau_up_ms': tau_up, 'tau_down_ms': tau_down})
+        self.geometry_version += 1 # compiled programs must re-check their pauses
+        if self.debug:
+            print(f"BallDriver #{self.bd_number}: motor dynamics calibrated to {self.dynamics.getConfigData()}")
+        return self.dynamics.getConfigData()
+
+    def _record_step_response(self, speed_pct: int, duration_ms: int, tick_ms: int):
+        """Sets all motors to speed_pct at once and samples their speeds (rpm) every tick_ms.
+           A single tick holds only a few sensor pulses, so each speed is taken from the pulses of a window centered
+           on its sample (as wide as the measuring window of the speed controller), which does not delay the response.
+           The recording starts half a window before the step, so the first sample is the previous steady state.
+        """
+        tachos = self.speed_controller.tachometers
+        half = max(self.speed_controller.window_ticks // 2, 1)
+        first = [t.count() for t in tachos]
+        times = [0]
+        counts = [[0] for _ in tachos]
+        t0 = time.ticks_ms()
+        while len(times) <= half or times[-1] - times[half] < duration_ms:
+            time.sleep_ms(tick_ms)
+            if len(times) == half:
+                for motor in self.motors:
+                    motor.set_speed(speed_pct)
+            times.append(time.ticks_diff(time.ticks_ms(), t0))
+            for i in range(len(tachos)):
+                counts[i].append((tachos[i].count() - first[i]) & 0xFFFFFFFF)
+        n = len(times)
+        rpms = []
+        for i in range(len(tachos)):
+            r = []
+            # the first sample is the steady state before the step, the others only use pulses after the step
+            r.append((counts[i][half] - counts[i][0]) * 60000.0 / tachos[i].pulses_per_rev / times[half] if times[half] > 0 else 0.0)
+            for k in range(half + 1, n):
+                a = max(k - half, half)
+                b = min(k + half, n - 1)
+                dt = times[b] - times[a]
+                r.append((counts[i][b] - counts[i][a]) * 60000.0 / tachos[i].pulses_per_rev / dt if dt > 0 else 0.0)
+            rpms.append(r)
+        times = [t - times[half] for t in times[half:]]
+        return times, rpms
 
     def getStatusData(self) -> dict:
         ret = {
@@ -253,7 +402,11 @@ class BallDriver():
             'bd_number': self.bd_number,
             'current_shot': {'velocity': self.current_shot[0], 'topspin': self.current_shot[1], 'sidespin': self.current_shot[2]},
             'motor_speeds': self.motor_speeds,
+            'ready': self.is_ready(),
+            'settings_cache': self._settings_cache.getStatusData(),
         }
+        if self.speed_controller:
+            ret['speed_control'] = self.speed_controller.getStatusData()
         return ret
 
     def getConfigData(self) -> dict:
@@ -266,6 +419,9 @@ class BallDriver():
         ret['motor_angles'] = self.motor_angles
         ret['wheel_diameters'] = self.wheel_diameters
         ret['motor_driver'] = self.motorDriver.getConfigData()
+        if self.speed_controller:
+            ret['speed_control'] = self.speed_controller.getConfigData()
+        ret['dynamics'] = self.dynamics.getConfigData()
         return ret
 
     def setConfigData(self, data) -> dict:
@@ -290,6 +446,13 @@ class BallDriver():
             motors.append(motor)
         self.motors = motors
         self.motor_speeds = [0 for _ in self.motors]
+        self._settings_cache.invalidate()
+        self.geometry_version += 1
+        self._compiled_speeds = [0 for _ in self.motors]
+        self._speed_buf = array('h', [0] * len(self.motors))
+        self.configure_speed_control(data.get('speed_control'))
+        self.dynamics = MotorDynamics(len(self.motors))
+        self.dynamics.setConfigData(data.get('dynamics', {}))
         return self.getConfigData()
 
 if __name__ == "__main__":
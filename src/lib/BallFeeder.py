@@ -1,9 +1,15 @@
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import Union
+import time
+from machine import Timer
 from StepMotorPIO import StepMotorPIO, MODE_COUNTED
 from RobbyExceptions import InvalidOperationException
+import BallSensor
 
 class BallFeeder:
     """BallFeeder is responsible for dispensing singel balls controlling one or more motors."""
-    def __init__(self, motor, bf_index: int, action_cycle: list = [-77], mounting_index: int = 0, debug=False) -> None:
+    def __init__(self, motor, bf_index: int, action_cycle: list = [-77], mounting_index: int = 0, commit_index: int = 0, ball_driver: int = -1, debug=False) -> None:
         """Initialize the BallFeeder with a motor and a push cycle.  
         Args:
             motor (StepMotorPIO): The motor to be used for dispensing balls.
@@ -12,36 +18,159 @@ class BallFeeder:
                                These steps can represent angles, number of steps to rotate a stepmotor or even pause times.
                                The actual interpretation depends on the motor type.
             mounting_index (int): The index in the action cycle where the motor is meant to be when mounted.
+            commit_index (int): The index of the action in the action cycle after which the ball is committed to the driver,
+                               i.e. the remaining actions (return stroke) do not affect the ball anymore.
+            ball_driver (int): The index of the ball driver this feeder feeds, -1 for the driver with the same index as the feeder.
             debug (bool): If True, enables debug mode.
         """
         if mounting_index < 0 or mounting_index >= len(action_cycle):
             raise ValueError(f"Mounting index {mounting_index} is out of bounds for action cycle of length {len(action_cycle)}.")
+        if commit_index < 0 or commit_index >= len(action_cycle):
+            raise ValueError(f"Commit index {commit_index} is out of bounds for action cycle of length {len(action_cycle)}.")
         self.debug = debug
         self.bf_index = bf_index
+        self.ball_driver = ball_driver if ball_driver >= 0 else bf_index
+        """index of the ball driver this feeder feeds (several feeders can feed the same driver, see FeederScheduler)"""
         self.motors = [motor]
-        self.motor_states = [[-1, action_cycle, mounting_index]]
+        self.controller_callback = None
+        self.committed_callback = None
+        self.motor_states = [[-1, action_cycle, mounting_index, commit_index]]
         """list containing additional data per motor:
-           - action cycle: e.g. a list of angles to rotate
            - current index: the current index in the action cycle, -1 if no action is running
+           - action cycle: e.g. a list of angles to rotate
            - mounting position: the index in the action cycle, where the motor is meant to be when mounted.
              This is used to move the motor accordingly into parking position after it has been mounted.
+           - commit index: the index in the action cycle, after which the ball has left the feeder.
         """
+        self._commit_waiting = 0
+        """number of motors, which have not yet passed their commit index in the running dispense operation"""
+        self._dispense_t0 = 0
+        self.last_commit_ms = -1
+        """time from the start of the last dispense operation until the ball was committed"""
+        self.last_cycle_ms = -1
+        """duration of the last complete dispense operation"""
+        self.cycle_duration: Union[float, None] = None
+        """duration in seconds the feeder needs for one reliable cycle, None for the controller's default (see FeederTuner)"""
+        self.release_duration: Union[float, None] = None
+        """duration in seconds from the start of a cycle until the ball is committed, None for the controller's default"""
+        self.ball_sensor: Union[BallSensor.BallSensor, None] = None
+        """optional light barriers: if set, a dispense operation is only complete when the ball has passed the outlet"""
+        self.max_retries = 2
+        """number of additional cycles performed, if the ball sensor did not detect a ball"""
+        self.ball_timeout_ms = 500
+        """time to wait for the ball sensor after the end of a cycle"""
+        self.miss_callback = None
+        """function(feeder, final), called if no ball was detected: before a retry (final=False) or when giving up (final=True)"""
+        self.misses = 0
+        self.retries = 0
+        self._dispensing = False
+        self._retries_left = 0
+        self._ball_seen = False
+        self._awaiting_ball = False
+        self._ball_timer = None
 
-    def dispense(self, controller_callback=None):
-        """Dispense a ball by performing the predefined action with the motor."""
+    def dispense(self, controller_callback=None, committed_callback=None):
+        """Dispense a ball by performing the predefined action with the motor.
+           The action cycle is performed in two phases: up to the commit index (release and push) and the rest (return).
+           committed_callback is called as soon as the ball is committed to the driver, while the return stroke is still running,
+           controller_callback when the whole cycle is finished.
+        """
         if self.is_busy():
             raise InvalidOperationException("Ball Feeder should dispense, but is not finished with previous operation.")
         if self.debug:
             print(f"Ball Feeder releasing next ball.")
         
-        self.current_ballfeeder_cycle_index = 0
         self.controller_callback = controller_callback
+        self.committed_callback = committed_callback
+        self._dispensing = True
+        self._ball_seen = False
+        self._retries_left = self.max_retries
+        self._start_cycle()
+
+    def _start_cycle(self) -> None:
+        self.current_ballfeeder_cycle_index = 0
+        self._commit_waiting = len(self.motors)
+        self._dispense_t0 = time.ticks_ms()
         for m in range(len(self.motors)):
             mot = self.motors[m]
             mot_states = self.motor_states[m]
             mot_states[0] = current_action_index = 0
             action_cycle = mot_states[1]
-            mot.rotate_by_angle(angle=action_cycle[current_action_index], op_complete_callback=self._ball_feeder_next_step)
+            if hasattr(mot, 'rotate_segments'):
+                # the strokes of a phase are queued at once, so there is no dead time between them
+                self._rotate_remaining_cycle(m, current_action_index, mot_states[3])
+            else:
+                mot.rotate_by_angle(angle=action_cycle[current_action_index], op_complete_callback=self._ball_feeder_next_step)
+
+    def _rotate_remaining_cycle(self, m: int, start_index: int, end_index: int = -1) -> None:
+        """Queues the action cycle of motor m from start_index to end_index (default: its end) as one multi-segment move."""
+        mot = self.motors[m]
+        cycle = self.motor_states[m][1]
+        if end_index < 0:
+            end_index = len(cycle) - 1
+        self.motor_states[m][0] = end_index # the completion is reported for the last action only
+        segments = [mot.angle_to_steps(angle) for angle in cycle[start_index:end_index + 1]]
+        if not any(segments):
+            # nothing to move, rotate_segments() would not call back
+            self._ball_feeder_next_step(mot)
+            return
+        mot.rotate_segments(segments, op_complete_callback=self._ball_feeder_next_step)
+
+    def _ball_committed(self) -> None:
+        """Called when a motor has passed its commit index. The ball is committed when all motors have."""
+        self._commit_waiting -= 1
+        if self._commit_waiting > 0:
+            return
+        if self.ball_sensor is None:
+            self._emit_committed()
+
+    def _emit_committed(self) -> None:
+        self.last_commit_ms = time.ticks_diff(time.ticks_ms(), self._dispense_t0)
+        if self.debug:
+            print(f"BallFeeder #{self.bf_index}: ball committed after {self.last_commit_ms} ms.")
+        if self.committed_callback is not None:
+            self.committed_callback()
+
+    def _ball_detected(self, channel: int, t_us: int) -> None:
+        """Called by the ball sensor for every ball detected. With a sensor, the ball is committed when it passed the outlet."""
+        if channel != BallSensor.OUTLET or not self._dispensing or self._ball_seen:
+            return
+        self._ball_seen = True
+        self._emit_committed()
+        if self._awaiting_ball:
+            # the cycle has already ended, only the ball was missing
+            self._awaiting_ball = False
+            self._ball_timer.deinit()
+            self._finish_dispense()
+
+    def _ball_timeout(self, timer) -> None:
+        """No ball detected within ball_timeout_ms after the end of the cycle: retry or give up."""
+        if not self._awaiting_ball:
+            return
+        self._awaiting_ball = False
+        self.misses += 1
+        final = self._retries_left <= 0
+        if self.debug:
+            print(f"BallFeeder #{self.bf_index}: no ball detected ({'giving up' if final else 'retrying'}).")
+        if self.miss_callback is not None:
+            self.miss_callback(self, final)
+        if final:
+            # no ball has been committed, but the controller prepares the next shot with the commit
+            if self.committed_callback is not None:
+                self.committed_callback()
+            self._finish_dispense()
+            return
+        self._retries_left -= 1
+        self.retries += 1
+        self._start_cycle()
+
+    def _finish_dispense(self) -> None:
+        self._dispensing = False
+        self.last_cycle_ms = time.ticks_diff(time.ticks_ms(), self._dispense_t0)
+        if self.controller_callback is not None:
+            if self.debug:
+                print(f"BallFeeder #{self.bf_index} finished dispensing. Calling controller callback.")
+            self.controller_callback()
 
     def prepare_after_mount(self) -> None:
         """Move the ball feeder from the mounting position (mount_index) into waiting position.
@@ -56,7 +185,10 @@ class BallFeeder:
             motor = self.motors[m]
             state = self.motor_states[m]
             state[0] = state[2]  # set the current action index to the mounting index
-            self._ball_feeder_next_step(motor)  # this will trigger the next step in the action cycle
+            if hasattr(motor, 'rotate_segments') and state[2] + 1 < len(state[1]):
+                self._rotate_remaining_cycle(m, state[2] + 1)
+            else:
+                self._ball_feeder_next_step(motor)  # this will trigger the next step in the action cycle
 
     def _ball_feeder_next_step(self, mot):
         """Callback function to be called when the motor has completed a step in the action cycle.
@@ -68,27 +200,42 @@ class BallFeeder:
         cycle = self.motor_states[m][1]
         if self.debug:
             print(f"Motor #{m} identified. Current cycle index: {cycle_index}, cycle length: {len(cycle)}")
+        if self._commit_waiting > 0 and cycle_index == self.motor_states[m][3]:
+            self._ball_committed()
         cycle_index += 1
         if cycle_index >= len(cycle):
             # reached end of cycle --> waiting position
             if self.debug:
-                print(f"Action cycle complete. {self.is_busy=}")
+                print(f"Action cycle complete. {self.is_busy()=}")
             self.motor_states[m][0] = -1
+            if self._commit_waiting > 0 and self.motor_states[m][3] >= len(cycle):
+                self._ball_committed() # invalid commit index: the ball is committed with the end of the cycle at the latest
             # Moved to the async handling in run()
             # # set the machine status according to the current operation
             # self._status = self._status_requested
             # if self.debug:
             #     print(f"Machine status = {self._status}")
             #call back the controller if everything is done
-            if not self.is_busy and self.controller_callback is not None:
-                if self.debug:
-                    print(f"BallFeeder #{self.bf_index} finished dispensing. Calling controller callback.")
-                self.controller_callback()
+            if not self.is_busy() and self._dispensing:
+                if self.ball_sensor is not None and not self._ball_seen:
+                    # the completion is driven by the ball passing the outlet
+                    self._awaiting_ball = True
+                    if self._ball_timer is None:
+                        self._ball_timer = Timer()
+                    self._ball_timer.init(mode=Timer.ONE_SHOT, period=self.ball_timeout_ms, callback=self._ball_timeout)
+                    return
+                self._finish_dispense()
+            return
+        if hasattr(mot, 'rotate_segments'):
+            # return stroke: the rest of the cycle in one move
+            self._rotate_remaining_cycle(m, cycle_index)
             return
         self.motor_states[m][0] = cycle_index # update with the new index
         mot.rotate_by_angle(angle=cycle[cycle_index], op_complete_callback=self._ball_feeder_next_step)
 
     def is_busy(self) -> bool:
+        if self._awaiting_ball:
+            return True
         for state in self.motor_states:
             if state[0] >= 0:
                 return True
@@ -104,6 +251,10 @@ class BallFeeder:
 
     def stop(self):
         """Will bring the motors to an immediate halt. Will not reset motor states."""
+        if self._awaiting_ball:
+            self._awaiting_ball = False
+            self._ball_timer.deinit()
+            self._dispensing = False
         i = 0
         for m in self.motors:
             try:
@@ -115,17 +266,58 @@ class BallFeeder:
     def getConfigData(self):
         config = {
             'bf_index': self.bf_index,
+            'ball_driver': self.ball_driver,
             'motors': [mot.getConfigData() for mot in self.motors],
             'motor_states': [ 
-                {'action_cycle': s[1], 'mounting_index': s[2]} for s in self.motor_states
+                {'action_cycle': s[1], 'mounting_index': s[2], 'commit_index': s[3]} for s in self.motor_states
                 ],
+            'cycle_duration': self.cycle_duration,
+            'release_duration': self.release_duration,
+            'ball_sensor': self.ball_sensor.getConfigData() if self.ball_sensor else None,
+            'max_retries': self.max_retries,
+            'ball_timeout_ms': self.ball_timeout_ms,
             }
         return config
     
+    def get_cycle_progress(self) -> list:
+        """Returns the live progress of the running action cycle per motor as (steps done, total steps).
+           The controller can use this to start the next action as soon as the critical part of a stroke has passed.
+           Motors without position readback report (0, 0).
+        """
+        return [mot.get_move_progress() if hasattr(mot, 'get_move_progress') else (0, 0) for mot in self.motors]
+
+    def estimate_cycle_ms(self) -> Union[int, None]:
+        """Theoretical duration of a complete dispense operation in ms, i.e. the limit of the ball cadence of this feeder.
+           None if none of the motors can estimate its moves.
+        """
+        ret = None
+        for m in range(len(self.motors)):
+            mot = self.motors[m]
+            if not hasattr(mot, 'estimate_move_ms'):
+                continue
+            ms = mot.estimate_move_ms([mot.angle_to_steps(angle) for angle in self.motor_states[m][1]])
+            if ret is None or ms > ret:
+                ret = ms
+        return ret
+
     def getStatusData(self):
+        progress = self.get_cycle_progress()
         status = {
             'is_busy': self.is_busy(),
-            'motor_states': [ {'current_action_index': s[0], 'total_actions': len(s[1])} for s in self.motor_states],
+            'motor_states': [ {'current_action_index': s[0], 'total_actions': len(s[1]), 'commit_index': s[3]} for s in self.motor_states],
+            'last_commit_ms': self.last_commit_ms,
+            'last_cycle_ms': self.last_cycle_ms,
+            'estimated_cycle_ms': self.estimate_cycle_ms(),
+            'awaiting_ball': self._awaiting_ball,
+            'misses': self.misses,
+            'retries': self.retries,
+            'ball_sensor': self.ball_sensor.getStatusData() if self.ball_sensor else None,
+            'motor_positions': [
+                {
+                    'position_steps': mot.read_position_steps() if hasattr(mot, 'read_position_steps') else None,
+                    'move_steps_done': progress[i][0],
+                    'move_steps_total': progress[i][1],
+                } for i, mot in enumerate(self.motors)],
             }
         return status
     
@@ -133,7 +325,9 @@ class BallFeeder:
         """Adopts all settings from a serialized config. Existing settings will be overwritten."""
 
         self.motors = []
-        self.bf_index = data.get('bf_index', 0)
+        self.bf_index = data.get('bf_index', self.bf_index)
+        tmp = data.get('ball_driver')
+        self.ball_driver = int(tmp) if tmp is not None else self.bf_index
         for mot_cfg in data.get('motors', []):
             # if mot['type'] == 'Sg92r':
             #     raise NotImplementedError("The SetConfigData() method is not implemented for the Sg92r class.")
@@ -150,8 +344,25 @@ class BallFeeder:
             self.motor_states.append([
                 -1,  # current action index
                 state_cfg.get('action_cycle', []),  # action cycle
-                state_cfg.get('mounting_index', -1)  # mounting index
+                state_cfg.get('mounting_index', -1),  # mounting index
+                state_cfg.get('commit_index', 0)  # commit index
             ])
+        tmp = data.get('cycle_duration')
+        self.cycle_duration = float(tmp) if tmp else None
+        tmp = data.get('release_duration')
+        self.release_duration = float(tmp) if tmp else None
+        tmp = data.get('max_retries')
+        if tmp is not None:
+            self.max_retries = int(tmp)
+        tmp = data.get('ball_timeout_ms')
+        if tmp is not None:
+            self.ball_timeout_ms = int(tmp)
+        if self.ball_sensor is not None:
+            self.ball_sensor.stop()
+            self.ball_sensor = None
+        tmp = data.get('ball_sensor')
+        if tmp:
+            self.ball_sensor = BallSensor.create_from_config(tmp, on_ball=self._ball_detected, debug=self.debug)
 
         if self.debug:
             print(f"BallFeeder initialized with data: {data}")
@@ -0,0 +1,238 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List, Union
+from array import array
+import time
+try:
+    from machine import Pin
+except ImportError:
+    Pin = None # host environment: the GpioStandIn is used instead
+from IrqEventQueue import event_queue
+
+OUTLET = 0
+"""channel of the light barrier at the feeder outlet"""
+ENTRY = 1
+"""channel of the light barrier at the driver entry"""
+CHANNEL_NAMES = ('outlet', 'entry')
+DEFAULT_CAPACITY = 32
+
+if hasattr(time, 'ticks_us'):
+    _ticks_us = time.ticks_us
+    _ticks_diff = time.ticks_diff
+else:
+    _ticks_us = lambda: int(time.time() * 1000000) & 0x3fffffff
+    _ticks_diff = lambda a, b: a - b
+
+# Installation instructions for the light barriers
+# - Mount a light barrier (e.g. IR LED and phototransistor or a slotted sensor) at the feeder outlet, so that each
+#   dispensed ball interrupts the beam. A second one at the entry of the ball driver is optional.
+# - Connect the open collector outputs to free GP-pins on the pico (outlet_pin, entry_pin), the internal pull-up is enabled.
+#   With active_low, an interrupted beam pulls the input low, i.e. the falling edge marks a ball.
+class BallSensor:
+    """Detects the balls passing the light barriers of a ball feeder.
+       The edges are captured by Pin.irq: the hard irq handler only stores the timestamp and the channel in a preallocated
+       ring buffer and posts the event to the IrqEventQueue. Counting, the transit time (outlet to driver entry) and
+       the callback are handled there, outside of the interrupt.
+    """
+    def __init__(self, outlet_pin: int, entry_pin: int = -1, active_low: bool = True, debounce_us: int = 3000,
+                 capacity: int = DEFAULT_CAPACITY, on_ball=None, debug=False) -> None:
+        """Parameters:
+           outlet_pin:  GP-pin of the light barrier at the feeder outlet.
+           entry_pin:   GP-pin of the light barrier at the driver entry, -1 if there is none.
+           active_low:  True if an interrupted beam results in low level.
+           debounce_us: edges within this time after the previous one of the same channel are ignored.
+           capacity:    size of the edge buffer, i.e. the max. number of edges not yet processed.
+           on_ball:     function(channel, timestamp_us), called for every ball detected (outside of the interrupt).
+        """
+        self.debug = debug
+        self.outlet_pin = outlet_pin
+        self.entry_pin = entry_pin
+        self.active_low = active_low
+        self.debounce_us = debounce_us
+        self.capacity = capacity
+        self.on_ball = on_ball
+        self._stamps = array('I', [0] * capacity)
+        self._channels = array('B', bytes(capacity))
+        self._head = 0
+        self._last_edge = array('I', [0, 0])
+        """timestamp of the last accepted edge per channel, for debouncing"""
+        self._counts = array('I', [0, 0])
+        """balls counted per channel (in the irq, so they are up to date even if the event queue lags)"""
+        self._ball_passed_ref = self._ball_passed
+        self._irq_refs = (self._outlet_irq, self._entry_irq)
+        """bound methods created once, since the irq handlers must not allocate"""
+        self._pins = []
+        self.reset_stats()
+        self.adopt_config()
+
+    def adopt_config(self) -> None:
+        """(Re)installs the irq handlers for the configured pins."""
+        self.stop()
+        self._pins = []
+        for channel, pin_number in ((OUTLET, self.outlet_pin), (ENTRY, self.entry_pin)):
+            if pin_number < 0:
+                continue
+            pin = Pin(pin_number, Pin.IN, Pin.PULL_UP) if Pin else GpioStandIn(pin_number)
+            trigger = pin.IRQ_FALLING if self.active_low else pin.IRQ_RISING
+            pin.irq(self._irq_refs[channel], trigger, hard=True)
+            self._pins.append(pin)
+        if self.debug:
+            print(f"BallSensor: light barriers on GP{self.outlet_pin} (outlet) and GP{self.entry_pin} (entry).")
+
+    def stop(self) -> None:
+        """Removes the irq handlers."""
+        for pin in self._pins:
+            pin.irq(None)
+        self._pins = []
+
+    def reset_stats(self) -> None:
+        self.overflows = 0
+        """edges which were not processed, because the event queue was full"""
+        self.transits = 0
+        self.transit_sum_us = 0
+        self.transit_min_us = 0
+        self.transit_max_us = 0
+        self.unmatched = 0
+        """balls detected at the outlet, but not at the entry (before the next ball left the outlet)"""
+        self._pending_outlet = -1
+        """timestamp of the last ball at the outlet, which has not yet been seen at the entry"""
+
+    def _outlet_irq(self, pin) -> None:
+        self._record(OUTLET)
+
+    def _entry_irq(self, pin) -> None:
+        self._record(ENTRY)
+
+    def _record(self, channel: int) -> None:
+        """Runs in the irq: stores the edge and defers its handling. No memory is allocated here."""
+        t = _ticks_us()
+        if self._counts[channel] and _ticks_diff(t, self._last_edge[channel]) < self.debounce_us:
+            return
+        self._last_edge[channel] = t
+        self._counts[channel] += 1
+        head = self._head
+        self._stamps[head] = t
+        self._channels[head] = channel
+        self._head = (head + 1) % self.capacity
+        if not event_queue.post(self._ball_passed_ref, head):
+            self.overflows += 1
+
+    def _ball_passed(self, index: int) -> None:
+        """Handles an edge recorded by the irq (called by the event queue)."""
+        channel = self._channels[index]
+        t = self._stamps[index]
+        if channel == OUTLET:
+            if self._pending_outlet >= 0 and self.entry_pin >= 0:
+                self.unmatched += 1
+            self._pending_outlet = t
+        elif self._pending_outlet >= 0:
+            transit = _ticks_diff(t, self._pending_outlet)
+            self._pending_outlet = -1
+            if self.transits == 0 or transit < self.transit_min_us:
+                self.transit_min_us = transit
+            if transit > self.transit_max_us:
+                self.transit_max_us = transit
+            self.transits += 1
+            self.transit_sum_us += transit
+        if self.debug:
+            print(f"BallSensor: ball at the {CHANNEL_NAMES[channel]} ({t} us).")
+        if self.on_ball is not None:
+            self.on_ball(channel, t)
+
+    def count(self, channel: int = OUTLET) -> int:
+        """Returns the number of balls detected so far at the channel (the outlet by default)."""
+        return self._counts[channel]
+
+    def getConfigData(self) -> dict:
+        return {
+            'outlet_pin': self.outlet_pin,
+            'entry_pin': self.entry_pin,
+            'active_low': self.active_low,
+            'debounce_us': self.debounce_us,
+        }
+
+    def getStatusData(self) -> dict:
+        n = self.transits
+        return {
+            'outlet_count': self._counts[OUTLET],
+            'entry_count': self._counts[ENTRY],
+            'transits': n,
+            'transit_avg_us': self.transit_sum_us // n if n else None,
+            'transit_min_us': self.transit_min_us if n else None,
+            'transit_max_us': self.transit_max_us if n else None,
+            'unmatched': self.unmatched,
+            'overflows': self.overflows,
+        }
+
+def create_from_config(data: dict, on_ball=None, debug=False) -> BallSensor:
+    return BallSensor(outlet_pin=int(data['outlet_pin']),
+                      entry_pin=int(data.get('entry_pin', -1)),
+                      active_low=bool(data.get('active_low', True)),
+                      debounce_us=int(data.get('debounce_us', 3000)),
+                      on_ball=on_ball, debug=debug)
+
+class GpioStandIn:
+    """Host-side stand-in for a machine.Pin with a light barrier connected, e.g. for testing the ball detection without hardware.
+       pass_ball() emulates a ball interrupting the beam, which triggers the irq handler like the real input would.
+    """
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, pin_number: int, active_low: bool = True) -> None:
+        self.pin_number = pin_number
+        self.active_low = active_low
+        self._value = 1 if active_low else 0
+        self._handler = None
+        self._trigger = 0
+
+    def irq(self, handler=None, trigger=IRQ_FALLING, hard=False) -> None:
+        self._handler = handler
+        self._trigger = trigger
+
+    def value(self) -> int:
+        return self._value
+
+    def _set(self, value: int) -> None:
+        if value == self._value:
+            return
+        self._value = value
+        edge = self.IRQ_RISING if value else self.IRQ_FALLING
+        if self._handler is not None and self._trigger & edge:
+            self._handler(self)
+
+    def pass_ball(self) -> None:
+        """Interrupts and releases the beam once."""
+        self._set(0 if self.active_low else 1)
+        self._set(1 if self.active_low else 0)
+
+def run_sensor_test(balls: int = 5, transit_ms: int = 20) -> bool:
+    """Host test of the ball detection with the GpioStandIn: counting, debouncing, transit times and missing balls."""
+    detected = []
+    sensor = BallSensor(outlet_pin=20, entry_pin=21, debounce_us=1000, on_ball=lambda c, t: detected.append(c))
+    if Pin:
+        print("run_sensor_test() must be run on the host, where the GpioStandIn is used.")
+        return False
+    outlet, entry = sensor._pins
+    ok = True
+    for _ in range(balls):
+        outlet.pass_ball()
+        outlet.pass_ball() # bouncing within the debounce time
+        time.sleep(transit_ms / 1000)
+        entry.pass_ball()
+        time.sleep(0.002)
+    status = sensor.getStatusData()
+    print(f"Ball sensor status after {balls} balls: {status}")
+    ok = ok and status['outlet_count'] == balls and status['entry_count'] == balls and status['transits'] == balls
+    ok = ok and status['transit_min_us'] >= transit_ms * 1000 and detected.count(OUTLET) == balls
+    # a ball lost between outlet and driver
+    outlet.pass_ball()
+    time.sleep(0.002)
+    outlet.pass_ball()
+    ok = ok and sensor.getStatusData()['unmatched'] == 1
+    sensor.stop()
+    print(f"Ball sensor test {'passed' if ok else 'FAILED'}.")
+    return ok
@@ -1,3 +1,4 @@
+from machine import Timer
 from Sg92r import Sg92r
 from StepMotorPIO import StepMotorPIO, MODE_PERMANENT
 from RobbyExceptions import ImplementationException
@@ -18,6 +19,8 @@ class BallStirrer:
             self.motors = []
         self.debug = debug
         self.running = False
+        self.bursts = 0
+        self._burst_timer = None
         if self.debug: 
             print(f"BallStirrer #{self.bs_index} initialized with motor ", type(motor).__name__, ".")
 
@@ -27,7 +30,8 @@ class BallStirrer:
             print(f"BallStirrer #{self.bs_index}: Starting motor {motor_index}.")
         motor = self.motors[motor_index]
         if type(motor) is StepMotorPIO:
-            motor.rotate(1.0)
+            # the former rotate(1.0) was capped at runner_freq, i.e. the max. continuous speed
+            motor.rotate(motor.max_continuous_rpm())
         else:
             motor.start() # type: ignore
 
@@ -37,6 +41,30 @@ class BallStirrer:
         for m in range (len(self.motors)):
             self.motor_start(m)
 
+    def burst(self, duration_ms: int = 1500):
+        """Runs the stirrer for a short time, e.g. to loosen the balls after the feeder missed one.
+           A stirrer which is running anyways just keeps running.
+        """
+        self.bursts += 1
+        if self.running:
+            return
+        if self.debug:
+            print(f"BallStirrer #{self.bs_index}: burst for {duration_ms} ms.")
+        for m in range(len(self.motors)):
+            self.motor_start(m)
+        if self._burst_timer is None:
+            self._burst_timer = Timer()
+        self._burst_timer.init(mode=Timer.ONE_SHOT, period=duration_ms, callback=self._end_burst)
+
+    def _end_burst(self, timer):
+        if self.running:
+            return # started regularly in the meantime
+        for m in self.motors:
+            try:
+                m.stop()
+            except Exception as e:
+                print(f"BallStirrer #{self.bs_index}: Error stopping motor: {e}")
+
     def stop(self):
         """Stops the ball stirrer by stopping all motors."""
         self.running = False
@@ -59,6 +87,7 @@ class BallStirrer:
     def getStatusData(self):
         status = {
             'running': self.running,
+            'bursts': self.bursts,
             }
         return status
 
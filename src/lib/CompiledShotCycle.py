@@ -0,0 +1,171 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List
+from array import array
+from RobbyExceptions import ConfigurationException
+from ShotCycle import ShotCycle
+from AimingTable import IdentityAiming, AXIS_PAN
+
+SPINUP_POLICY_WARN = 'warn'
+SPINUP_POLICY_THROTTLE = 'throttle'
+
+class CompiledShotCycle:
+    """A ShotCycle translated into flat, preallocated tables, so that playing a shot only needs to index into arrays.
+       All calculations (motor speeds, intervals, aiming targets) are done once when the program is loaded. Applying the motor
+       speeds then neither allocates memory nor does any float math. Aiming does both: the targets are converted to degrees
+       and the machine rotators plan each move against the current motor positions, which cannot be done in advance.
+       Motor speeds are stored per shot in blocks of motor_stride values (the max. number of motors of all ball drivers).
+
+       Speed changes are scheduled ahead: right after a ball driver released its ball, it is set to the speeds of its
+       next shot (next_on_driver), which gives idle drivers the whole time until their next shot to spin up.
+       The motor dynamics of each driver predict whether this time is sufficient. Depending on the spin-up policy,
+       too short pauses are either reported (warn) or extended (throttle).
+       The axes are aimed at the next shot at the same time, so the move of the machine rotators runs in parallel with
+       the spin-up and the return stroke of the feeder. Its predicted duration is checked against the pause the same way.
+    """
+    def __init__(self, shot_cycle: ShotCycle, ball_drivers: list, release_ms: int = 250, spinup_policy: str = SPINUP_POLICY_WARN, aiming=None, machine_rotators=None) -> None:
+        """Parameters:
+           release_ms:    time after releasing a ball, before the driver may change its speeds (ball still in the driver).
+           spinup_policy: 'warn' or 'throttle', see class description.
+           aiming:        AimingTable mapping the angles of the shots to the targets of the pan and tilt axes.
+                          Without one, the axes follow the angles of the shots directly.
+           machine_rotators: the pan and tilt axes, whose move durations are predicted (none: moves are not checked).
+        """
+        if spinup_policy not in (SPINUP_POLICY_WARN, SPINUP_POLICY_THROTTLE):
+            raise ConfigurationException(f"Invalid spin-up policy '{spinup_policy}'.")
+        n = len(shot_cycle.shots)
+        if n == 0:
+            raise ConfigurationException("Cannot compile an empty shot cycle.")
+        self.shot_cycle = shot_cycle
+        self.count = n
+        self.motor_stride = max([len(bd.motors) for bd in ball_drivers]) if ball_drivers else 0
+        self.bd_index = array('B', bytes(n))
+        """ball driver index per shot (the feeder is chosen by the FeederScheduler at playback)"""
+        self.motor_pwm = array('b', bytes(n * self.motor_stride))
+        """motor speeds in % (-100 to +100) per shot and motor"""
+        self.rotator_target = array('h', [0] * n)
+        """target of the pan axis (machine rotators) in 0.1 degrees per shot"""
+        self.tilt_target = array('h', [0] * n)
+        """target of the tilt axis in 0.1 degrees per shot"""
+        self.interval_ms = array('I', [0] * n)
+        """pause to the next ball in ms per shot"""
+        self.next_on_driver = array('H', [0] * n)
+        """index of the next shot using the same ball driver, whose speeds are applied after the release"""
+        self.spinup_ms = array('H', [0] * n)
+        """predicted time in ms the driver needs to reach the speeds of this shot"""
+        self.aim_ms = array('H', [0] * n)
+        """predicted time in ms the axes need to move from the aim of the previous shot to this one, including settling"""
+        self.release_ms = release_ms
+        self.spinup_policy = spinup_policy
+        self.warnings = []
+        """shots whose pause is too short for the predicted spin-up ('path': 'spinup') or move of the axes ('path': 'aim')"""
+        self.throttled_ms = 0
+        """total time added to the pauses of one cycle by the throttle policy"""
+        self.current_index = 0
+        self._geometry_versions = [bd.geometry_version for bd in ball_drivers]
+        self._compile(ball_drivers, aiming if aiming is not None else IdentityAiming())
+        if machine_rotators:
+            self._schedule_aiming(machine_rotators)
+
+    def _compile(self, ball_drivers: list, aiming) -> None:
+        for i in range(self.count):
+            shot = self.shot_cycle.shots[i]
+            bd_number = shot.BallDriverNumber
+            if bd_number < 0 or bd_number >= len(ball_drivers):
+                raise ConfigurationException(f"Shot #{i} refers to ball driver #{bd_number}, which does not exist.")
+            if shot.Pause <= 0.0:
+                raise ConfigurationException(f"Shot #{i} has no valid pause time ({shot.Pause}).")
+            bd = ball_drivers[bd_number]
+            speeds = bd.get_motor_speeds(shot.BallSpeed, shot.Topspin, shot.Sidespin)
+            shot.MotorSettings = speeds
+            shot.MotorSettingsVersion = bd.geometry_version
+            self.bd_index[i] = bd_number
+            for m in range(len(speeds)):
+                self.motor_pwm[i * self.motor_stride + m] = speeds[m]
+            pan, tilt = aiming.lookup(shot.HorizontalAngle, shot.VerticalAngle)
+            self.rotator_target[i] = pan
+            self.tilt_target[i] = tilt
+            self.interval_ms[i] = int(shot.Pause * 1000)
+        self._schedule_spinup(ball_drivers)
+
+    def _schedule_spinup(self, ball_drivers: list) -> None:
+        """Predicts the spin-up time of every shot transition and checks it against the time available."""
+        n = self.count
+        stride = self.motor_stride
+        for i in range(n):
+            # previous shot on the same driver (cyclic), the driver keeps its speeds from there until it is released
+            k = i
+            available = 0
+            while True:
+                available += self.interval_ms[k]
+                k = k - 1 if k > 0 else n - 1
+                if self.bd_index[k] == self.bd_index[i]:
+                    break
+            self.next_on_driver[k] = i
+            bd = ball_drivers[self.bd_index[i]]
+            m = len(bd.motors)
+            from_speeds = self.motor_pwm[k * stride:k * stride + m]
+            to_speeds = self.motor_pwm[i * stride:i * stride + m]
+            t = bd.dynamics.time_to_speed_ms(from_speeds, to_speeds)
+            self.spinup_ms[i] = min(t, 0xFFFF)
+            deficit = t - (available - self.release_ms)
+            if deficit > 0:
+                self.warnings.append({'shot': i, 'path': 'spinup', 'needed_ms': t, 'available_ms': available - self.release_ms})
+                if self.spinup_policy == SPINUP_POLICY_THROTTLE:
+                    # the pause before shot i is the interval of shot i (see RobbyController._play_compiled_shot)
+                    self.interval_ms[i] += deficit
+                    self.throttled_ms += deficit
+
+    def _schedule_aiming(self, machine_rotators: list) -> None:
+        """Predicts the move of the axes between consecutive shots. The move starts when the previous ball is committed."""
+        n = self.count
+        for i in range(n):
+            k = i - 1 if i > 0 else n - 1
+            t = 0
+            for mr in machine_rotators:
+                targets = self.rotator_target if mr.axis == AXIS_PAN else self.tilt_target
+                t = max(t, mr.estimate_move_ms(targets[k] / 10, targets[i] / 10))
+            self.aim_ms[i] = min(t, 0xFFFF)
+            available = self.interval_ms[i] - self.release_ms
+            deficit = t - available
+            if deficit > 0:
+                self.warnings.append({'shot': i, 'path': 'aim', 'needed_ms': t, 'available_ms': available})
+                if self.spinup_policy == SPINUP_POLICY_THROTTLE:
+                    self.interval_ms[i] += deficit
+                    self.throttled_ms += deficit
+
+    def is_valid(self, ball_drivers: list) -> bool:
+        """Returns False if any ball driver changed its geometry or config since the compilation."""
+        if len(ball_drivers) != len(self._geometry_versions):
+            return False
+        for i in range(len(ball_drivers)):
+            if ball_drivers[i].geometry_version != self._geometry_versions[i]:
+                return False
+        return True
+
+    def reset(self) -> None:
+        self.current_index = 0
+        self.shot_cycle.nextShotIndex = 1 % self.count
+
+    def advance(self) -> int:
+        """Moves on to the next shot of the cycle and returns its index."""
+        i = self.current_index + 1
+        if i >= self.count:
+            i = 0
+        self.current_index = i
+        self.shot_cycle.nextShotIndex = (i + 1) % self.count # ShotCycle.getStatusData() indexes with it
+        return i
+
+    def getStatusData(self) -> dict:
+        return {
+            'shots': self.count,
+            'current_index': self.current_index,
+            'motor_stride': self.motor_stride,
+            'spinup_policy': self.spinup_policy,
+            'spinup_warnings': self.warnings,
+            'throttled_ms': self.throttled_ms,
+        }
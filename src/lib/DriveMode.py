@@ -0,0 +1,54 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List
+
+# Drive modes of a unipolar stepper (e.g. 28BYJ-48 with ULN2003). One electrical cycle always covers 4 full steps,
+# so the angle per cycle does not depend on the drive mode, only the number of coil patterns (phases) within a cycle does.
+DRIVE_HALF_STEP = 'half'
+"""8 phases, alternating one and two coils: smooth, medium torque (default)"""
+DRIVE_FULL_STEP = 'full'
+"""4 phases, always two coils: highest torque, twice the speed at the same phase rate"""
+DRIVE_WAVE = 'wave'
+"""4 phases, always one coil: lowest power consumption and torque"""
+
+PATTERNS = {
+    DRIVE_HALF_STEP: (8, 12, 4, 6, 2, 3, 1, 9),
+    DRIVE_FULL_STEP: (12, 6, 3, 9),
+    DRIVE_WAVE: (8, 4, 2, 1),
+}
+"""forward coil patterns per drive mode (bit 3: first pin)"""
+PHASE_TICKS = 24
+"""PIO ticks per phase of the fixed-rate programs (set with delay 23)"""
+
+def backward_patterns(drive_mode: str) -> tuple:
+    """The forward patterns in reverse order, rotated to end with the same pattern as the forward cycle."""
+    fwd = PATTERNS[drive_mode]
+    rev = fwd[::-1]
+    return rev[1:] + rev[:1]
+
+def phases_per_cycle(drive_mode: str) -> int:
+    return len(PATTERNS[drive_mode])
+
+def ticks_per_cycle(drive_mode: str) -> int:
+    """PIO ticks per step (cycle) of the fixed-rate program run_segments_pio, without the tick of its loop."""
+    return phases_per_cycle(drive_mode) * PHASE_TICKS
+
+def compare_cycle_times(action_cycle: List[float], angle_per_step: float, runner_freq: int) -> dict:
+    """Host benchmark: duration of a feeder action cycle (angles in degrees) per drive mode, at the given runner frequency.
+       The frequency is the phase rate limit of the motor, which is about the same for all modes, so full step and wave
+       drive need half the time of half step drive. Whether the motor still delivers enough torque must be tested.
+    """
+    steps = sum([abs(round(angle / angle_per_step)) for angle in action_cycle])
+    ret = {}
+    for mode in PATTERNS:
+        ticks = steps * (ticks_per_cycle(mode) + 1) # + loop of run_segments_pio
+        ret[mode] = {
+            'phases_per_cycle': phases_per_cycle(mode),
+            'steps': steps,
+            'cycle_time_ms': ticks * 1000 // runner_freq,
+        }
+    return ret
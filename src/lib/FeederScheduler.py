@@ -0,0 +1,110 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List, Union
+import time
+from RobbyExceptions import ConfigurationException
+
+class FeederScheduler:
+    """Distributes the balls of each ball driver over all ball feeders feeding it (staggered round-robin).
+       Each feeder is busy for its cycle time after a release. While one feeder performs its return stroke, the next one
+       can already release a ball, so the rate of a driver can exceed the cycle limit of a single feeder.
+       The driver a feeder feeds is given by its ball_driver setting.
+    """
+    def __init__(self, ball_feeders: list, default_cycle_ms: int, debug=False) -> None:
+        """Parameters:
+           ball_feeders:     the feeders of the machine (the list is referenced, so later changes are taken into account).
+           default_cycle_ms: cycle time of feeders, which are neither calibrated nor can estimate their cycle.
+        """
+        self.ball_feeders = ball_feeders
+        self.default_cycle_ms = default_cycle_ms
+        self.debug = debug
+        self._next = {}
+        """round-robin position per ball driver"""
+        self._released = {}
+        """time of the last release per feeder index"""
+        self.selections = 0
+        self.busy_selections = 0
+        """selections where all feeders of the driver were still busy, i.e. the release had to wait"""
+
+    def feeders_for_driver(self, bd_number: int) -> List[int]:
+        return [i for i in range(len(self.ball_feeders)) if self.ball_feeders[i].ball_driver == bd_number]
+
+    def cycle_ms(self, bf_index: int) -> int:
+        """Time a feeder is busy after a release: calibrated, estimated or default, in this order."""
+        bf = self.ball_feeders[bf_index]
+        if bf.cycle_duration:
+            return int(bf.cycle_duration * 1000)
+        estimated = bf.estimate_cycle_ms()
+        return estimated if estimated else self.default_cycle_ms
+
+    def ready_in_ms(self, bf_index: int) -> int:
+        """Predicted time until the feeder can release its next ball, 0 if it is ready."""
+        if not self.ball_feeders[bf_index].is_busy():
+            return 0
+        t = self._released.get(bf_index)
+        if t is None:
+            return self.cycle_ms(bf_index)
+        return max(self.cycle_ms(bf_index) - time.ticks_diff(time.ticks_ms(), t), 1)
+
+    def select(self, bd_number: int) -> int:
+        """Returns the index of the feeder to release the next ball for the ball driver: the next ready one in round-robin
+           order, or the one which will be ready first, if all are busy.
+        """
+        candidates = self.feeders_for_driver(bd_number)
+        if not candidates:
+            raise ConfigurationException(f"No ball feeder is configured to feed ball driver #{bd_number}.")
+        n = len(candidates)
+        start = self._next.get(bd_number, 0) % n
+        best = -1
+        best_ms = 0
+        for k in range(n):
+            j = (start + k) % n
+            ms = self.ready_in_ms(candidates[j])
+            if best < 0 or ms < best_ms:
+                best = j
+                best_ms = ms
+            if ms == 0:
+                break
+        self._next[bd_number] = best + 1
+        self.selections += 1
+        if best_ms > 0:
+            self.busy_selections += 1
+            if self.debug:
+                print(f"FeederScheduler: all feeders of ball driver #{bd_number} busy, feeder #{candidates[best]} ready in {best_ms} ms.")
+        return candidates[best]
+
+    def record_release(self, bf_index: int) -> None:
+        self._released[bf_index] = time.ticks_ms()
+
+    def max_ball_frequency(self, bd_number: int) -> float:
+        """Max. balls per second the feeders of the ball driver can supply together."""
+        ret = 0.0
+        for i in self.feeders_for_driver(bd_number):
+            ret += 1000.0 / self.cycle_ms(i)
+        return ret
+
+    def reset(self) -> None:
+        self._next = {}
+        self._released = {}
+        self.selections = 0
+        self.busy_selections = 0
+
+    def getStatusData(self) -> dict:
+        drivers = []
+        for bf in self.ball_feeders:
+            if bf.ball_driver not in [d['ball_driver'] for d in drivers]:
+                drivers.append({
+                    'ball_driver': bf.ball_driver,
+                    'feeders': self.feeders_for_driver(bf.ball_driver),
+                    'max_ball_frequency': self.max_ball_frequency(bf.ball_driver),
+                })
+        return {
+            'drivers': drivers,
+            'feeder_cycle_ms': [self.cycle_ms(i) for i in range(len(self.ball_feeders))],
+            'selections': self.selections,
+            'busy_selections': self.busy_selections,
+        }
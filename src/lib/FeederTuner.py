@@ -0,0 +1,210 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List, Union
+import time
+from RobbyExceptions import InvalidOperationException
+
+SPEED_STEP = 1.15
+"""factor by which the speed is raised from one probe to the next"""
+MAX_SPEED_FACTOR = 3.0
+"""highest speed probed, relative to the settings the calibration starts with"""
+REFINE_STEPS = 3
+"""number of bisection steps between the last reliable and the first failing speed"""
+SAFETY_MARGIN = 0.85
+"""the speed finally stored is the fastest reliable one multiplied by this factor"""
+TIMING_MARGIN = 1.15
+"""the cycle and release durations stored are the ones measured multiplied by this factor"""
+TIMING_TOLERANCE = 0.25
+"""max. relative deviation of a measured cycle from the expected one, before the cycle is considered a failure"""
+TIMING_SLACK_MS = 30
+"""absolute deviation allowed on top of TIMING_TOLERANCE (scheduling jitter of the completion handling)"""
+SENSOR_SETTLE_MS = 300
+"""time to wait after a cycle for the ball sensor to detect the ball"""
+
+class FeederTuner:
+    """Calibrates the fastest reliable cycle of a ball feeder.
+       The feeder is dispensing repeatedly, while the speed of its step motors (runner_freq, or max. speed and acceleration
+       of the motion profile) is raised stepwise until a cycle fails. The limit is then narrowed down by bisection and
+       the fastest reliable speed, reduced by SAFETY_MARGIN, is adopted into the motor configs. The measured cycle and
+       release (commit) durations are stored in the feeder config, where the controller takes them from.
+       A cycle fails if
+       - it does not complete in time (stalled move or lost completion),
+       - its duration deviates from the expected one by more than TIMING_TOLERANCE, or
+       - the optional ball sensor does not count a ball.
+       The timing alone cannot detect a stall: the steps of an open-loop stepper are clocked by the PIO, so a stalled
+       cycle takes exactly as long as a successful one, and the expected duration scales with the speed as well.
+       Without a ball sensor the speed is therefore not raised, only the cycle and release durations are measured
+       at the current settings.
+       The feeder must be loaded with balls and be in waiting position.
+    """
+    def __init__(self, feeder, ball_sensor=None, trials: int = 3, debug=False) -> None:
+        """Parameters:
+           feeder:      the BallFeeder to calibrate.
+           ball_sensor: optional function without parameters returning the number of balls detected so far
+                        (e.g. by a light barrier behind the feeder). Required to search for a faster speed.
+           trials:      number of cycles dispensed per probed speed, all must succeed.
+        """
+        self.feeder = feeder
+        self.ball_sensor = ball_sensor
+        self.trials = max(int(trials), 1)
+        self.debug = debug
+        self._base_configs = [mot.getConfigData() for mot in feeder.motors]
+        self._overhead_ms = 0
+        """difference between the measured and the estimated cycle time at the initial speed"""
+        self.log = []
+        """one entry per probed speed: factor, success, measured durations"""
+
+    def _apply_factor(self, factor: float) -> None:
+        """Sets the speed of all motors to the initial speed multiplied by factor."""
+        for m in range(len(self.feeder.motors)):
+            mot = self.feeder.motors[m]
+            base = self._base_configs[m]
+            profile = base.get('motion_profile')
+            if profile:
+                profile = dict(profile)
+                profile['max_rpm'] = float(profile.get('max_rpm', 15.0)) * factor
+                profile['accel_rpm_per_s'] = float(profile.get('accel_rpm_per_s', 60.0)) * factor * factor
+                mot.setConfigData({'motion_profile': profile})
+            elif 'runner_freq' in base:
+                mot.setConfigData({'runner_freq': int(base['runner_freq'] * factor)})
+
+    def _dispense_once(self) -> dict:
+        """Performs one feeder cycle and returns its measured durations and whether it succeeded."""
+        feeder = self.feeder
+        expected_ms = feeder.estimate_cycle_ms()
+        timeout_ms = 2 * (expected_ms if expected_ms else 1000) + 500 + getattr(feeder, 'ball_timeout_ms', 0)
+        balls = self.ball_sensor() if self.ball_sensor else 0
+        done = []
+        committed = []
+        t0 = time.ticks_ms()
+        feeder.dispense(controller_callback=lambda: done.append(time.ticks_diff(time.ticks_ms(), t0)),
+                        committed_callback=lambda: committed.append(time.ticks_diff(time.ticks_ms(), t0)))
+        while not done and time.ticks_diff(time.ticks_ms(), t0) < timeout_ms:
+            time.sleep_ms(5)
+        ret = {
+            'expected_ms': expected_ms,
+            'cycle_ms': done[0] if done else None,
+            'commit_ms': committed[0] if committed else None,
+            'ok': True,
+            'failure': None,
+        }
+        if not done:
+            feeder.stop()
+            ret['ok'] = False
+            ret['failure'] = 'timeout'
+            return ret
+        if expected_ms:
+            expected_ms += self._overhead_ms
+            if abs(done[0] - expected_ms) > expected_ms * TIMING_TOLERANCE + TIMING_SLACK_MS:
+                ret['ok'] = False
+                ret['failure'] = 'timing'
+                return ret
+        if self.ball_sensor:
+            t1 = time.ticks_ms()
+            while self.ball_sensor() == balls and time.ticks_diff(time.ticks_ms(), t1) < SENSOR_SETTLE_MS:
+                time.sleep_ms(5)
+            if self.ball_sensor() == balls:
+                ret['ok'] = False
+                ret['failure'] = 'no ball'
+        return ret
+
+    def _probe(self, factor: float) -> Union[dict, None]:
+        """Dispenses self.trials cycles at the given speed factor. Returns the slowest result, or None if any cycle failed."""
+        self._apply_factor(factor)
+        worst = None
+        for _ in range(self.trials):
+            res = self._dispense_once()
+            if not res['ok']:
+                self.log.append({'factor': factor, 'ok': False, 'failure': res['failure'], 'cycle_ms': res['cycle_ms']})
+                if self.debug:
+                    print(f"FeederTuner: speed factor {factor:.2f} failed ({res['failure']}).")
+                if res['failure'] == 'timeout':
+                    # the feeder has been stopped somewhere within its cycle and must be prepared again
+                    self._apply_factor(1.0)
+                    raise InvalidOperationException(f"Ball Feeder #{self.feeder.bf_index} did not complete its cycle at speed factor {factor:.2f}. Initial settings restored, please check the feeder and prepare it again.")
+                return None
+            if worst is None or res['cycle_ms'] > worst['cycle_ms']:
+                worst = res
+        self.log.append({'factor': factor, 'ok': True, 'cycle_ms': worst['cycle_ms'], 'commit_ms': worst['commit_ms']})
+        if self.debug:
+            print(f"FeederTuner: speed factor {factor:.2f} ok, cycle {worst['cycle_ms']} ms.")
+        return worst
+
+    def run(self) -> dict:
+        """Performs the calibration and adopts the result into the feeder and its motors.
+           If the feeder fails already at its initial speed, the initial settings are restored and an InvalidOperationException is raised.
+        """
+        feeder = self.feeder
+        if feeder.is_busy():
+            raise InvalidOperationException(f"Ball Feeder #{feeder.bf_index} is operating and cannot be calibrated.")
+        # a missed ball must fail the probe, not be compensated by a retry of the feeder
+        max_retries = feeder.max_retries
+        miss_callback = feeder.miss_callback
+        feeder.max_retries = 0
+        feeder.miss_callback = None
+        try:
+            return self._run()
+        finally:
+            feeder.max_retries = max_retries
+            feeder.miss_callback = miss_callback
+
+    def _run(self) -> dict:
+        feeder = self.feeder
+        base = self._probe(1.0)
+        if base is None:
+            self._apply_factor(1.0)
+            raise InvalidOperationException(f"Ball Feeder #{feeder.bf_index} fails already with its current settings ({self.log[-1]['failure']}).")
+        if base['expected_ms']:
+            self._overhead_ms = base['cycle_ms'] - base['expected_ms']
+        good = 1.0
+        bad = None
+        if self.ball_sensor is None:
+            # a stalled cycle takes as long as a successful one, so a faster speed could not be verified
+            if self.debug:
+                print(f"FeederTuner: Ball Feeder #{feeder.bf_index} has no ball sensor, its speed is kept.")
+        else:
+            factor = SPEED_STEP
+            while factor <= MAX_SPEED_FACTOR:
+                if self._probe(factor) is None:
+                    bad = factor
+                    break
+                good = factor
+                factor *= SPEED_STEP
+            if bad is not None:
+                for _ in range(REFINE_STEPS):
+                    factor = (good + bad) / 2
+                    if self._probe(factor) is None:
+                        bad = factor
+                    else:
+                        good = factor
+        final = max(good * SAFETY_MARGIN, 1.0)
+        res = self._probe(final)
+        if res is None:
+            # not even reliable with the margin: stay with the initial settings
+            final = 1.0
+            res = self._probe(final)
+            if res is None:
+                self._apply_factor(1.0)
+                raise InvalidOperationException(f"Ball Feeder #{feeder.bf_index} became unreliable during the calibration ({self.log[-1]['failure']}).")
+        feeder.cycle_duration = res['cycle_ms'] * TIMING_MARGIN / 1000.0
+        if res['commit_ms'] is not None:
+            feeder.release_duration = res['commit_ms'] * TIMING_MARGIN / 1000.0
+        ret = {
+            'speed_search': self.ball_sensor is not None,
+            'fastest_reliable_factor': good,
+            'first_failing_factor': bad,
+            'adopted_factor': final,
+            'cycle_ms': res['cycle_ms'],
+            'commit_ms': res['commit_ms'],
+            'cycle_duration': feeder.cycle_duration,
+            'release_duration': feeder.release_duration,
+            'motors': [mot.getConfigData() for mot in feeder.motors],
+            'log': self.log,
+        }
+        if self.debug:
+            print(f"FeederTuner: Ball Feeder #{feeder.bf_index} calibrated: {ret}")
+        return ret
@@ -0,0 +1,161 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List, Union
+from array import array
+import time
+try:
+    import micropython
+except ImportError:
+    micropython = None # host environment: events are handled immediately
+try:
+    from machine import disable_irq, enable_irq
+except ImportError:
+    disable_irq = lambda: 0
+    enable_irq = lambda state: None
+
+DEFAULT_CAPACITY = 16
+
+if hasattr(time, 'ticks_us'):
+    _ticks_us = time.ticks_us
+    _ticks_diff = time.ticks_diff
+else:
+    _ticks_us = lambda: int(time.time() * 1000000) & 0x3fffffff
+    _ticks_diff = lambda a, b: a - b
+
+class IrqEventQueue:
+    """Defers the follow-up work of interrupt handlers (e.g. motor completion callbacks) out of the interrupt context.
+       An irq handler only calls post(), which records the handler, its argument and a timestamp in a preallocated ring
+       buffer, so it neither allocates memory nor blocks. The events are then processed by a single drain run, which is
+       requested via micropython.schedule(), in the order they were posted.
+       The delay between post() and the start of the handler (latency) and the duration of the handlers are measured.
+    """
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        self.capacity = capacity
+        self._handlers = [None] * capacity
+        self._args = [None] * capacity
+        self._stamps = array('I', [0] * capacity)
+        self._head = 0
+        """index of the next event to post"""
+        self._tail = 0
+        """index of the next event to process"""
+        self._scheduled = False
+        self._drain_ref = self._drain
+        """bound method created once, since the irq handler must not allocate"""
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.events = 0
+        self.overflows = 0
+        """events dropped, because the queue was full"""
+        self.schedule_failures = 0
+        """drain runs which could not be scheduled (the scheduler queue was full), the events are processed with the next one"""
+        self.max_depth = 0
+        self.latency_max_us = 0
+        self.latency_sum_us = 0
+        self.handler_max_us = 0
+        self.handler_sum_us = 0
+
+    def post(self, handler, arg=None) -> bool:
+        """Queues handler(arg) for deferred execution. Safe to be called from an interrupt handler, as long as the handler
+           is an existing object (e.g. a bound method stored in an attribute, not created in the irq).
+           Returns False if the queue is full and the event was dropped.
+           Hard irq handlers (e.g. the ball sensors) can interrupt a post() from a soft irq, so the slot is claimed
+           with the interrupts disabled.
+        """
+        state = disable_irq()
+        head = self._head
+        nxt = (head + 1) % self.capacity
+        if nxt == self._tail:
+            self.overflows += 1
+            enable_irq(state)
+            return False
+        self._handlers[head] = handler
+        self._args[head] = arg
+        self._stamps[head] = _ticks_us()
+        self._head = nxt
+        depth = (nxt - self._tail) % self.capacity
+        if depth > self.max_depth:
+            self.max_depth = depth
+        schedule = not self._scheduled
+        self._scheduled = True
+        enable_irq(state)
+        if schedule:
+            self._schedule()
+        return True
+
+    def _schedule(self) -> None:
+        if micropython is None:
+            self._drain(0)
+            return
+        try:
+            micropython.schedule(self._drain_ref, 0)
+        except RuntimeError:
+            # the pending events are processed with the next successful drain, see reschedule()
+            self._scheduled = False
+            self.schedule_failures += 1
+
+    def reschedule(self) -> None:
+        """Requests a drain run for events left pending, because their drain run could not be scheduled.
+           Called periodically by the controller loop, so that such events are not stuck until the next post().
+           Unlike drain(), the events are still processed in the scheduler context, not in parallel to it.
+        """
+        state = disable_irq()
+        schedule = not self._scheduled and self._tail != self._head
+        if schedule:
+            self._scheduled = True
+        enable_irq(state)
+        if schedule:
+            self._schedule()
+
+    def drain(self) -> None:
+        """Processes all pending events in the calling context, e.g. from the controller loop."""
+        self._drain(0)
+
+    def _drain(self, _) -> None:
+        self._scheduled = False
+        while self._tail != self._head:
+            tail = self._tail
+            handler = self._handlers[tail]
+            arg = self._args[tail]
+            t0 = _ticks_us()
+            latency = _ticks_diff(t0, self._stamps[tail])
+            self._handlers[tail] = None
+            self._args[tail] = None
+            self._tail = (tail + 1) % self.capacity
+            try:
+                handler(arg)
+            except Exception as e:
+                print(f"IrqEventQueue: error in deferred handler {handler}: {e}")
+            duration = _ticks_diff(_ticks_us(), t0)
+            self.events += 1
+            self.latency_sum_us += latency
+            self.handler_sum_us += duration
+            if latency > self.latency_max_us:
+                self.latency_max_us = latency
+            if duration > self.handler_max_us:
+                self.handler_max_us = duration
+
+    def pending(self) -> int:
+        return (self._head - self._tail) % self.capacity
+
+    def getStatusData(self) -> dict:
+        n = self.events
+        return {
+            'capacity': self.capacity,
+            'pending': self.pending(),
+            'events': n,
+            'overflows': self.overflows,
+            'schedule_failures': self.schedule_failures,
+            'max_depth': self.max_depth,
+            'latency_avg_us': self.latency_sum_us // n if n else 0,
+            'latency_max_us': self.latency_max_us,
+            'handler_avg_us': self.handler_sum_us // n if n else 0,
+            'handler_max_us': self.handler_max_us,
+        }
+
+event_queue = IrqEventQueue()
+"""The queue shared by all interrupt sources of the machine."""
@@ -1,21 +1,52 @@
+from machine import Timer
+import time
 from lib.StepMotorPIO import StepMotorPIO, MODE_COUNTED
 from lib.Sg92r import Sg92r
 from lib.RobbyExceptions import ImplementationException, ConfigurationException
+from lib.AimingTable import AXES, AXIS_PAN
 
 
 class MachineRotator:
     """
     Defines a joint, rotating the whole machine on a horizontal plane (vertical axis).
-    Multiple motors can be used to rotate the machine, however, they must be coordinated/synced properly.
+    Multiple motors can be used to rotate the machine. A rotation is planned as one coordinated move: every motor is
+    moved to its absolute target (machine angle * angle factor), and all motors arrive at the same time, given by the
+    slowest one. Servos are slowed down by interpolation, faster steppers start later. When the last motor has
+    arrived and the settle time has passed, a single completion callback is called.
+    The same joint serves as tilt axis (horizontal axis, raising and lowering the aim), if its axis is set to 'tilt'.
+    The controller aims each shot by moving the 'pan' rotators to the pan target and the 'tilt' rotators to the
+    tilt target of the AimingTable.
     """
-    def __init__(self, mr_index: int, min_angle_deg: float = -45.0, max_angle_deg: float = 45.0, debug: bool=False):
+    def __init__(self, mr_index: int, min_angle_deg: float = -45.0, max_angle_deg: float = 45.0, settle_ms: int = 50, axis: str = AXIS_PAN, debug: bool=False):
         self.debug = debug
         self.mr_index = mr_index
+        if axis not in AXES:
+            raise ConfigurationException(f"MachineRotator #{mr_index}: invalid axis '{axis}', must be one of {AXES}.")
+        self.axis = axis
+        """'pan' (rotating the machine) or 'tilt', i.e. which target of the AimingTable the rotator follows"""
         self.motors: list[StepMotorPIO | Sg92r] = []
         self.motor_angle_factors = []
         """motors which participate in the rotation."""
         self.min_angle_deg = min(float(min_angle_deg), float(max_angle_deg))
         self.max_angle_deg = max(float(min_angle_deg), float(max_angle_deg))
+        self.settle_ms = settle_ms
+        """time to wait after the arrival of the motors, until the machine is considered settled"""
+        self.current_angle = 0.0
+        """machine angle of the last completed rotation"""
+        self.target_angle = 0.0
+        self._moving = False
+        self._pending_angle = None
+        """rotation requested during a move, started when the move is complete (the latest request wins)"""
+        self._pending_callback = None
+        self._op_complete_callback = None
+        self._waiting_motors = 0
+        self._move_t0 = 0
+        self.planned_ms = 0
+        """planned duration of the current (or last) rotation, i.e. the shared arrival time"""
+        self.last_move_ms = 0
+        """measured duration of the last rotation until all motors arrived"""
+        self._start_timers = []
+        self._settle_timer = None
         if self.debug: 
             print(f"MachineRotator #{self.mr_index} initialized.")
     
@@ -35,20 +66,169 @@ class MachineRotator:
         self.motors.append(motor)
         self.motor_angle_factors.append(angle_factor)
 
-    def rotate(self, angle: float):
-        """Rotates the machine to the given angle."""
+    def rotate(self, angle: float, op_complete_callback=None) -> int:
+        """Rotates the machine to the given (absolute) angle and returns the planned duration in ms.
+           op_complete_callback: 1-parameter function called with the rotator, when all motors arrived and settled.
+           A rotation requested while the machine is moving is performed after the current one.
+        """
         angle = max(min(angle, self.max_angle_deg), self.min_angle_deg)
+        if self._moving:
+            if self.debug:
+                print(f"MachineRotator #{self.mr_index}: rotation to {angle} degrees queued.")
+            self._pending_angle = angle
+            self._pending_callback = op_complete_callback
+            return 0
+        if angle == self.current_angle:
+            # already there, nothing to move or settle
+            if op_complete_callback is not None:
+                op_complete_callback(self)
+            return 0
         if self.debug:
             print("Rotating machine to %f degrees." % angle)
+        self.target_angle = angle
+        self._op_complete_callback = op_complete_callback
+        plan = self.plan(angle)
+        self.planned_ms = max([p[1] for p in plan]) if plan else 0
+        self._waiting_motors = len([p for p in plan if p[1] > 0])
+        self._moving = True
+        self._move_t0 = time.ticks_ms()
+        if self._waiting_motors == 0:
+            self._motor_arrived(None)
+            return 0
+        while len(self._start_timers) < len(self.motors):
+            self._start_timers.append(None)
+        for i, motor in enumerate(self.motors):
+            target, duration = plan[i]
+            if duration <= 0:
+                continue
+            if hasattr(motor, 'rotate_segments'):
+                delay = self.planned_ms - duration
+                if delay > 0:
+                    # a stepper cannot be slowed down per move, so it starts later to arrive with the others
+                    if self._start_timers[i] is None:
+                        self._start_timers[i] = Timer()
+                    self._start_timers[i].init(mode=Timer.ONE_SHOT, period=delay,
+                                               callback=lambda t, m=motor, s=target: self._start_stepper(m, s))
+                else:
+                    self._start_stepper(motor, target)
+            else:
+                motor.rotate_by_angle(target, op_complete_callback=self._motor_arrived, duration_ms=self.planned_ms)
+        return self.planned_ms
+
+    def plan(self, angle: float) -> list:
+        """Plans the move of every motor to the machine angle: [absolute target, natural duration in ms] per motor.
+           Steppers get their target in steps (relative to their home position), servos in degrees.
+        """
+        ret = []
         for i, motor in enumerate(self.motors):
-            motor.rotate_by_angle(angle * self.motor_angle_factors[i])
+            motor_angle = angle * self.motor_angle_factors[i]
+            if hasattr(motor, 'rotate_segments'):
+                target = motor.angle_to_steps(motor_angle)
+                steps = target - motor.read_position_steps()
+                ret.append([target, motor.estimate_move_ms([steps]) if steps != 0 else 0])
+            else:
+                ret.append([motor_angle, motor.move_duration_ms(motor_angle) if motor_angle != motor.current_angle else 0])
+        return ret
+
+    def estimate_move_ms(self, from_angle: float, to_angle: float) -> int:
+        """Predicted duration of a rotation between two machine angles in ms, including the settle time (e.g. for planning a program).
+           Unlike plan(), it does not depend on the current position of the motors.
+        """
+        from_angle = max(min(from_angle, self.max_angle_deg), self.min_angle_deg)
+        to_angle = max(min(to_angle, self.max_angle_deg), self.min_angle_deg)
+        if from_angle == to_angle:
+            return 0
+        ret = 0
+        for i, motor in enumerate(self.motors):
+            f = self.motor_angle_factors[i]
+            if hasattr(motor, 'rotate_segments'):
+                steps = motor.angle_to_steps(to_angle * f) - motor.angle_to_steps(from_angle * f)
+                ms = motor.estimate_move_ms([steps]) if steps != 0 else 0
+            else:
+                ms = motor.move_duration_ms(to_angle * f, from_angle * f)
+            ret = max(ret, ms)
+        return ret + self.settle_ms
+
+    def _start_stepper(self, motor, target_steps: int):
+        steps = target_steps - motor.read_position_steps()
+        if steps == 0:
+            self._motor_arrived(motor)
+            return
+        motor.rotate_segments([steps], op_complete_callback=self._motor_arrived)
+
+    def _motor_arrived(self, motor):
+        if self._waiting_motors > 0:
+            self._waiting_motors -= 1
+        if self._waiting_motors > 0:
+            return
+        self.last_move_ms = time.ticks_diff(time.ticks_ms(), self._move_t0)
+        if self.debug:
+            print(f"MachineRotator #{self.mr_index}: arrived at {self.target_angle} degrees after {self.last_move_ms} ms (planned: {self.planned_ms} ms).")
+        if self.settle_ms > 0:
+            if self._settle_timer is None:
+                self._settle_timer = Timer()
+            self._settle_timer.init(mode=Timer.ONE_SHOT, period=self.settle_ms, callback=self._settled)
+        else:
+            self._settled(None)
+
+    def _settled(self, timer):
+        self.current_angle = self.target_angle
+        self._moving = False
+        callback = self._op_complete_callback
+        self._op_complete_callback = None
+        if self._pending_angle is not None:
+            angle = self._pending_angle
+            self._pending_angle = None
+            self.rotate(angle, self._pending_callback)
+            self._pending_callback = None
+        if callback is not None:
+            callback(self)
+
+    def is_settled(self) -> bool:
+        """True if no rotation is running, i.e. the aim can be relied on."""
+        return not self._moving
+
+    def set_home(self):
+        """Declares the current position of all motors as machine angle 0, e.g. after mounting or a manual correction."""
+        if self._moving:
+            raise ImplementationException(f"MachineRotator #{self.mr_index}: cannot set the home position while rotating.")
+        for motor in self.motors:
+            if hasattr(motor, 'reset_position'):
+                motor.reset_position(0)
+        self.current_angle = self.target_angle = 0.0
+
+    def stop(self):
+        """Stops all motors immediately. The rotation is not completed, the current angle is unknown until the next rotation."""
+        for t in self._start_timers:
+            if t is not None:
+                t.deinit()
+        if self._settle_timer is not None:
+            self._settle_timer.deinit()
+        for motor in self.motors:
+            if hasattr(motor, 'rotate_segments'):
+                motor.stop()
+        self._moving = False
+        self._pending_angle = None
+        self._op_complete_callback = None
+
+    def getStatusData(self):
+        return {
+            'axis': self.axis,
+            'current_angle': self.current_angle,
+            'target_angle': self.target_angle,
+            'settled': self.is_settled(),
+            'planned_ms': self.planned_ms,
+            'last_move_ms': self.last_move_ms,
+        }
 
     def getConfigData(self):
         return {
             "mr_index": self.mr_index,
             "debug": self.debug,
+            "axis": self.axis,
             "min_angle_deg": self.min_angle_deg, 
             "max_angle_deg": self.max_angle_deg,
+            "settle_ms": self.settle_ms,
             "motors": [motor.getConfigData() for motor in self.motors],
             "motor_settings": [{'angle_factor': self.motor_angle_factors[i]} for i in range(len(self.motor_angle_factors))],
         }
@@ -56,8 +236,13 @@ class MachineRotator:
     def setConfigData(self, data):
         self.mr_index = int(data.get("mr_index", 0))
         self.debug = bool(data.get("debug", False))
+        axis = data.get("axis", AXIS_PAN)
+        if axis not in AXES:
+            raise ConfigurationException(f"MachineRotator #{self.mr_index}: invalid axis '{axis}', must be one of {AXES}.")
+        self.axis = axis
         self.min_angle_deg = float(data.get("min_angle_deg", -45.0))
         self.max_angle_deg = float(data.get("max_angle_deg", 45.0))
+        self.settle_ms = int(data.get("settle_ms", 50))
         self.motors = []
         for cfg_mot in data["motors"]:
             if cfg_mot.get('type') == 'StepMotorPIO':
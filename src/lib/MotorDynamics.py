@@ -0,0 +1,88 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List, Union
+import math
+
+DEFAULT_TAU_UP_MS = 400
+DEFAULT_TAU_DOWN_MS = 700
+
+class MotorDynamics:
+    """First-order response model of the ball driver motors.
+       The 130 size DC motors are slow compared to the shot intervals, esp. when slowing down (no active braking).
+       So each motor has its own time constant per direction (speeding up / slowing down), which can be identified
+       in a calibration run. The model predicts how long a motor needs to get from one speed to another.
+    """
+    def __init__(self, motor_count: int, tau_up_ms: Union[List[int], None] = None, tau_down_ms: Union[List[int], None] = None, tolerance_pct: float = 3.0) -> None:
+        """Parameters:
+           motor_count:   number of motors of the ball driver.
+           tau_up_ms:     time constant per motor when speeding up (ms).
+           tau_down_ms:   time constant per motor when slowing down or reversing (ms).
+           tolerance_pct: a motor is considered at speed when it deviates less than this from the target (percent points).
+        """
+        self.tau_up_ms = list(tau_up_ms) if tau_up_ms and len(tau_up_ms) == motor_count else [DEFAULT_TAU_UP_MS] * motor_count
+        self.tau_down_ms = list(tau_down_ms) if tau_down_ms and len(tau_down_ms) == motor_count else [DEFAULT_TAU_DOWN_MS] * motor_count
+        self.tolerance_pct = tolerance_pct
+
+    def motor_time_to_speed_ms(self, motor_index: int, from_pct: int, to_pct: int) -> int:
+        """Predicts the time (ms) a single motor needs to get within tolerance of its new speed."""
+        delta = abs(to_pct - from_pct)
+        if delta <= self.tolerance_pct:
+            return 0
+        if abs(to_pct) > abs(from_pct) and (to_pct >= 0) == (from_pct >= 0):
+            tau = self.tau_up_ms[motor_index]
+        else:
+            tau = self.tau_down_ms[motor_index]
+        # first order: deviation = delta * exp(-t/tau) --> t = tau * ln(delta/tolerance)
+        return int(tau * math.log(delta / self.tolerance_pct) + 0.5)
+
+    def time_to_speed_ms(self, from_speeds, to_speeds) -> int:
+        """Predicts the time (ms) until all motors run at their new speeds."""
+        t = 0
+        for i in range(min(len(from_speeds), len(to_speeds))):
+            t_mot = self.motor_time_to_speed_ms(i, from_speeds[i], to_speeds[i])
+            if t_mot > t:
+                t = t_mot
+        return t
+
+    def getConfigData(self) -> dict:
+        return {
+            'tau_up_ms': self.tau_up_ms,
+            'tau_down_ms': self.tau_down_ms,
+            'tolerance_pct': self.tolerance_pct,
+        }
+
+    def setConfigData(self, data: dict) -> dict:
+        n = len(self.tau_up_ms)
+        tmp = data.get('tau_up_ms')
+        if tmp is not None and len(tmp) == n:
+            self.tau_up_ms = [int(t) for t in tmp]
+        tmp = data.get('tau_down_ms')
+        if tmp is not None and len(tmp) == n:
+            self.tau_down_ms = [int(t) for t in tmp]
+        tmp = data.get('tolerance_pct')
+        if tmp is not None:
+            self.tolerance_pct = float(tmp)
+        return self.getConfigData()
+
+def identify_time_constant(times_ms: List[int], values: List[float]) -> int:
+    """Identifies the time constant (ms) of a recorded step response.
+       values must start at the old steady state and end at the new one, the time constant is the time
+       to cover 63.2% of the difference. Returns 0 if the response did not change at all.
+    """
+    start = values[0]
+    end = values[-1]
+    delta = end - start
+    if delta == 0:
+        return 0
+    threshold = start + delta * (1.0 - math.exp(-1.0))
+    for i in range(1, len(values)):
+        if (delta > 0 and values[i] >= threshold) or (delta < 0 and values[i] <= threshold):
+            # interpolate between the samples around the threshold
+            v0 = values[i - 1]
+            frac = (threshold - v0) / (values[i] - v0) if values[i] != v0 else 0.0
+            return int(times_ms[i - 1] + frac * (times_ms[i] - times_ms[i - 1]) - times_ms[0] + 0.5)
+    return times_ms[-1] - times_ms[0]
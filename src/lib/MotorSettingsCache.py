@@ -0,0 +1,75 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List, Union
+
+class MotorSettingsCache:
+    """Bounded LRU cache for the motor settings of a ball driver, keyed by the quantised shot parameters.
+       Programs usually repeat the same few shots, so the motor speeds are calculated only once per shot and geometry.
+       The key is packed into a single small int instead of a tuple, so the dict lookup itself is cheap. The quantisation
+       in key() is float math, which does allocate on MicroPython, so shots already holding their motor settings
+       (Shot.MotorSettings) should not be looked up at all.
+       The cache must be invalidated whenever the driver's geometry or motor config changes.
+    """
+    def __init__(self, max_entries: int = 32, resolution: int = 200) -> None:
+        """Parameters:
+           max_entries: max. number of cached shots, the least recently used entry is dropped when exceeded.
+           resolution:  quantisation steps per unit of speed/spin (200 -> 0.005). Must stay <= 200, so that keys remain small ints.
+        """
+        self.max_entries = max(int(max_entries), 1)
+        self.resolution = min(max(int(resolution), 1), 200)
+        self._span = 2 * self.resolution + 1
+        self._entries = {}
+        """key -> [motor speeds, last use]"""
+        self._clock = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, v_ball_norm: float, w_h_norm: float, w_v_norm: float) -> int:
+        """Returns the quantised key for the shot parameters (values are expected between -1 and +1)."""
+        r = self.resolution
+        q_v = min(max(int(v_ball_norm * r + (0.5 if v_ball_norm >= 0 else -0.5)), -r), r) + r
+        q_h = min(max(int(w_h_norm * r + (0.5 if w_h_norm >= 0 else -0.5)), -r), r) + r
+        q_w = min(max(int(w_v_norm * r + (0.5 if w_v_norm >= 0 else -0.5)), -r), r) + r
+        return (q_v * self._span + q_h) * self._span + q_w
+
+    def get(self, key: int) -> Union[List[int], None]:
+        """Returns the cached motor speeds or None. The returned list is shared and must not be modified."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._clock += 1
+        entry[1] = self._clock
+        return entry[0]
+
+    def put(self, key: int, motor_speeds: List[int]) -> None:
+        if key not in self._entries and len(self._entries) >= self.max_entries:
+            # MicroPython dicts are not ordered, so the LRU entry is searched (the cache is small)
+            lru_key = None
+            lru_clock = self._clock + 1
+            for k, e in self._entries.items():
+                if e[1] < lru_clock:
+                    lru_key = k
+                    lru_clock = e[1]
+            del self._entries[lru_key]
+        self._clock += 1
+        self._entries[key] = [motor_speeds, self._clock]
+
+    def invalidate(self) -> None:
+        """Drops all entries, e.g. after a geometry or config change."""
+        self._entries = {}
+
+    def getStatusData(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total > 0 else 0.0,
+        }
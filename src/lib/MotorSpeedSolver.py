@@ -0,0 +1,222 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List, Union
+from array import array
+import math
+import time
+from RobbyExceptions import ConfigurationException
+
+PIVOT_EPSILON = 1e-9
+Q_BITS = 12
+"""Fractional bits of the fixed-point coefficients."""
+INPUT_SCALE = 1000
+"""Fixed-point inputs are given in 1/1000 (per mille) of the normalized values."""
+_PCT_DIVISOR = (1 << Q_BITS) * INPUT_SCALE // 100
+_FULL_SCALE = (1 << Q_BITS) * INPUT_SCALE
+
+class MotorSpeedSolver:
+    """Translates the requested ball parameters (speed, topspin, sidespin) into the speeds of any number of ball driver wheels.
+
+       Each wheel touches the ball at its motor angle (0° top, 90° left, 180° bottom, 270° right in the machine's forward axial view).
+       The model used for a wheel i with normalized surface speed s_i is:
+       - ball speed = mean of all s_i
+       - topspin    = sum(s_i * cos(a_i)) / sum(|cos(a_i)|)
+       - sidespin   = sum(s_i * sin(a_i)) / sum(|sin(a_i)|)
+       This is a linear 3 x n system A*s = (speed, topspin, sidespin). Its pseudo-inverse only depends on the geometry,
+       so it is calculated once whenever the geometry changes and each shot is just a small matrix-vector product.
+       Components which cannot be controlled by the geometry (e.g. sidespin with two wheels at top and bottom) are ignored.
+    """
+    def __init__(self, motor_angles: List[float], wheel_diameters: Union[List[float], None] = None) -> None:
+        self.motor_angles = []
+        self.wheel_diameters = []
+        self.matrix = []
+        """Pseudo-inverse of the geometry (n rows with 3 columns), already scaled by the wheel diameters."""
+        self.controllable = (False, False, False)
+        """Flags telling which of (speed, topspin, sidespin) can be controlled with the current geometry."""
+        self.matrix_q = array('i')
+        """The matrix as fixed-point coefficients (Q12), flattened to n*3 values."""
+        self._speeds = []
+        self.update_geometry(motor_angles, wheel_diameters)
+
+    def update_geometry(self, motor_angles: List[float], wheel_diameters: Union[List[float], None] = None) -> None:
+        """Recalculates the pseudo-inverse for the given geometry. Must be called whenever motor angles or wheel diameters change."""
+        n = len(motor_angles)
+        if n == 0:
+            raise ConfigurationException("MotorSpeedSolver: at least one motor angle is required.")
+        if wheel_diameters is None or len(wheel_diameters) != n:
+            wheel_diameters = [0.04 for _ in range(n)]
+        for d in wheel_diameters:
+            if d <= 0:
+                raise ConfigurationException(f"MotorSpeedSolver: invalid wheel diameter {d}.")
+        self.motor_angles = [float(a) for a in motor_angles]
+        self.wheel_diameters = [float(d) for d in wheel_diameters]
+
+        rows = [[1.0 / n for _ in range(n)]]
+        cos_a = [math.cos(a / 180.0 * math.pi) for a in self.motor_angles]
+        sin_a = [math.sin(a / 180.0 * math.pi) for a in self.motor_angles]
+        for eff in (cos_a, sin_a):
+            norm = sum([abs(e) for e in eff])
+            rows.append([e / norm for e in eff] if norm > 1e-6 else None)
+
+        # drop components which are linearly dependent on the ones before (or not controllable at all)
+        used = []
+        for r in range(3):
+            if rows[r] is None:
+                continue
+            if _invert([rows[u] for u in used] + [rows[r]]) is not None:
+                used.append(r)
+        a = [rows[u] for u in used]
+        g_inv = _invert(a)
+        # pseudo-inverse: A^T * (A * A^T)^-1, expanded to 3 columns (zeros for unused components)
+        d_max = max(self.wheel_diameters)
+        matrix = []
+        for i in range(n):
+            # wheels with a smaller diameter must turn faster for the same surface speed
+            scale = d_max / self.wheel_diameters[i]
+            row = [0.0, 0.0, 0.0]
+            for k in range(len(used)):
+                row[used[k]] = scale * sum([a[j][i] * g_inv[j][k] for j in range(len(used))])
+            matrix.append(row)
+        self.matrix = matrix
+        self.matrix_q = array('i', [int(round(c * (1 << Q_BITS))) for row in matrix for c in row])
+        self.controllable = (0 in used, 1 in used, 2 in used)
+        self._speeds = [0.0 for _ in range(n)]
+
+    def solve(self, v_ball_norm: float, w_h_norm: float, w_v_norm: float) -> List[int]:
+        """Calculates the motor speeds in % (-100 to +100) for already limited, normalized ball parameters.
+           If a wheel would exceed its max. speed, all speeds are scaled down linearly, which changes rotation and speed,
+           but might be the best compromise.
+        """
+        speeds = self._speeds
+        hi = 0.0
+        lo = 0.0
+        for i in range(len(speeds)):
+            row = self.matrix[i]
+            s = row[0] * v_ball_norm + row[1] * w_h_norm + row[2] * w_v_norm
+            speeds[i] = s
+            if s > hi:
+                hi = s
+            elif s < lo:
+                lo = s
+        scale = 100.0
+        if hi > 1.0 or -lo > 1.0:
+            scale = 100.0 / max(hi, -lo)
+        return [int(s * scale) for s in speeds]
+
+    def solve_fixed(self, out, v_ball_pm: int, w_h_pm: int, w_v_pm: int) -> None:
+        """Fixed-point variant of solve() without any float math or memory allocation, e.g. for use in timer callbacks.
+           Parameters:
+           out: caller-supplied array('h') with one element per motor, receiving the speeds in % (-100 to +100).
+           v_ball_pm, w_h_pm, w_v_pm: already limited ball parameters in 1/1000 (e.g. 750 for 0.75).
+        """
+        m = self.matrix_q
+        hi = 0
+        lo = 0
+        # first pass: find the peak of the raw sums (Q12 * per mille), they are recalculated below instead of being buffered
+        for i in range(len(out)):
+            j = i * 3
+            s = m[j] * v_ball_pm + m[j + 1] * w_h_pm + m[j + 2] * w_v_pm
+            if s > hi:
+                hi = s
+            elif s < lo:
+                lo = s
+        peak = hi if hi > -lo else -lo
+        divisor = _PCT_DIVISOR if peak <= _FULL_SCALE else peak // 100
+        for i in range(len(out)):
+            j = i * 3
+            s = m[j] * v_ball_pm + m[j + 1] * w_h_pm + m[j + 2] * w_v_pm
+            # truncate towards zero like int() does in solve()
+            out[i] = s // divisor if s >= 0 else -((-s) // divisor)
+
+    def getConfigData(self) -> dict:
+        return {
+            'motor_angles': self.motor_angles,
+            'wheel_diameters': self.wheel_diameters,
+            'controllable': {'speed': self.controllable[0], 'topspin': self.controllable[1], 'sidespin': self.controllable[2]},
+        }
+
+def _invert(m: List[List[float]]) -> Union[List[List[float]], None]:
+    """Returns the inverse of the gram matrix m * m^T (Gauss-Jordan), or None if it is singular."""
+    k = len(m)
+    g = [[sum([m[r][i] * m[c][i] for i in range(len(m[r]))]) for c in range(k)] + [1.0 if c == r else 0.0 for c in range(k)] for r in range(k)]
+    for col in range(k):
+        pivot = max(range(col, k), key=lambda r: abs(g[r][col]))
+        if abs(g[pivot][col]) < PIVOT_EPSILON:
+            return None
+        g[col], g[pivot] = g[pivot], g[col]
+        p = g[col][col]
+        g[col] = [x / p for x in g[col]]
+        for r in range(k):
+            if r != col and g[r][col] != 0.0:
+                f = g[r][col]
+                g[r] = [g[r][c] - f * g[col][c] for c in range(2 * k)]
+    return [row[k:] for row in g]
+
+def run_benchmark(solver: MotorSpeedSolver, iterations: int = 1000) -> float:
+    """Measures the average duration of a single solve() and solve_fixed() call in microseconds (to be run on the device).
+       Returns the duration of solve().
+    """
+    ticks_us = getattr(time, 'ticks_us', lambda: int(time.time() * 1000000))
+    t0 = ticks_us()
+    for i in range(iterations):
+        solver.solve(0.75, (i % 21 - 10) / 10.0, (i % 11 - 5) / 5.0)
+    duration = (ticks_us() - t0) / iterations
+    out = array('h', [0] * len(solver.motor_angles))
+    t0 = ticks_us()
+    for i in range(iterations):
+        solver.solve_fixed(out, 750, (i % 21 - 10) * 100, (i % 11 - 5) * 200)
+    duration_fixed = (ticks_us() - t0) / iterations
+    print(f"MotorSpeedSolver: {len(solver.motor_angles)} motors, {duration} us per shot (fixed-point: {duration_fixed} us).")
+    return duration
+
+def verify_fixed_point(solver: MotorSpeedSolver, steps: int = 21) -> int:
+    """Compares solve_fixed() with the float reference solve() on a grid of shots (runs on host and device).
+       Returns the max. deviation in percent points, which must not exceed 1 (rounding of the Q12 coefficients).
+    """
+    out = array('h', [0] * len(solver.motor_angles))
+    max_dev = 0
+    for i_v in range(1, steps + 1):
+        v_pm = i_v * INPUT_SCALE // steps
+        for i_h in range(steps):
+            w_h_pm = (2 * i_h - (steps - 1)) * INPUT_SCALE // (steps - 1)
+            for i_w in range(steps):
+                w_v_pm = (2 * i_w - (steps - 1)) * INPUT_SCALE // (steps - 1)
+                ref = solver.solve(v_pm / INPUT_SCALE, w_h_pm / INPUT_SCALE, w_v_pm / INPUT_SCALE)
+                solver.solve_fixed(out, v_pm, w_h_pm, w_v_pm)
+                for m in range(len(out)):
+                    dev = abs(out[m] - ref[m])
+                    if dev > max_dev:
+                        max_dev = dev
+                        if dev > 1:
+                            print(f"MotorSpeedSolver: fixed-point deviation {dev} at ({v_pm}, {w_h_pm}, {w_v_pm}), motor {m}: {out[m]} vs. {ref[m]}")
+    return max_dev
+
+def verify_against_numpy(solver: MotorSpeedSolver, steps: int = 11) -> float:
+    """Compares the solver on the host with a NumPy least-squares reference on a grid of shots.
+       Returns the max. deviation in percent points (only rounding differences are expected).
+    """
+    import numpy as np
+    n = len(solver.motor_angles)
+    rad = np.radians(solver.motor_angles)
+    rows = [np.full(n, 1.0 / n)]
+    for eff in (np.cos(rad), np.sin(rad)):
+        norm = np.abs(eff).sum()
+        rows.append(eff / norm if norm > 1e-6 else np.zeros(n))
+    a = np.array(rows)
+    scale = max(solver.wheel_diameters) / np.array(solver.wheel_diameters)
+    max_dev = 0.0
+    for v in np.linspace(0.1, 1.0, steps):
+        for w_h in np.linspace(-1.0, 1.0, steps):
+            for w_v in np.linspace(-1.0, 1.0, steps):
+                target = np.array([v, w_h, w_v]) * np.array(solver.controllable, dtype=float)
+                ref = np.linalg.pinv(a, rcond=1e-9) @ target * scale
+                peak = max(ref.max(), -ref.min())
+                if peak > 1.0:
+                    ref = ref / peak
+                dev = np.abs(np.array(solver.solve(v, w_h, w_v)) - ref * 100.0).max()
+                max_dev = max(max_dev, float(dev))
+    return max_dev
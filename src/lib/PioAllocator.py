@@ -0,0 +1,141 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List, Union
+try:
+    import rp2
+except ImportError:
+    rp2 = None # host environment: allocations are only bookkept
+from RobbyExceptions import ConfigurationException
+
+PIO_BLOCKS = 2
+SMS_PER_BLOCK = 4
+INSTRUCTION_MEMORY = 32
+"""Instructions per PIO block"""
+WIFI_BLOCK = 1
+WIFI_STATE_MACHINES = (0, 1)
+WIFI_INSTRUCTIONS = 10
+"""Approx. size of the cyw43 SPI program loaded by the WLAN driver (Pico W)"""
+IRQ_SM0 = 0x100
+"""Trigger bit of PIO irq flag 0 (flag n: IRQ_SM0 << n)"""
+
+class PioAllocator:
+    """Keeps track of the state machines and the instruction memory of both PIO blocks, so that several step motors,
+       tachometers etc. can share the PIO without hard-coded state machine indices.
+       Identical programs are loaded only once per block and shared between their users.
+       Each block has a single irq handler, which dispatches the irq flags 0-3 to the handler registered for the
+       state machine with the same index (i.e. the flag a program raises with irq(rel(0))).
+    """
+    def __init__(self, reserve_wifi: bool = True) -> None:
+        """Parameters:
+           reserve_wifi: reserve the state machines and instruction memory the WLAN driver uses on PIO1 (Pico W).
+        """
+        self._owners = [[None] * SMS_PER_BLOCK for _ in range(PIO_BLOCKS)]
+        """owner name per block and state machine, None if free"""
+        self._programs = [[] for _ in range(PIO_BLOCKS)]
+        """loaded programs per block: [program, name, length, state machine indices]"""
+        self._sm_programs = [[None] * SMS_PER_BLOCK for _ in range(PIO_BLOCKS)]
+        self._reserved_instructions = [0] * PIO_BLOCKS
+        self._irq_handlers = [[None] * SMS_PER_BLOCK for _ in range(PIO_BLOCKS)]
+        self._irq_installed = [False] * PIO_BLOCKS
+        if reserve_wifi:
+            for sm in WIFI_STATE_MACHINES:
+                self._owners[WIFI_BLOCK][sm] = 'WLAN'
+            self._reserved_instructions[WIFI_BLOCK] = WIFI_INSTRUCTIONS
+
+    def free_instructions(self, block: int) -> int:
+        used = self._reserved_instructions[block]
+        for entry in self._programs[block]:
+            used += entry[2]
+        return INSTRUCTION_MEMORY - used
+
+    def _find_program(self, block: int, program) -> Union[list, None]:
+        for entry in self._programs[block]:
+            if entry[0] is program:
+                return entry
+        return None
+
+    def allocate(self, owner: str, program, name: str, preferred_block: int = 0, preferred_sm: Union[int, None] = None) -> int:
+        """Reserves a state machine for the program and returns its id (0-7, as expected by rp2.StateMachine).
+           The preferred block is tried first, then the other one. Within a block the preferred state machine is used if free.
+           Raises a ConfigurationException if no block has a free state machine and enough instruction memory left.
+        """
+        length = program_length(program)
+        blocks = [preferred_block] + [b for b in range(PIO_BLOCKS) if b != preferred_block]
+        for block in blocks:
+            owners = self._owners[block]
+            free = [i for i in range(SMS_PER_BLOCK) if owners[i] is None]
+            if not free:
+                continue
+            entry = self._find_program(block, program)
+            if entry is None and self.free_instructions(block) < length:
+                continue
+            sm = preferred_sm if preferred_sm in free else free[0]
+            if entry is None:
+                entry = [program, name, length, []]
+                self._programs[block].append(entry)
+            entry[3].append(sm)
+            owners[sm] = owner
+            self._sm_programs[block][sm] = entry
+            return block * SMS_PER_BLOCK + sm
+        raise ConfigurationException(f"No PIO resources left for {owner} (program '{name}' with {length} instructions). Allocations: {self.getStatusData()}")
+
+    def release(self, sm_id: Union[int, None]) -> None:
+        """Frees the state machine and unloads its program, if no other state machine uses it anymore."""
+        if sm_id is None:
+            return
+        block = sm_id // SMS_PER_BLOCK
+        sm = sm_id % SMS_PER_BLOCK
+        entry = self._sm_programs[block][sm]
+        if rp2:
+            rp2.StateMachine(sm_id).active(0)
+        self._owners[block][sm] = None
+        self._sm_programs[block][sm] = None
+        self._irq_handlers[block][sm] = None
+        if entry is None:
+            return
+        entry[3].remove(sm)
+        if not entry[3]:
+            self._programs[block].remove(entry)
+            if rp2:
+                try:
+                    rp2.PIO(block).remove_program(entry[0])
+                except Exception as e:
+                    print(f"PioAllocator: could not remove program '{entry[1]}' from PIO{block}: {e}")
+
+    def register_irq(self, sm_id: int, handler) -> None:
+        """Registers the handler for the irq flag raised by the state machine with irq(rel(0)). The handler receives the PIO object."""
+        block = sm_id // SMS_PER_BLOCK
+        self._irq_handlers[block][sm_id % SMS_PER_BLOCK] = handler
+        if rp2 and not self._irq_installed[block]:
+            rp2.PIO(block).irq(lambda pio, b=block: self._dispatch_irq(b, pio))
+            self._irq_installed[block] = True
+
+    def _dispatch_irq(self, block: int, pio) -> None:
+        flags = pio.irq().flags()
+        handlers = self._irq_handlers[block]
+        for i in range(SMS_PER_BLOCK):
+            if flags & (IRQ_SM0 << i) and handlers[i] is not None:
+                handlers[i](pio)
+
+    def getStatusData(self) -> list:
+        ret = []
+        for block in range(PIO_BLOCKS):
+            ret.append({
+                'block': block,
+                'state_machines': self._owners[block],
+                'programs': [{'name': e[1], 'instructions': e[2], 'state_machines': e[3]} for e in self._programs[block]],
+                'reserved_instructions': self._reserved_instructions[block],
+                'free_instructions': self.free_instructions(block),
+            })
+        return ret
+
+def program_length(program) -> int:
+    """Number of instructions of a program created by @rp2.asm_pio."""
+    return len(program[0])
+
+allocator = PioAllocator()
+"""The allocator shared by all PIO users of the machine."""
@@ -0,0 +1,591 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+"""Cycle-accurate emulator for the PIO programs of this project, to be used on the host (CPython) only.
+
+   The programs are written with the same DSL as for @rp2.asm_pio, so modules with PIO programs can fall back to the
+   assembler of this module (see StepMotorPrograms), and the emulated state machines behave like rp2.StateMachine
+   (put(), get(), exec(), tx_fifo(), ...). Each executed instruction takes one tick plus its delay, stalls take one tick
+   per retry, exactly like on the RP2040. Pin writes are recorded with their tick, so the coil patterns of a move can be
+   checked and timed.
+
+   Supported instructions: jmp (all conditions), wait (gpio, pin, irq), in_, out, push, pull, mov (incl. invert/reverse),
+   irq (set, wait, clear, rel), set, nop, as well as label, wrap_target, wrap and delays.
+   Not supported: side-set, autopush/autopull, status and exec as mov/out operands.
+"""
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List, Union
+import builtins
+import types
+
+MASK32 = 0xFFFFFFFF
+
+class _Operand:
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __repr__(self) -> str:
+        return self.name
+
+_OPERANDS = {name: _Operand(name) for name in (
+    'pins', 'x', 'y', 'null', 'isr', 'osr', 'pc', 'pindirs', 'exec', 'status', 'gpio', 'pin',
+    'block', 'noblock', 'clear', 'ifempty', 'iffull', 'not_x', 'not_y', 'x_dec', 'y_dec', 'x_not_y', 'not_osre')}
+
+class Instruction:
+    """One assembled instruction. The delay is set by indexing, as in set(pins, 1) [7]."""
+    def __init__(self, op: str, args: tuple) -> None:
+        self.op = op
+        self.args = args
+        self.delay = 0
+
+    def __getitem__(self, delay: int) -> 'Instruction':
+        self.delay = delay
+        return self
+
+    def __repr__(self) -> str:
+        return f"{self.op}{self.args}" + (f" [{self.delay}]" if self.delay else '')
+
+class _Assembler:
+    def __init__(self) -> None:
+        self.instructions = []
+        self.labels = {}
+        self.wrap_target = None
+        self.wrap = None
+        ns = {'__builtins__': builtins}
+        ns.update(_OPERANDS)
+        ns.update({
+            'label': lambda name: self.labels.__setitem__(name, len(self.instructions)),
+            'wrap_target': lambda: setattr(self, 'wrap_target', len(self.instructions)),
+            'wrap': lambda: setattr(self, 'wrap', len(self.instructions) - 1),
+            'jmp': self._jmp,
+            'wait': lambda polarity, src, index: self._emit('wait', polarity, 'irq' if src is ns['irq'] else src.name, index),
+            'in_': lambda src, bits: self._emit('in', src, bits),
+            'out': lambda dst, bits: self._emit('out', dst, bits),
+            'push': lambda *args: self._emit('push', _OPERANDS['iffull'] in args, _OPERANDS['noblock'] not in args),
+            'pull': lambda *args: self._emit('pull', _OPERANDS['ifempty'] in args, _OPERANDS['noblock'] not in args),
+            'mov': lambda dst, src: self._emit('mov', dst, src),
+            'irq': self._irq,
+            'set': lambda dst, value: self._emit('set', dst, value),
+            'nop': lambda: self._emit('mov', _OPERANDS['y'], _OPERANDS['y']),
+            'rel': lambda index: ('rel', index),
+            'invert': lambda src: ('invert', src),
+            'reverse': lambda src: ('reverse', src),
+        })
+        self.namespace = ns
+
+    def _emit(self, op: str, *args) -> Instruction:
+        instr = Instruction(op, args)
+        self.instructions.append(instr)
+        return instr
+
+    def _jmp(self, cond, target=None) -> Instruction:
+        if target is None:
+            cond, target = None, cond
+        return self._emit('jmp', cond.name if cond is not None else None, target)
+
+    def _irq(self, mode, index=None) -> Instruction:
+        if index is None:
+            mode, index = None, mode
+        return self._emit('irq', mode.name if mode is not None else 'set', index)
+
+    def resolve(self) -> None:
+        for instr in self.instructions:
+            if instr.op == 'jmp' and isinstance(instr.args[1], str):
+                instr.args = (instr.args[0], self.labels[instr.args[1]])
+
+def asm_pio(**settings):
+    """Decorator like @rp2.asm_pio: assembles the program for the emulator.
+       The result is a list (instructions first, like the one of rp2), see EmulatedStateMachine for its use.
+    """
+    def assemble(fn):
+        asm = _Assembler()
+        # like rp2.asm_pio, the instructions are provided as globals of the program function
+        types.FunctionType(fn.__code__, asm.namespace, fn.__name__, fn.__defaults__, fn.__closure__)()
+        asm.resolve()
+        n = len(asm.instructions)
+        wrap_target = asm.wrap_target if asm.wrap_target is not None else 0
+        wrap = asm.wrap if asm.wrap is not None else n - 1
+        return [asm.instructions, dict(settings), wrap_target, wrap, fn.__name__]
+    return assemble
+
+class _PIO:
+    OUT_LOW = 0
+    OUT_HIGH = 1
+    IN_LOW = 0
+    IN_HIGH = 1
+    SHIFT_LEFT = 0
+    SHIFT_RIGHT = 1
+    JOIN_NONE = 0
+    JOIN_TX = 1
+    JOIN_RX = 2
+
+class _Rp2:
+    """The parts of the rp2 module needed to assemble programs on the host."""
+    PIO = _PIO
+    asm_pio = staticmethod(asm_pio)
+
+rp2 = _Rp2()
+
+class EmulatedPio:
+    """A PIO block: the GPIO levels and the irq flags shared by its state machines."""
+    def __init__(self) -> None:
+        self.pins = 0
+        """levels of GPIO 0-31 (outputs written by the state machines as well as inputs set by the caller)"""
+        self.irq_flags = 0
+        self.irq_log = []
+        """(state machine index, tick, flag) of each system irq (flags 0-3) raised by a program"""
+        self.irq_handler = None
+        """optional callable(state machine), called for each system irq. The flag is cleared afterwards (acknowledged)."""
+        self.state_machines = []
+
+    def state_machine(self, program, freq: int = 125000000, set_base: int = 0, out_base: int = 0, in_base: int = 0, jmp_pin: int = 0) -> 'EmulatedStateMachine':
+        sm = EmulatedStateMachine(self, len(self.state_machines), program, freq, set_base, out_base, in_base, jmp_pin)
+        self.state_machines.append(sm)
+        return sm
+
+    def set_pin(self, gpio: int, level: int) -> None:
+        if level:
+            self.pins |= 1 << gpio
+        else:
+            self.pins &= ~(1 << gpio)
+
+    def run(self, ticks: int) -> None:
+        """Runs all active state machines of the block in lockstep (one tick each per iteration)."""
+        for _ in range(ticks):
+            for sm in self.state_machines:
+                sm.step()
+
+class EmulatedStateMachine:
+    """Emulates a state machine running an assembled program, with the interface of rp2.StateMachine where it applies.
+       trace holds (tick, value) for each change of the output pins (set_base or out_base, 4 bits).
+    """
+    def __init__(self, pio: EmulatedPio, index: int, program, freq: int, set_base: int, out_base: int, in_base: int, jmp_pin: int) -> None:
+        self.pio = pio
+        self.index = index
+        self.instructions, settings, self.wrap_target, self.wrap, self.name = program
+        self.freq = freq
+        self.set_base = set_base
+        self.out_base = out_base
+        self.in_base = in_base
+        self.jmp_pin = jmp_pin
+        set_init = settings.get('set_init')
+        self.set_count = (len(set_init) if isinstance(set_init, tuple) else 1) if set_init is not None else 0
+        out_init = settings.get('out_init')
+        self.out_count = (len(out_init) if isinstance(out_init, tuple) else 1) if out_init is not None else 0
+        self.out_right = settings.get('out_shiftdir', _PIO.SHIFT_LEFT) == _PIO.SHIFT_RIGHT
+        self.in_right = settings.get('in_shiftdir', _PIO.SHIFT_LEFT) == _PIO.SHIFT_RIGHT
+        self.pull_thresh = settings.get('pull_thresh', 32)
+        self.push_thresh = settings.get('push_thresh', 32)
+        join = settings.get('fifo_join', _PIO.JOIN_NONE)
+        self.tx_depth = 8 if join == _PIO.JOIN_TX else (0 if join == _PIO.JOIN_RX else 4)
+        self.rx_depth = 8 if join == _PIO.JOIN_RX else (0 if join == _PIO.JOIN_TX else 4)
+        self.trace_base = set_base if self.set_count else out_base
+        self.trace = []
+        self.tick = 0
+        self.pc = 0
+        self.x = 0
+        self.y = 0
+        self.isr = 0
+        self.osr = 0
+        self._tx = []
+        self._rx = []
+        self._active = False
+        self.restart()
+
+    # --- rp2.StateMachine interface ---
+    def active(self, value: Union[int, None] = None) -> bool:
+        if value is not None:
+            self._active = bool(value)
+        return self._active
+
+    def restart(self) -> None:
+        self.isr_count = 0
+        self.osr_count = 32 # empty
+        self._delay = 0
+        self._irq_waiting = None
+
+    def put(self, value: int) -> None:
+        if len(self._tx) >= self.tx_depth:
+            raise RuntimeError(f"{self.name}: TX FIFO full (put() would block)")
+        self._tx.append(value & MASK32)
+
+    def get(self) -> int:
+        if not self._rx:
+            raise RuntimeError(f"{self.name}: RX FIFO empty (get() would block)")
+        return self._rx.pop(0)
+
+    def tx_fifo(self) -> int:
+        return len(self._tx)
+
+    def rx_fifo(self) -> int:
+        return len(self._rx)
+
+    def exec(self, instr: str) -> None:
+        """Executes a single instruction immediately, without advancing the program (except for jumps)."""
+        asm = _Assembler()
+        eval(instr, asm.namespace)
+        nxt = self._execute(asm.instructions[-1], self.pc)
+        if nxt is not None:
+            self.pc = nxt
+
+    # --- emulation ---
+    def time_us(self, tick: Union[int, None] = None) -> float:
+        return (self.tick if tick is None else tick) * 1000000.0 / self.freq
+
+    def step(self) -> None:
+        """Advances the state machine by a single tick."""
+        if not self._active:
+            return
+        self.tick += 1
+        if self._delay:
+            self._delay -= 1
+            return
+        instr = self.instructions[self.pc]
+        nxt = self._execute(instr, self.wrap_target if self.pc == self.wrap else self.pc + 1, self.tick - 1)
+        if nxt is not None:
+            self.pc = nxt
+            self._delay = instr.delay
+
+    def run(self, ticks: int) -> None:
+        """Runs the state machine on its own for the given number of ticks. Delays and self-loops of jmp x_dec/y_dec
+           are fast-forwarded, so long moves can be emulated quickly (the result is the same as with step()).
+        """
+        end = self.tick + ticks
+        while self._active and self.tick < end:
+            if self._fast_forward(end - self.tick):
+                continue
+            self.step()
+            if self._is_stalled():
+                self.tick = end # nothing can change without the caller
+                return
+
+    def run_until_irq(self, max_ticks: int = 100000000) -> Union[int, None]:
+        """Runs until the program raises a system irq. Returns the tick of the irq, None if the program stalled or max_ticks passed."""
+        n = len(self.pio.irq_log)
+        end = self.tick + max_ticks
+        while self._active and self.tick < end:
+            if self._fast_forward(end - self.tick):
+                continue
+            self.step()
+            if len(self.pio.irq_log) > n:
+                return self.pio.irq_log[n][1]
+            if self._is_stalled():
+                return None
+        return None
+
+    def _fast_forward(self, budget: int) -> bool:
+        if self._delay:
+            n = min(self._delay, budget)
+            self._delay -= n
+            self.tick += n
+            return True
+        instr = self.instructions[self.pc]
+        if instr.op != 'jmp' or instr.args[1] != self.pc or instr.args[0] not in ('x_dec', 'y_dec'):
+            return False
+        reg = 'x' if instr.args[0] == 'x_dec' else 'y'
+        value = getattr(self, reg)
+        loops = min(value + 1, budget // (1 + instr.delay))
+        if loops < 2:
+            return False
+        # the last iteration (if any) is executed by step(), so the fall-through is handled there
+        loops = min(loops, value)
+        setattr(self, reg, value - loops)
+        self.tick += loops * (1 + instr.delay)
+        return True
+
+    def _is_stalled(self) -> bool:
+        instr = self.instructions[self.pc]
+        if self._delay:
+            return False
+        if instr.op == 'pull' and instr.args[1] and not self._tx:
+            return not (instr.args[0] and self.osr_count < self.pull_thresh)
+        if instr.op == 'push' and instr.args[1] and len(self._rx) >= self.rx_depth:
+            return True
+        if instr.op == 'wait':
+            return not self._wait_satisfied(instr)
+        return False
+
+    def _irq_index(self, index) -> int:
+        if isinstance(index, tuple):
+            n = index[1]
+            return (n & 4) | ((n + self.index) & 3)
+        return index
+
+    def _read(self, src) -> int:
+        if isinstance(src, tuple):
+            v = self._read(src[1])
+            if src[0] == 'invert':
+                return ~v & MASK32
+            return int('{:032b}'.format(v)[::-1], 2)
+        name = src.name
+        if name == 'pins':
+            return (self.pio.pins >> self.in_base) & MASK32
+        if name == 'null':
+            return 0
+        return getattr(self, name)
+
+    def _write_pins(self, base: int, count: int, value: int, tick: int) -> None:
+        mask = ((1 << count) - 1) << base
+        old = self.pio.pins
+        self.pio.pins = (old & ~mask) | ((value << base) & mask)
+        if self.pio.pins != old:
+            self.trace.append((tick, (self.pio.pins >> self.trace_base) & 0xF))
+
+    def _wait_satisfied(self, instr: Instruction) -> bool:
+        polarity, src, index = instr.args
+        if src == 'gpio':
+            return (self.pio.pins >> index) & 1 == polarity
+        if src == 'pin':
+            return (self.pio.pins >> (self.in_base + index)) & 1 == polarity
+        flag = (self.pio.irq_flags >> self._irq_index(index)) & 1
+        return flag == polarity
+
+    def _execute(self, instr: Instruction, nxt: int, tick: Union[int, None] = None) -> Union[int, None]:
+        """Executes the instruction. Returns the next pc, or None if the instruction stalls."""
+        if tick is None:
+            tick = self.tick
+        op = instr.op
+        args = instr.args
+        if op == 'jmp':
+            cond, target = args
+            if cond is None:
+                take = True
+            elif cond == 'not_x':
+                take = self.x == 0
+            elif cond == 'not_y':
+                take = self.y == 0
+            elif cond == 'x_dec':
+                take = self.x != 0
+                self.x = (self.x - 1) & MASK32
+            elif cond == 'y_dec':
+                take = self.y != 0
+                self.y = (self.y - 1) & MASK32
+            elif cond == 'x_not_y':
+                take = self.x != self.y
+            elif cond == 'pin':
+                take = (self.pio.pins >> self.jmp_pin) & 1 == 1
+            else: # not_osre
+                take = self.osr_count < self.pull_thresh
+            return target if take else nxt
+        if op == 'pull':
+            ifempty, block = args
+            if ifempty and self.osr_count < self.pull_thresh:
+                return nxt
+            if self._tx:
+                self.osr = self._tx.pop(0)
+            elif block:
+                return None
+            else:
+                self.osr = self.x
+            self.osr_count = 0
+            return nxt
+        if op == 'push':
+            iffull, block = args
+            if iffull and self.isr_count < self.push_thresh:
+                return nxt
+            if len(self._rx) >= self.rx_depth:
+                if block:
+                    return None
+            else:
+                self._rx.append(self.isr)
+            self.isr = 0
+            self.isr_count = 0
+            return nxt
+        if op == 'out':
+            dst, bits = args
+            if self.out_right:
+                data = self.osr & ((1 << bits) - 1)
+                self.osr = self.osr >> bits if bits < 32 else 0
+            else:
+                data = self.osr >> (32 - bits)
+                self.osr = (self.osr << bits) & MASK32
+            self.osr_count = min(self.osr_count + bits, 32)
+            return self._write(dst, data, bits, nxt, tick)
+        if op == 'in':
+            src, bits = args
+            data = self._read(src) & ((1 << bits) - 1)
+            if self.in_right:
+                self.isr = ((self.isr >> bits) | (data << (32 - bits))) & MASK32 if bits < 32 else data
+            else:
+                self.isr = ((self.isr << bits) | data) & MASK32
+            self.isr_count = min(self.isr_count + bits, 32)
+            return nxt
+        if op == 'mov':
+            dst, src = args
+            value = self._read(src)
+            if dst.name == 'isr':
+                self.isr = value
+                self.isr_count = 0
+                return nxt
+            if dst.name == 'osr':
+                self.osr = value
+                self.osr_count = 0
+                return nxt
+            return self._write(dst, value, self.out_count, nxt, tick)
+        if op == 'set':
+            dst, value = args
+            if dst.name == 'pins':
+                self._write_pins(self.set_base, self.set_count, value, tick)
+                return nxt
+            return self._write(dst, value, self.set_count, nxt, tick)
+        if op == 'wait':
+            if not self._wait_satisfied(instr):
+                return None
+            if args[1] == 'irq' and args[0] == 1:
+                self.pio.irq_flags &= ~(1 << self._irq_index(args[2]))
+            return nxt
+        # irq
+        mode, index = args
+        bit = 1 << self._irq_index(index)
+        if mode == 'clear':
+            self.pio.irq_flags &= ~bit
+            return nxt
+        if self._irq_waiting is not None:
+            if self.pio.irq_flags & bit:
+                return None
+            self._irq_waiting = None
+            return nxt
+        self.pio.irq_flags |= bit
+        if bit < 0x10:
+            self.pio.irq_log.append((self.index, tick, self._irq_index(index)))
+            if self.pio.irq_handler:
+                self.pio.irq_handler(self)
+            self.pio.irq_flags &= ~bit
+        if mode == 'block' and self.pio.irq_flags & bit:
+            self._irq_waiting = bit
+            return None
+        return nxt
+
+    def _write(self, dst, value: int, bits: int, nxt: int, tick: int) -> int:
+        name = dst.name
+        if name == 'pins':
+            self._write_pins(self.out_base, self.out_count, value, tick)
+        elif name == 'x':
+            self.x = value & MASK32
+        elif name == 'y':
+            self.y = value & MASK32
+        elif name == 'isr':
+            self.isr = value & MASK32
+            self.isr_count = bits
+        elif name == 'pc':
+            return value
+        return nxt
+
+def count_phases(trace: list, patterns, start: Union[int, None] = None) -> int:
+    """Signed number of phases (coil pattern changes) in a pin trace: +1 for each change to the next pattern of the
+       (forward) patterns, -1 for each change to the previous one. start is the pattern the coils were in before the trace.
+    """
+    n = len(patterns)
+    phases = 0
+    prev = start
+    for _, value in trace:
+        if prev in patterns and value in patterns:
+            d = (patterns.index(value) - patterns.index(prev)) % n
+            if d == 1:
+                phases += 1
+            elif d == n - 1:
+                phases -= 1
+        prev = value
+    return phases
+
+def simulate_segments(segments: List[int], drive_mode: str = 'half', runner_freq: int = 20000) -> dict:
+    """Emulates a counted move of run_segments_pio (e.g. a feeder action cycle) and returns its duration and step count."""
+    from DriveMode import PATTERNS, ticks_per_cycle
+    from StepMotorPrograms import SEGMENT_PROGRAMS, encode_segment
+    patterns = PATTERNS[drive_mode]
+    pio = EmulatedPio()
+    pio.pins = patterns[-1] # coils at rest after a complete cycle
+    sm = pio.state_machine(SEGMENT_PROGRAMS[drive_mode], freq=runner_freq, set_base=0)
+    for i in range(len(segments)):
+        sm.put(encode_segment(segments[i], i == len(segments) - 1))
+    sm.active(1)
+    ticks = sm.run_until_irq()
+    phases = count_phases(sm.trace, patterns, patterns[-1])
+    return {
+        'ticks': ticks,
+        'duration_ms': ticks * 1000.0 / runner_freq if ticks is not None else None,
+        'steps': phases / len(patterns),
+        'ticks_per_step': (ticks / sum([abs(c) for c in segments])) if ticks else None,
+        'expected_ticks_per_step': ticks_per_cycle(drive_mode) + 1,
+    }
+
+def simulate_variable_speed(speed_rpm: float, full_rotation_steps: float = 511.0, drive_mode: str = 'half', duration_ms: int = 1000) -> dict:
+    """Emulates run_variable_pio at the given speed for duration_ms and returns the resulting speed."""
+    from DriveMode import PATTERNS, backward_patterns
+    from StepMotorPrograms import run_variable_pio, encode_patterns, variable_phase_delay, VARIABLE_SM_FREQ
+    patterns = PATTERNS[drive_mode]
+    pio = EmulatedPio()
+    pio.pins = patterns[-1]
+    sm = pio.state_machine(run_variable_pio, freq=VARIABLE_SM_FREQ, out_base=0)
+    sm.put(encode_patterns(patterns if speed_rpm > 0 else backward_patterns(drive_mode)))
+    sm.put(variable_phase_delay(abs(speed_rpm), full_rotation_steps, len(patterns)))
+    sm.active(1)
+    sm.run(duration_ms * VARIABLE_SM_FREQ // 1000)
+    steps = count_phases(sm.trace, patterns, patterns[-1]) / len(patterns)
+    return {
+        'steps': steps,
+        'speed_rpm': steps / full_rotation_steps * 60000.0 / duration_ms,
+    }
+
+def simulate_profile(profile, drive_mode: str = 'half') -> dict:
+    """Emulates run_profile_pio with the words of a StepProfile (steps = phases) and returns the duration."""
+    from array import array
+    from DriveMode import PATTERNS
+    from StepMotorPrograms import run_profile_pio, encode_profile, PROFILE_SM_FREQ
+    patterns = PATTERNS[drive_mode]
+    words = array('I', [0] * (profile.steps + 1))
+    offset, phase = encode_profile(profile.delays_us, patterns, len(patterns) - 1, 1, words, 0)
+    words[offset] = patterns[phase]
+    pio = EmulatedPio()
+    pio.pins = patterns[-1]
+    sm = pio.state_machine(run_profile_pio, freq=PROFILE_SM_FREQ, out_base=0)
+    sm.active(1)
+    chunk = max(min(profile.delays_us) * 3, 1) # ticks the FIFO lasts at least, like the DMA refills it in time
+    i = 0
+    tick = None
+    while tick is None:
+        # feed the FIFO like the DMA does
+        while i < len(words) and sm.tx_fifo() < sm.tx_depth:
+            sm.put(words[i])
+            i += 1
+        tick = sm.run_until_irq(max_ticks=chunk)
+        if tick is None and i >= len(words) and not sm.tx_fifo() and sm._is_stalled():
+            break
+    return {
+        'duration_us': tick * 1000000.0 / PROFILE_SM_FREQ if tick is not None else None,
+        'expected_us': profile.duration_us,
+        'phases': count_phases(sm.trace, patterns, patterns[-1]),
+    }
+
+def run_regression() -> bool:
+    """Checks the step counts and timings of the StepMotorPIO programs against the formulas used by the driver.
+       To be run on the host, returns True if all checks passed.
+    """
+    from DriveMode import PATTERNS
+    from StepProfile import StepProfile
+    ok = True
+    for mode in PATTERNS:
+        for segments in ([100], [-100], [40, -40], [3, -5, 7, -1]):
+            res = simulate_segments(segments, mode)
+            overhead = res['ticks'] - sum([abs(c) for c in segments]) * res['expected_ticks_per_step']
+            # per segment: pull, out, out, jmp, (jmp segment_done,) out, jmp
+            expected_overhead = sum([7 if c > 0 else 6 for c in segments])
+            passed = res['steps'] == sum(segments) and overhead == expected_overhead
+            ok = ok and passed
+            print(f"PioEmulator: segments {segments} ({mode}): {res['steps']} steps in {res['duration_ms']} ms, {overhead} ticks overhead {'OK' if passed else 'FAILED'}")
+        for rpm in (0.5, 5.0, -5.0, 12.0):
+            res = simulate_variable_speed(rpm, drive_mode=mode)
+            passed = abs(res['speed_rpm'] - rpm) <= abs(rpm) * 0.02 + 0.1
+            ok = ok and passed
+            print(f"PioEmulator: variable speed {rpm} rpm ({mode}): {res['speed_rpm']:.3f} rpm {'OK' if passed else 'FAILED'}")
+    profile = StepProfile(400, 800.0, 4000.0, 200.0)
+    res = simulate_profile(profile)
+    passed = res['phases'] == profile.steps and res['duration_us'] is not None and abs(res['duration_us'] - res['expected_us']) <= 10
+    ok = ok and passed
+    print(f"PioEmulator: profile of {profile.steps} phases: {res['duration_us']} us, planned {res['expected_us']} us {'OK' if passed else 'FAILED'}")
+    return ok
+
+if __name__ == "__main__":
+    sys.exit(0 if run_regression() else 1)
@@ -0,0 +1,250 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List, Union
+from machine import Timer
+import time
+
+MAX_EXHAUSTIVE = 6
+"""up to this number of devices, all start orders are tried, otherwise the longest inrush is started first"""
+
+class PowerDevice:
+    """Current estimate of a device starting up: inrush_a for inrush_ms after its start, running_a afterwards."""
+    def __init__(self, name: str, start_function, inrush_a: float, inrush_ms: int, running_a: float) -> None:
+        self.name = name
+        self.start_function = start_function
+        """function without parameters starting the device, None if the device only draws current from then on"""
+        self.inrush_a = max(inrush_a, running_a)
+        self.inrush_ms = max(int(inrush_ms), 0)
+        self.running_a = running_a
+        self.offset_ms = 0
+        """planned start, relative to the start of the sequence"""
+
+    def current_at(self, t: int) -> float:
+        """Current drawn at time t (relative to the start of the sequence)."""
+        if t < self.offset_ms:
+            return 0.0
+        if t < self.offset_ms + self.inrush_ms:
+            return self.inrush_a
+        return self.running_a
+
+class PowerSequencer:
+    """Staggers the start of the motors, so that the current drawn from the power supply stays within its budget.
+       The DC motors of the ball drivers are started with a kick at full power and draw a multiple of their running current
+       until they reach their speed, so starting all devices at once adds up the inrush currents.
+       Each device is described by its estimated inrush current, inrush duration and running current. The sequencer
+       plans the start offsets, so that all devices run as early as possible (minimum time to the ready state) without
+       exceeding the budget: a device starts at the earliest point where its inrush fits beside the others. For a few
+       devices all orders are tried, otherwise the longest inrush goes first. The starts are then performed by a
+       one-shot timer. A device whose current alone exceeds the budget is started last and reported.
+    """
+    def __init__(self, supply_budget_a: float = 3.0, debug=False) -> None:
+        """Parameters:
+           supply_budget_a: max. current the motor power supply can deliver (A).
+        """
+        self.supply_budget_a = supply_budget_a
+        self.estimates = {
+            'balldriver_motor': {'inrush_a': 1.2, 'running_a': 0.3},
+            'ballstirrer': {'inrush_a': 0.3, 'inrush_ms': 0, 'running_a': 0.3},
+            'ballfeeder': {'inrush_a': 0.3, 'inrush_ms': 0, 'running_a': 0.3},
+        }
+        """current estimates per device type, ball drivers per motor (their inrush lasts until the motors reach their speeds)"""
+        self.device_estimates = {}
+        """estimates of single devices by name (e.g. 'balldriver0'), overriding the ones of their type"""
+        self.debug = debug
+        self.devices = []
+        self.ready_ms = 0
+        """planned time from the start of the sequence until the last device passed its inrush"""
+        self.peak_a = 0.0
+        self.warnings = []
+        self._next = 0
+        self._t0 = 0
+        self._timer = None
+        self._running = False
+
+    def clear(self) -> None:
+        self.cancel()
+        self.devices = []
+        self.warnings = []
+        self.ready_ms = 0
+        self.peak_a = 0.0
+
+    def add_device(self, name: str, start_function, inrush_a: float, inrush_ms: int, running_a: float) -> PowerDevice:
+        dev = PowerDevice(name, start_function, inrush_a, inrush_ms, running_a)
+        self.devices.append(dev)
+        return dev
+
+    def add_estimated_device(self, name: str, kind: str, start_function, motors: int = 1, inrush_ms: int = 0) -> PowerDevice:
+        """Adds a device with the estimates of its kind (see estimates), scaled by the number of motors,
+           or the ones configured for the device itself.
+        """
+        est = self.estimates[kind]
+        own = self.device_estimates.get(name, {})
+        return self.add_device(name, start_function,
+                               float(own.get('inrush_a', est['inrush_a'] * motors)),
+                               int(own.get('inrush_ms', est.get('inrush_ms', inrush_ms))),
+                               float(own.get('running_a', est['running_a'] * motors)))
+
+    def _fits(self, placed: list, dev: PowerDevice, t: int) -> bool:
+        """True if dev can start at t beside the devices already placed."""
+        dev.offset_ms = t
+        points = [t, t + dev.inrush_ms]
+        for d in placed:
+            points.append(d.offset_ms)
+            points.append(d.offset_ms + d.inrush_ms)
+        for p in points:
+            if p < t:
+                continue
+            load = dev.current_at(p)
+            for d in placed:
+                load += d.current_at(p)
+            if load > self.supply_budget_a + 1e-6:
+                return False
+        return True
+
+    def _place(self, order: list, crowded: Union[list, None] = None) -> int:
+        """Assigns the earliest feasible start to the devices in the given order and returns the ready time.
+           The names of devices whose inrush does not fit anywhere are added to crowded (if given).
+        """
+        placed = []
+        ready = 0
+        for dev in order:
+            candidates = [0] + sorted([d.offset_ms + d.inrush_ms for d in placed])
+            start = None
+            for t in candidates:
+                if self._fits(placed, dev, t):
+                    start = t
+                    break
+            if start is None:
+                # its inrush does not fit beside the running load: start it after all inrushes, the budget is exceeded anyways
+                start = candidates[-1]
+                if crowded is not None:
+                    crowded.append(dev.name)
+            dev.offset_ms = start
+            placed.append(dev)
+            ready = max(ready, start + dev.inrush_ms)
+        return ready
+
+    def _orders(self, devices: list):
+        """All permutations of the devices (itertools is not available on the device)."""
+        if len(devices) <= 1:
+            yield list(devices)
+            return
+        for i in range(len(devices)):
+            for rest in self._orders(devices[:i] + devices[i + 1:]):
+                yield [devices[i]] + rest
+
+    def plan(self) -> int:
+        """Plans the start offsets of all devices and returns the time in ms until the machine is ready."""
+        self.warnings = []
+        # devices which exceed the budget alone are started last, one after another
+        oversized = [d for d in self.devices if d.inrush_a > self.supply_budget_a]
+        devices = [d for d in self.devices if d.inrush_a <= self.supply_budget_a]
+        devices.sort(key=lambda d: (d.inrush_ms, d.inrush_a), reverse=True)
+        best = None
+        best_ready = 0
+        if len(devices) <= MAX_EXHAUSTIVE:
+            for order in self._orders(devices):
+                ready = self._place(order)
+                if best is None or ready < best_ready:
+                    best = order
+                    best_ready = ready
+        else:
+            best = devices
+        crowded = []
+        self.ready_ms = self._place((best if best is not None else []) + oversized, crowded)
+        for d in oversized:
+            self.warnings.append(f"{d.name}: inrush of {d.inrush_a} A exceeds the supply budget of {self.supply_budget_a} A.")
+        points = [0]
+        for d in self.devices:
+            points.append(d.offset_ms)
+            points.append(d.offset_ms + d.inrush_ms)
+        self.peak_a = max([sum([d.current_at(p) for d in self.devices]) for p in points])
+        crowded = [name for name in crowded if name not in [d.name for d in oversized]]
+        if crowded:
+            self.warnings.append(f"The inrush of {', '.join(crowded)} does not fit beside the running load, the peak current ({self.peak_a:.2f} A) exceeds the supply budget of {self.supply_budget_a} A.")
+        self.devices.sort(key=lambda d: d.offset_ms)
+        if self.debug:
+            print(f"PowerSequencer: ready after {self.ready_ms} ms, peak {self.peak_a:.2f} A: {[(d.name, d.offset_ms) for d in self.devices]}")
+        for w in self.warnings:
+            print(f"WARNING: {w}")
+        return self.ready_ms
+
+    def start(self) -> None:
+        """Plans the sequence and starts the devices at their offsets."""
+        self.cancel()
+        self.plan()
+        self._next = 0
+        self._t0 = time.ticks_ms()
+        self._running = True
+        self._step(None)
+
+    def _step(self, timer) -> None:
+        """Starts all devices which are due and arms the timer for the next one."""
+        if not self._running:
+            return
+        elapsed = time.ticks_diff(time.ticks_ms(), self._t0)
+        while self._next < len(self.devices) and self.devices[self._next].offset_ms <= elapsed:
+            dev = self.devices[self._next]
+            self._next += 1
+            if dev.start_function is not None:
+                try:
+                    dev.start_function()
+                except Exception as e:
+                    print(f"PowerSequencer: error starting {dev.name}: {e}")
+            if self.debug:
+                print(f"PowerSequencer: {dev.name} started at {elapsed} ms (planned: {dev.offset_ms} ms).")
+        if self._next >= len(self.devices):
+            self._running = False
+            return
+        if self._timer is None:
+            self._timer = Timer()
+        self._timer.init(mode=Timer.ONE_SHOT, period=max(self.devices[self._next].offset_ms - elapsed, 1), callback=self._step)
+
+    def cancel(self) -> None:
+        """Stops starting further devices (the ones already started keep running)."""
+        self._running = False
+        if self._timer is not None:
+            self._timer.deinit()
+
+    def is_started(self) -> bool:
+        """True when all devices of the sequence have been started."""
+        return not self._running
+
+    def is_ready(self) -> bool:
+        """True when all devices have been started and passed their planned inrush."""
+        return not self._running and time.ticks_diff(time.ticks_ms(), self._t0) >= self.ready_ms
+
+    def getStatusData(self) -> dict:
+        return {
+            'supply_budget_a': self.supply_budget_a,
+            'ready_ms': self.ready_ms,
+            'peak_a': self.peak_a,
+            'ready': self.is_ready(),
+            'devices': [{'name': d.name, 'offset_ms': d.offset_ms, 'inrush_a': d.inrush_a, 'inrush_ms': d.inrush_ms, 'running_a': d.running_a} for d in self.devices],
+            'warnings': self.warnings,
+        }
+
+    def getConfigData(self) -> dict:
+        return {
+            'supply_budget_a': self.supply_budget_a,
+            'estimates': self.estimates,
+            'devices': self.device_estimates,
+        }
+
+    def setConfigData(self, data: dict) -> None:
+        tmp = data.get('supply_budget_a')
+        if tmp is not None:
+            self.supply_budget_a = float(tmp)
+        tmp = data.get('estimates')
+        if tmp is not None:
+            for key in tmp:
+                if key in self.estimates:
+                    for k in tmp[key]:
+                        self.estimates[key][k] = float(tmp[key][k])
+        tmp = data.get('devices')
+        if tmp is not None:
+            self.device_estimates = dict(tmp)
@@ -14,15 +14,24 @@ from Sg92r import Sg92r
 from _thread import start_new_thread, allocate_lock
 import gc
 import json
+from array import array
 from machine import Timer
-from utime import sleep, sleep_ms
+from utime import sleep, sleep_ms, ticks_ms, ticks_diff
 from BallDriver import BallDriver
 from API import API
 from RobbyExceptions import *
 from RobbySettings import RobbySettings
 import Shot
 from ShotCycle import ShotCycle
+from CompiledShotCycle import CompiledShotCycle
+from FeederTuner import FeederTuner
+from FeederScheduler import FeederScheduler
+import AimingTable
+from StirrerPolicy import StirrerPolicy
+from PowerSequencer import PowerSequencer
 from StepMotorPIO import StepMotorPIO, MODE_COUNTED, MODE_PERMANENT
+from PioAllocator import allocator
+from IrqEventQueue import event_queue
 import WebServer
 from lib.RobbyLibrary import RobbyLibrary
 
@@ -45,6 +54,13 @@ STATUS_STOPPING = 9
 """Halting operation"""
 STATUS_ERROR = 99
 """An error occurred. Device needs to be reset!"""
+# Preparation paths running in parallel between two ball releases (see RobbyController._release_next_ball())
+PATH_AIM = 0
+PATH_DRIVER = 1
+PATH_FEEDER = 2
+PATH_NONE = 3
+"""the release was not delayed at all"""
+PATH_NAMES = ('aim', 'driver', 'feeder', 'none')
 # Dict keys
 KEY_GENERAL_SETTINGS = 'general'
 KEY_BALL_DRIVERS = 'balldrivers'
@@ -52,6 +68,9 @@ KEY_BALL_FEEDERS = 'ballfeeders'
 KEY_BALL_STIRRERS = 'ballstirrers'
 KEY_MACHINE_ROTATORS = 'machinerotators'
 KEY_LIBRARY = 'library'
+KEY_AIMING = 'aiming'
+KEY_STIRRER_POLICY = 'stirrerpolicy'
+KEY_POWER = 'power'
 
 class RobbyController:
     #TODO: Controller should have info/control about pin usage to prevent conflicts.
@@ -67,11 +86,33 @@ class RobbyController:
     Too fast operation will cause the stepper motor to move unreliably or not to move at all.
     """
     BALL_RELEASE_DURATION = 0.25 
-    """Pause time after ball feeder starts operating (pushing the ball into the driver) and before the driver-motor settings for the next shot are initiated.  
+    """Expected time after the ball feeder starts operating until the ball is committed to the driver.
 
-    Shall prevent the robo parts from being moved too early, before the ball has been released completely.
+    The driver-motor settings for the next shot are initiated when the feeder reports the ball as committed, not before,
+    so the robo parts are not moved before the ball has been released completely. This value is only used to plan the spin-up times.
     """
     MAX_BALL_FREQUENCY = 1 / BALL_PUSHER_DURATION
+    """Ball frequency a single uncalibrated feeder can supply, several feeders per driver multiply it (see FeederScheduler)."""
+    SPINUP_READY_TIMEOUT = 0.5
+    """Max. time in seconds to hold back the next ball, while a ball driver with speed control has not yet reached its target speeds.
+    
+    The ball is released after this time anyways, so that a failing sensor cannot stall the whole shot cycle.
+    """
+    ROTATOR_SETTLE_TIMEOUT = 1.0
+    """Max. time in seconds to hold back the next ball, while a machine rotator is still moving to its target."""
+    FEEDER_READY_TIMEOUT = BALL_PUSHER_DURATION
+    """Max. time in seconds to hold back the next ball, while the ball feeder is still performing its return stroke.
+
+    Feeders with a calibrated cycle_duration (see FeederTuner) use that one instead.
+    """
+    STIRRER_BURST_DURATION_MS = 1500
+    """Time the stirrers run after a ball feeder missed a ball, to loosen the balls in the pool (default of the StirrerPolicy)."""
+    UPCOMING_RELEASES = 3
+    """Number of upcoming ball releases passed to the stirrer policy after each release."""
+    CADENCE_WINDOW = 16
+    """Number of recent ball releases the cadence report is calculated from."""
+    CRITICAL_PATH_LOG = 32
+    """Number of recent ball releases the critical path report is calculated from."""
 
     def __init__(self, config_path: str='/ttrobby-config.json', no_server: bool=False, debug=False) -> None:
         """Parameters:
@@ -100,6 +141,10 @@ class RobbyController:
             self.kill_requested = False
             self.errors = []
             self.API = API(self, debug)
+            self.pio_allocator = allocator
+            """Shared by all PIO users (step motors, tachometers), see PioAllocator."""
+            self.event_queue = event_queue
+            """Deferred handling of motor completion interrupts, see IrqEventQueue."""
             self._mode = MODE_CONFIGURATION
             self._mode_requested = MODE_CONFIGURATION
             self._status = STATUS_IDLE
@@ -147,6 +192,8 @@ class RobbyController:
                             self.ball_drivers.append(BallDriver(bd_number=cfg['bd_number'], motor_angles=cfg['motor_angles'], i2c_channel=cfg['motor_driver']['i2c_channel'], sda_pin=cfg['motor_driver']['sda_pin'], address=cfg['motor_driver']['address'], debug=self.debug))
                             for motor in cfg['motors']:
                                 self.ball_drivers[-1].motors[motor['motor_number']].polarity = motor['polarity']
+                            self.ball_drivers[-1].configure_speed_control(cfg.get('speed_control'))
+                            self.ball_drivers[-1].dynamics.setConfigData(cfg.get('dynamics', {}))
                         except Exception as e:
                             self.errors.append(f"ERROR: Could not instantiate ball driver: {str(e)}")
                             print(self.errors[-1])
@@ -156,6 +203,8 @@ class RobbyController:
                 if self.debug:
                     print("No ball drivers found in settings, creating default one.")
                 self.ball_drivers.append(BallDriver(0, debug=self.debug))
+            for bd in self.ball_drivers:
+                bd.ready_callback = self._driver_ready
 
             txt_step = "Ball Feeders Initialization"
             if self.debug:
@@ -171,6 +220,10 @@ class RobbyController:
                     print("No ball feeders found in settings, creating default one.")
                 # create one default entry, using defaults
                 self.ball_feeders.append(BallFeeder(motor=StepMotorPIO(mode=MODE_COUNTED, debug=self.debug), bf_index=0, debug=self.debug))
+            for bf in self.ball_feeders:
+                bf.miss_callback = self._ball_missed
+            self.feeder_scheduler = FeederScheduler(self.ball_feeders, int(self.BALL_PUSHER_DURATION * 1000), debug=self.debug)
+            """Assigns the balls of each ball driver to its feeders in round-robin."""
 
             txt_step = "Ball Stirrers Initialization"
             if self.debug:
@@ -189,6 +242,9 @@ class RobbyController:
                     print("No ball stirrers found in settings, creating default one.")
                 # create one default entry
                 self.ball_stirrers.append(BallStirrer(bs_index=0, motor=StepMotorPIO(mode=MODE_PERMANENT, debug=self.debug), debug=self.debug))
+            self.stirrer_policy = StirrerPolicy(self.ball_stirrers, miss_ms=self.STIRRER_BURST_DURATION_MS, debug=self.debug)
+            """Decides when the stirrers run: around the ball releases (duty) or during the whole session (continuous)."""
+            self.stirrer_policy.setConfigData(settings.get(KEY_STIRRER_POLICY, {}))
             
             txt_step = "Machine Rotators Initialization"
             if self.debug:
@@ -206,12 +262,38 @@ class RobbyController:
                 # create one default entry
                 self.machine_rotators.append(MachineRotator(0, debug=self.debug))
 
+            txt_step = "Aiming Initialization"
+            if self.debug:
+                print("Initializing RobbyController: ", txt_step)
+            self.aiming_config = settings.get(KEY_AIMING, {})
+            """{'table_file': path} of the calibrated AimingTable, empty if the axes follow the shot angles directly"""
+            self.aiming = AimingTable.create_from_config(self.aiming_config)
+
+            txt_step = "Power Sequencer Initialization"
+            if self.debug:
+                print("Initializing RobbyController: ", txt_step)
+            self.power_sequencer = PowerSequencer(debug=self.debug)
+            """Staggers the motor starts within the supply budget, when the machine starts playing."""
+            self.power_sequencer.setConfigData(settings.get(KEY_POWER, {}))
+
             txt_step = "BallTimer Initialization"
             if self.debug:
                 print(f"{len(self.machine_rotators)=}")
                 print("Initializing RobbyController: ", txt_step)
             self.BallTimer = Timer() # type: ignore
             self.BallTimerRunning = False
+            self.ReleaseTimer = Timer() # type: ignore
+            """One-shot timer limiting the time a due ball release is held back by each path (see _release_next_ball())."""
+            self._release_due = False
+            self._release_gates = 0
+            """paths (bit 1 << PATH_*) the due release still waits for"""
+            self._release_limits = array('I', [0] * PATH_NONE)
+            """max. time in ms each path may hold back the due release"""
+            self._release_bd = 0
+            self._release_bf = 0
+            self._release_shot = -1
+            self._release_callback = None
+            self._release_t0 = 0
             self.current_program_index = -1
             """Current index in the shot cycle. Is -1 if in no program is started."""
             
@@ -219,6 +301,11 @@ class RobbyController:
             if self.debug:
                 print("Initializing RobbyController: ", txt_step)
             self.ShotCycle = ShotCycle([Shot.get_default_shot_from_settings(self.__general_settings)])
+            self.CompiledProgram: Union[CompiledShotCycle, None] = None
+            """The ShotCycle precalculated for playback, available in program mode only."""
+            self._current_interval_ms = 0
+            self._currentBallFrequency = 0.0
+            self.reset_cadence()
 
             txt_step = "ContinuousShot Initialization"
             if self.debug:
@@ -269,11 +356,13 @@ class RobbyController:
                     # Stop routines only execute once
                     if self._status != STATUS_STOPPING:
                         self._status = STATUS_STOPPING
+                        self.power_sequencer.cancel()
                         self._stop_balldrivers()
                         self._stop_stirrers()
                         if self.BallTimerRunning:
                             self.BallTimerRunning = False
                             self.BallTimer.deinit()
+                        self._cancel_release()
                         self.ShotCycle.reset()
                     # the ball feeders will stop when reaching the waiting position, then we can update the status:
                     if not self._is_any_ballfeeder_busy():
@@ -284,6 +373,7 @@ class RobbyController:
                     if self.BallTimerRunning:
                         self.BallTimerRunning = False
                         self.BallTimer.deinit()
+                    self._cancel_release()
                     # the ball feeders will stop when reaching the waiting position, then we update the status:
                     if not self._is_any_ballfeeder_busy():
                         self._status = self._status_requested
@@ -291,12 +381,13 @@ class RobbyController:
                 # State transition: * --> PLAYING
                 if self._status_requested == STATUS_PLAYING:
                     if self._status != STATUS_PREPARING:
-                        # Start the engines
+                        # Start the engines, staggered within the power budget. When resuming a pause, they are still running.
+                        resume = self._status == STATUS_PAUSED
                         self._status = STATUS_PREPARING
-                        self._start_balldrivers()
-                        self._start_stirrers()
-                    # the ball feeders should be in the waiting position, then we can update the status:
-                    if not self._is_any_ballfeeder_busy():
+                        if not resume:
+                            self._power_up()
+                    # the ball feeders should be in the waiting position and the motors past their inrush, then we can update the status:
+                    if not self._is_any_ballfeeder_busy() and self.power_sequencer.is_ready():
                         self._status = self._status_requested
                         self._start_playing_async()
 
@@ -305,6 +396,12 @@ class RobbyController:
                 self.lock_mode.acquire()
                 self._mode = self._mode_requested
                 self.lock_mode.release()
+                if self._mode == MODE_PROGRAM:
+                    try:
+                        self.compile_program()
+                    except Exception as e:
+                        self.errors.append(f"Cannot compile program: {e}")
+                        print(self.errors[-1])
                 # try:
                 #     if self._mode == MODE_CONTINUOUS:
                 #         if self._mode_requested == MODE_PROGRAM:
@@ -329,6 +426,8 @@ class RobbyController:
                 self._stop_playing()
                 #TODO: stop the webserver if running
                 break
+            # deferred irq events whose drain run could not be scheduled would wait for the next irq otherwise
+            self.event_queue.reschedule()
             sleep_ms(sleeptime_ms)
             if mem_interval_left > 0:
                 mem_interval_left -= sleeptime_ms
@@ -361,7 +460,10 @@ class RobbyController:
                 KEY_BALL_DRIVERS: [bd.getConfigData() for bd in self.ball_drivers],
                 KEY_BALL_FEEDERS: [bf.getConfigData() for bf in self.ball_feeders],
                 KEY_BALL_STIRRERS: [bs.getConfigData() for bs in self.ball_stirrers],
-                KEY_MACHINE_ROTATORS: [mr.getConfigData() for mr in self.machine_rotators]
+                KEY_MACHINE_ROTATORS: [mr.getConfigData() for mr in self.machine_rotators],
+                KEY_AIMING: self.aiming_config,
+                KEY_STIRRER_POLICY: self.stirrer_policy.getConfigData(),
+                KEY_POWER: self.power_sequencer.getConfigData(),
                 }
             with open(path,'w') as f:
                 settings = json.dump(settings, f)
@@ -369,26 +471,15 @@ class RobbyController:
             Exception(f"Cannot save settings to file '{path}': {str(e)}")
 
     def _start_stirrers(self) -> None:
-        i = 0
-        for stirrer in self.ball_stirrers:
-            try:
-                stirrer.start()
-                i += 1
-            except Exception as e:
-                print(f"Error starting stirrer {i}: {e}")
+        """Starts the session of the stirrer policy: continuous stirrers start right away, duty cycled ones follow the ball releases."""
+        self.stirrer_policy.session_start()
         if self.debug:
-            print(f"{i} stirrers started.")
+            print(f"{len(self.ball_stirrers)} stirrers started ({self.stirrer_policy.policy}).")
 
     def _stop_stirrers(self) -> None:
-        i = 0
-        for stirrer in self.ball_stirrers:
-            try:
-                stirrer.stop()
-                i += 1
-            except Exception as e:
-                print(f"Error stopping stirrer {i}: {e}")
+        self.stirrer_policy.session_stop()
         if self.debug:
-            print(f"{i} stirrers successfully stopped.")
+            print(f"{len(self.ball_stirrers)} stirrers stopped, runtime: {self.stirrer_policy.getStatusData()}")
     
     def _start_balldrivers(self) -> None:
         i = 0
@@ -402,6 +493,29 @@ class RobbyController:
         if self.debug:
             print(f"{i} balldrivers started.")
 
+    def _power_up(self) -> None:
+        """Starts the ball driver motors and the stirrers staggered by the PowerSequencer, so that their inrush currents
+           do not add up beyond the supply budget. The feeders are included with their running current, since the first
+           ball is released when the sequence is complete.
+           Ball drivers without speed control are started motor by motor, their inrush lasts until the motor reaches its speed.
+        """
+        seq = self.power_sequencer
+        seq.clear()
+        for bd in self.ball_drivers:
+            bd.update_current_shot(self.__general_settings.default_ball_speed, self.__general_settings.default_topspin, self.__general_settings.default_sidespin)
+            if bd.speed_controller is None:
+                for m in range(len(bd.motors)):
+                    seq.add_estimated_device(f"balldriver{bd.bd_number}.{m}", 'balldriver_motor', lambda bd=bd, m=m: bd.start_motor(m),
+                                             inrush_ms=bd.dynamics.motor_time_to_speed_ms(m, 0, bd.motor_speeds[m]))
+            else:
+                seq.add_estimated_device(f"balldriver{bd.bd_number}", 'balldriver_motor', bd.start, motors=len(bd.motors),
+                                         inrush_ms=bd.dynamics.time_to_speed_ms([0] * len(bd.motors), bd.motor_speeds))
+        if self.ball_stirrers:
+            seq.add_estimated_device('ballstirrers', 'ballstirrer', self._start_stirrers, motors=len(self.ball_stirrers))
+        for bf in self.ball_feeders:
+            seq.add_estimated_device(f"ballfeeder{bf.bf_index}", 'ballfeeder', None, motors=len(bf.motors))
+        seq.start()
+
     def _stop_balldrivers(self) -> None:
         i = 0 # currently we have only one!
         for bd in self.ball_drivers:
@@ -436,17 +550,408 @@ class RobbyController:
             raise InvalidOperationException(f"Ball Feeder #{bf_index} is currently operating and cannot be moved into the waiting position!")
         bf.prepare_after_mount()
 
-    def _release_next_ball(self, bf_index: int) -> None:
-        """Trigger the feeder cycle for the next ball"""
+    def _release_next_ball(self, bd_number: int, committed_callback=None, shot_index: int = -1) -> None:
+        """Marks the next ball of the ball driver as due. The feeder is chosen by the feeder scheduler.
+           The ball is released as soon as the axes have settled on the aim, the ball driver reports its target speeds and
+           the feeder finished its previous cycle. All three have been running in parallel since the previous ball was
+           committed, so the release is only delayed by the slowest one, i.e. the critical path.
+           This is called by the ball timer, which must not wait: the paths report their completion by callback
+           (_release_gate_event()), and a one-shot timer limits the time each of them can hold back the ball
+           (ROTATOR_SETTLE_TIMEOUT, SPINUP_READY_TIMEOUT, the feeder's cycle_duration or FEEDER_READY_TIMEOUT),
+           so that a failing sensor cannot stall the shot cycle.
+           committed_callback is called as soon as the ball is committed to the driver, i.e. while the feeder is still returning.
+           shot_index: index of the shot in the compiled program (for the critical path log), -1 if not compiled.
+        """
+        if self._release_due:
+            # the previous ball has been held back for a whole interval: release it now
+            self._expire_release_gates(True)
+        bf_index = self.feeder_scheduler.select(bd_number)
+        bf = self.ball_feeders[bf_index]
+        self._release_bd = bd_number
+        self._release_bf = bf_index
+        self._release_shot = shot_index
+        self._release_callback = committed_callback
+        self._release_limits[PATH_AIM] = int(self.ROTATOR_SETTLE_TIMEOUT * 1000)
+        self._release_limits[PATH_DRIVER] = int(self.SPINUP_READY_TIMEOUT * 1000)
+        self._release_limits[PATH_FEEDER] = int((bf.cycle_duration or self.FEEDER_READY_TIMEOUT) * 1000)
+        self._release_gates = (1 << PATH_AIM) | (1 << PATH_DRIVER) | (1 << PATH_FEEDER)
+        self._release_t0 = ticks_ms()
+        self._release_due = True
+        self._release_gate_event()
+        if self._release_due:
+            self._arm_release_timeout()
+
+    def _release_gate_event(self) -> None:
+        """Called when a path may have completed: clears the gates of the due release which are open by now
+           and releases the ball, when it does not wait for any path anymore.
+        """
+        if not self._release_due:
+            return
+        waited = ticks_diff(ticks_ms(), self._release_t0)
+        gates = self._release_gates
+        if gates & (1 << PATH_AIM) and self._machine_rotators_settled():
+            self._clear_release_gate(PATH_AIM, waited)
+        if gates & (1 << PATH_DRIVER) and self.ball_drivers[self._release_bd].is_ready():
+            self._clear_release_gate(PATH_DRIVER, waited)
+        if gates & (1 << PATH_FEEDER) and not self.ball_feeders[self._release_bf].is_busy():
+            self._clear_release_gate(PATH_FEEDER, waited)
+        if self._release_gates == 0:
+            self._do_release()
+
+    def _clear_release_gate(self, path: int, waited: int) -> None:
+        self._cp_wait_ms[self._cp_head * 3 + path] = min(waited, 0xFFFF)
+        self._release_gates &= ~(1 << path)
+
+    def _expire_release_gates(self, force: bool = False) -> None:
+        """Clears the gates which have held back the due release for their max. time (all of them with force=True)."""
+        waited = ticks_diff(ticks_ms(), self._release_t0)
+        for p in (PATH_AIM, PATH_DRIVER, PATH_FEEDER):
+            if self._release_gates & (1 << p) and (force or waited >= self._release_limits[p]):
+                if self.debug:
+                    print(f"Ball release: {PATH_NAMES[p]} not ready after {waited} ms, releasing anyways.")
+                self._clear_release_gate(p, waited)
+        if self._release_gates == 0:
+            self._do_release()
+
+    def _arm_release_timeout(self) -> None:
+        """Arms the release timer for the earliest max. time of the paths the due release still waits for."""
+        waited = ticks_diff(ticks_ms(), self._release_t0)
+        period = -1
+        for p in (PATH_AIM, PATH_DRIVER, PATH_FEEDER):
+            if self._release_gates & (1 << p):
+                left = self._release_limits[p] - waited
+                if period < 0 or left < period:
+                    period = left
+        self.ReleaseTimer.init(mode=Timer.ONE_SHOT, period=max(period, 1), callback=self._release_timeout)
+
+    def _release_timeout(self, timer: Timer) -> None:
+        if not self._release_due:
+            return
+        self._release_gate_event()
+        if self._release_due:
+            self._expire_release_gates()
+        if self._release_due:
+            self._arm_release_timeout()
+
+    def _cancel_release(self) -> None:
+        """Drops the due release, e.g. when the machine pauses or stops."""
+        self._release_due = False
+        self._release_callback = None
+        self.ReleaseTimer.deinit()
+
+    def _do_release(self) -> None:
+        """Triggers the feeder cycle of the due release."""
+        self._release_due = False
+        self.ReleaseTimer.deinit()
+        self._log_critical_path()
+        bf_index = self._release_bf
         bf = self.ball_feeders[bf_index]
+        callback = self._release_callback
+        self._release_callback = None
         if bf.is_busy():
-            raise ImplementationException("Ball Feeder not finished with previous operation.")
+            # the feeder did not finish within its max. time: skip the ball instead of stalling the shot cycle
+            self._skipped_releases += 1
+            print(f"WARNING: Ball Feeder #{bf_index} is still busy after {self._release_limits[PATH_FEEDER]} ms, ball skipped.")
+            if callback is not None:
+                # the next shot is prepared anyways
+                callback()
+            return
         if self.debug:
             print(f"Ball Feeder releasing next ball")
-        bf.dispense()
+        self._record_release(bf_index)
+        self.feeder_scheduler.record_release(bf_index)
+        # the end of the cycle may clear the feeder gate of the next release
+        bf.dispense(controller_callback=self._release_gate_event, committed_callback=callback)
+        self.stirrer_policy.plan(self._upcoming_releases_ms(self._release_shot))
+
+    def _upcoming_releases_ms(self, shot_index: int = -1) -> List[int]:
+        """Offsets in ms of the next UPCOMING_RELEASES ball releases from now, taken from the compiled program or the ball frequency."""
+        ret = []
+        t = 0
+        prg = self.CompiledProgram
+        if shot_index >= 0 and prg is not None:
+            for n in range(1, self.UPCOMING_RELEASES + 1):
+                t += prg.interval_ms[(shot_index + n) % prg.count]
+                ret.append(t)
+        elif self._currentBallFrequency > 0:
+            interval_ms = int(1000 / self._currentBallFrequency)
+            for n in range(1, self.UPCOMING_RELEASES + 1):
+                ret.append(n * interval_ms)
+        return ret
+
+    def _release_duration(self) -> float:
+        """Time in seconds from releasing a ball until it is committed, the longest of all feeders (calibrated or default)."""
+        ret = 0.0
+        for bf in self.ball_feeders:
+            ret = max(ret, bf.release_duration or self.BALL_RELEASE_DURATION)
+        return ret if ret > 0 else self.BALL_RELEASE_DURATION
+
+    def tune_ball_feeder(self, bf_index: int, trials: int = 3, save: bool = True) -> dict:
+        """Calibrates the fastest reliable cycle of the ball feeder (see FeederTuner) and adopts the result.
+           The machine must be idle and the feeder loaded with balls. With save=True the settings file is updated.
+           Without a ball sensor, only the durations at the current speed are measured (a stall cannot be detected by timing).
+        """
+        if bf_index < 0 or bf_index >= len(self.ball_feeders):
+            raise InputDataException(f"Ball Feeder index out of range ({bf_index})!")
+        if self._status != STATUS_IDLE:
+            raise InvalidOperationException(f"Machine must be in status IDLE ({STATUS_IDLE}) to calibrate a ball feeder, but current status is {self.status_text} ({self._status})!")
+        bf = self.ball_feeders[bf_index]
+        result = FeederTuner(bf, ball_sensor=bf.ball_sensor.count if bf.ball_sensor else None, trials=trials, debug=self.debug).run()
+        # the spin-up planning depends on the release duration
+        self.CompiledProgram = None
+        if self._mode == MODE_PROGRAM:
+            self.compile_program()
+        if save:
+            self._save_settings()
+        return result
+
+    def max_ball_frequency(self, bd_number: int) -> float:
+        """Max. balls per second for the ball driver: limited by its feeders together and by the general settings."""
+        return min(self.__general_settings.MAX_BALL_FREQUENCY, self.feeder_scheduler.max_ball_frequency(bd_number))
+
+    def _ball_missed(self, bf: BallFeeder, final: bool) -> None:
+        """Called by a ball feeder whose sensor did not detect a ball: the pool might be starved or the outlet jammed."""
+        self.stirrer_policy.ball_missed()
+        if final:
+            self.errors.append(f"Ball Feeder #{bf.bf_index}: no ball detected after {bf.max_retries} retries. Ball pool empty or outlet jammed?")
+            print(self.errors[-1])
+
+    def reset_cadence(self) -> None:
+        self._release_ticks = []
+        self._release_feeders = []
+        self._feeder_waits = 0
+        """releases which were held back by a ball feeder still performing its cycle"""
+        self._feeder_wait_ms = 0
+        self._skipped_releases = 0
+        """releases skipped, because the ball feeder had not finished its previous cycle within its max. time"""
+        self.reset_critical_path_log()
+
+    def reset_critical_path_log(self) -> None:
+        n = self.CRITICAL_PATH_LOG
+        self._cp_shot = array('h', [-1] * n)
+        """shot index per logged release (-1: not compiled)"""
+        self._cp_wait_ms = array('H', [0] * (n * 3))
+        """time each path (aim, driver, feeder) held back the release, per logged release"""
+        self._cp_predicted_ms = array('H', [0] * (n * 2))
+        """predicted move time of the axes and spin-up time of the driver (compiled program only), per logged release"""
+        self._cp_path = array('B', bytes(n))
+        self._cp_head = 0
+        self._cp_count = 0
+        self._cp_critical = array('I', [0] * len(PATH_NAMES))
+        """number of releases each path was critical for"""
+
+    def _machine_rotators_settled(self) -> bool:
+        for mr in self.machine_rotators:
+            if not mr.is_settled():
+                return False
+        return True
+
+    def _log_critical_path(self) -> None:
+        """Logs the time each path held back the due release (recorded by _clear_release_gate()) and the critical one."""
+        k = self._cp_head
+        waits = self._cp_wait_ms
+        shot_index = self._release_shot
+        path = PATH_NONE
+        delay = 0
+        for p in (PATH_AIM, PATH_DRIVER, PATH_FEEDER):
+            if waits[k * 3 + p] > delay:
+                delay = waits[k * 3 + p]
+                path = p
+        self._cp_shot[k] = shot_index
+        self._cp_path[k] = path
+        prg = self.CompiledProgram
+        if shot_index >= 0 and prg is not None:
+            self._cp_predicted_ms[k * 2] = prg.aim_ms[shot_index]
+            self._cp_predicted_ms[k * 2 + 1] = prg.spinup_ms[shot_index]
+        else:
+            self._cp_predicted_ms[k * 2] = 0
+            self._cp_predicted_ms[k * 2 + 1] = 0
+        self._cp_critical[path] += 1
+        self._cp_head = (k + 1) % self.CRITICAL_PATH_LOG
+        if self._cp_count < self.CRITICAL_PATH_LOG:
+            self._cp_count += 1
+        if waits[k * 3 + PATH_FEEDER] > 0:
+            self._feeder_waits += 1
+            self._feeder_wait_ms += waits[k * 3 + PATH_FEEDER]
+        if self.debug and delay > 0:
+            print(f"Ball release delayed by {delay} ms, critical path: {PATH_NAMES[path]} (aim {waits[k * 3]} ms, driver #{self._release_bd} {waits[k * 3 + 1]} ms, feeder #{self._release_bf} {waits[k * 3 + 2]} ms).")
+
+    def get_critical_path_report(self) -> dict:
+        """Returns the time each preparation path (aim, driver, feeder) held back the recent ball releases (oldest first),
+           together with the predictions of the compiled program, and how often each path was the critical one.
+        """
+        n = self.CRITICAL_PATH_LOG
+        releases = []
+        for c in range(self._cp_count):
+            k = (self._cp_head - self._cp_count + c) % n
+            releases.append({
+                'shot': self._cp_shot[k],
+                'critical': PATH_NAMES[self._cp_path[k]],
+                'delay_ms': max(self._cp_wait_ms[k * 3:k * 3 + 3]),
+                'aim_ms': self._cp_wait_ms[k * 3 + PATH_AIM],
+                'driver_ms': self._cp_wait_ms[k * 3 + PATH_DRIVER],
+                'feeder_ms': self._cp_wait_ms[k * 3 + PATH_FEEDER],
+                'predicted_aim_ms': self._cp_predicted_ms[k * 2],
+                'predicted_spinup_ms': self._cp_predicted_ms[k * 2 + 1],
+            })
+        return {
+            'releases': releases,
+            'critical_counts': [{'path': PATH_NAMES[p], 'count': self._cp_critical[p]} for p in range(len(PATH_NAMES))],
+            'delay_avg_ms': sum([r['delay_ms'] for r in releases]) // len(releases) if releases else None,
+        }
+
+    def _record_release(self, bf_index: int) -> None:
+        if len(self._release_ticks) >= self.CADENCE_WINDOW:
+            self._release_ticks.pop(0)
+            self._release_feeders.pop(0)
+        self._release_ticks.append(ticks_ms())
+        self._release_feeders.append(bf_index)
+
+    def get_cadence_report(self) -> dict:
+        """Compares the achieved ball cadence (of the last CADENCE_WINDOW balls) with the theoretical limit of the ball feeders in use.
+           The limit of a feeder is given by its cycle time (measured if available, estimated otherwise).
+           Cadences are given in balls per minute.
+        """
+        ticks = self._release_ticks
+        intervals = [ticks_diff(ticks[k], ticks[k - 1]) for k in range(1, len(ticks))]
+        feeders = []
+        limit_bpm = 0.0
+        for i in range(len(self.ball_feeders)):
+            bf = self.ball_feeders[i]
+            estimated_ms = bf.estimate_cycle_ms()
+            cycle_ms = bf.last_cycle_ms if bf.last_cycle_ms > 0 else estimated_ms
+            feeder_limit = 60000.0 / cycle_ms if cycle_ms else None
+            if feeder_limit and i in self._release_feeders:
+                limit_bpm += feeder_limit
+            feeders.append({
+                'estimated_cycle_ms': estimated_ms,
+                'last_cycle_ms': bf.last_cycle_ms,
+                'last_commit_ms': bf.last_commit_ms,
+                'limit_bpm': feeder_limit,
+            })
+        achieved_bpm = 60000.0 * len(intervals) / sum(intervals) if intervals and sum(intervals) > 0 else None
+        return {
+            'balls': len(ticks),
+            'interval_avg_ms': sum(intervals) // len(intervals) if intervals else None,
+            'interval_min_ms': min(intervals) if intervals else None,
+            'interval_max_ms': max(intervals) if intervals else None,
+            'achieved_bpm': achieved_bpm,
+            'limit_bpm': limit_bpm if limit_bpm > 0 else None,
+            'utilization': achieved_bpm / limit_bpm if achieved_bpm and limit_bpm > 0 else None,
+            'feeder_waits': self._feeder_waits,
+            'feeder_wait_ms': self._feeder_wait_ms,
+            'skipped_releases': self._skipped_releases,
+            'feeders': feeders,
+        }
         
+    def load_shot_cycle(self, shot_cycle: ShotCycle) -> None:
+        """Replaces the current program. In program mode it is compiled immediately, otherwise when switching to program mode."""
+        if self._status != STATUS_IDLE:
+            raise InvalidOperationException(f"Machine must be in status IDLE ({STATUS_IDLE}) to load a program, but current status is {self.status_text} ({self._status})!")
+        self.ShotCycle = shot_cycle
+        self.CompiledProgram = None
+        if self._mode == MODE_PROGRAM:
+            self.compile_program()
+
+    def compile_program(self) -> CompiledShotCycle:
+        """Precalculates all shots of the current ShotCycle (motor speeds, intervals, angles) for the playback."""
+        t0 = ticks_ms()
+        self.CompiledProgram = CompiledShotCycle(self.ShotCycle, self.ball_drivers,
+                                                 release_ms=int(self._release_duration() * 1000),
+                                                 spinup_policy=self.__general_settings.spinup_policy,
+                                                 aiming=self.aiming,
+                                                 machine_rotators=self.machine_rotators)
+        if self.debug:
+            print(f"Program with {self.CompiledProgram.count} shots compiled in {ticks_diff(ticks_ms(), t0)} ms.")
+        for w in self.CompiledProgram.warnings:
+            what = 'to spin up' if w['path'] == 'spinup' else 'to aim'
+            print(f"WARNING: Shot #{w['shot']} needs {w['needed_ms']} ms {what}, but its pause leaves only {w['available_ms']} ms ({self.CompiledProgram.spinup_policy}).")
+        prg = self.CompiledProgram
+        for i in range(prg.count):
+            bd_number = prg.bd_index[i]
+            max_freq = self.max_ball_frequency(bd_number)
+            if max_freq > 0 and prg.interval_ms[i] < 1000 / max_freq:
+                print(f"WARNING: Shot #{i} has a pause of {prg.interval_ms[i]} ms, but the feeders of ball driver #{bd_number} allow {int(1000 / max_freq)} ms at least.")
+        return self.CompiledProgram
+
+    def _get_compiled_program(self) -> CompiledShotCycle:
+        """Returns the compiled program, recompiling it if missing or outdated (e.g. after ball driver config changes)."""
+        if self.CompiledProgram is None or self.CompiledProgram.shot_cycle is not self.ShotCycle or not self.CompiledProgram.is_valid(self.ball_drivers):
+            self.compile_program()
+        return self.CompiledProgram
+
+    def _play_compiled_shot(self) -> None:
+        """Program mode playback: only indexes into the precalculated tables of the compiled program."""
+        prg = self.CompiledProgram
+        bd_number = prg.bd_index[prg.current_index]
+        # look ahead: the driver which just got its ball can already spin up for its next shot, while the feeder is still returning
+        j = prg.next_on_driver[prg.current_index]
+        k = prg.current_index + 1 if prg.current_index + 1 < prg.count else 0
+        bd = self.ball_drivers[bd_number]
+        self._release_next_ball(bd_number, lambda: self._prepare_compiled_shot(prg, bd, j, k), prg.current_index) # the releasing still belongs to the current shot
+        i = prg.advance()
+        interval_ms = prg.interval_ms[i]
+        if interval_ms != self._current_interval_ms or not self.BallTimerRunning:
+            self._set_next_ball_interval(interval_ms)
+
+    def _prepare_compiled_shot(self, prg: CompiledShotCycle, bd: BallDriver, j: int, k: int) -> None:
+        """Called when the ball is committed: sets the driver to the speeds of its next shot j and aims at the next shot k.
+           The move of the axes, the spin-up and the return stroke of the feeder then run in parallel until the next release.
+        """
+        bd.apply_motor_speeds(prg.motor_pwm, j * prg.motor_stride)
+        self._aim(prg.rotator_target[k], prg.tilt_target[k])
+
+    def _aim(self, pan: int, tilt: int) -> None:
+        """Moves the pan and tilt axes to their targets (in 0.1 degrees, see AimingTable).
+           The release of the next ball waits for them to settle (see _release_next_ball()).
+        """
+        for mr in self.machine_rotators:
+            mr.rotate((pan if mr.axis == AimingTable.AXIS_PAN else tilt) / 10, self._rotator_settled)
+
+    def _driver_ready(self, bd: BallDriver) -> None:
+        """Called by a ball driver with speed control when its wheels reached the target speeds: may open the driver gate."""
+        self._release_gate_event()
+
+    def _rotator_settled(self, mr: MachineRotator) -> None:
+        """Called by a machine rotator when its move is complete: the aim gate opens when all rotators have settled."""
+        self._release_gate_event()
+
+    def _aim_at_shot(self, shot: Shot.Shot) -> None:
+        """Aims at a shot, which is not compiled (direct mode, or program mode before the compilation)."""
+        pan, tilt = self.aiming.lookup(shot.HorizontalAngle, shot.VerticalAngle)
+        self._aim(pan, tilt)
+
+    def set_aiming_table(self, path: str, save: bool = True) -> dict:
+        """Loads the AimingTable from a file built on the host (AimingTable.build()), an empty path restores the direct aiming.
+           The compiled program is recalculated with the new table.
+        """
+        if self._status != STATUS_IDLE:
+            raise InvalidOperationException(f"Machine must be in status IDLE ({STATUS_IDLE}) to change the aiming table, but current status is {self.status_text} ({self._status})!")
+        config = {'table_file': path} if path else {}
+        self.aiming = AimingTable.create_from_config(config)
+        self.aiming_config = config
+        self.CompiledProgram = None
+        if self._mode == MODE_PROGRAM:
+            self.compile_program()
+        if save:
+            self._save_settings()
+        return self.aiming.getStatusData()
+
+    def _prespin_ball_drivers(self, prg: CompiledShotCycle) -> None:
+        """Sets every ball driver of the program to the speeds of its first upcoming shot."""
+        done = []
+        for k in range(prg.count):
+            i = (prg.current_index + k) % prg.count
+            bd_number = prg.bd_index[i]
+            if bd_number not in done:
+                done.append(bd_number)
+                self.ball_drivers[bd_number].apply_motor_speeds(prg.motor_pwm, i * prg.motor_stride)
+
     def _play_shot(self, timer: Timer) -> None:
         """Play the next ball with the current settings and handle release cycle and shot cylcle"""
+        if self._mode == MODE_PROGRAM and self.CompiledProgram is not None:
+            self._play_compiled_shot()
+            return
         if self._mode == MODE_PROGRAM:
             shot_settings = self.ShotCycle.get_current_shot()
         elif self._mode == MODE_DIRECT:
@@ -454,27 +959,36 @@ class RobbyController:
         else:
             raise InvalidOperationException(f"Cannot play shot in mode {self._mode}. Only PROGRAM and DIRECT modes are supported.")
 
-        #TODO: We need the BallFeederNumber here, but it would make more sense to maintain Driver-Feeder relations somewhere.
-        #Until that's implemented, we use the driver number also as feeder number.
-        self._release_next_ball(shot_settings.BallDriverNumber) # the releasing still belongs to the current shot
-        sleep(self.BALL_RELEASE_DURATION)
-        # update the motors with possibly new settings
         if self._mode == MODE_PROGRAM:
             settings = self.ShotCycle.get_next_shot()
         elif self._mode == MODE_DIRECT:
             settings = self.ContinuousShot
-        self.ball_drivers[settings.BallDriverNumber].update_from_shot(settings)
+        # update the motors and the aim with possibly new settings, as soon as the ball is committed to the driver
+        self._release_next_ball(shot_settings.BallDriverNumber, lambda: self._prepare_shot(settings)) # the releasing still belongs to the current shot
         # update ball frequency if changed
         if (self._currentBallFrequency != 1.0/settings.Pause) or not self.BallTimerRunning:
             if self.debug:
                 print(f"Timer started or frequency changed from {self._currentBallFrequency} to {1.0/settings.Pause} bps")
             self._set_next_ball_frequency(1.0/settings.Pause)
 
+    def _prepare_shot(self, settings: Shot.Shot) -> None:
+        self.ball_drivers[settings.BallDriverNumber].update_from_shot(settings)
+        self._aim_at_shot(settings)
+
+    def _set_next_ball_interval(self, interval_ms: int) -> None:
+        """Changes the interval to the next ball (in ms), see _set_next_ball_frequency()."""
+        self._current_interval_ms = interval_ms
+        self.BallTimerRunning = False
+        self.BallTimer.deinit()
+        self.BallTimer.init(mode = Timer.PERIODIC, period=interval_ms, callback=self._play_shot)
+        self.BallTimerRunning = True
+
     def _set_next_ball_frequency(self, new_frequency) -> None:
         """Changes the ball frequency without interrupting the running shot cycle
            However, it is designed for call between timer cycles, as it will interrupt a running timer.
         """        
         self._currentBallFrequency = new_frequency
+        self._current_interval_ms = 0
         self.BallTimerRunning = False
         self.BallTimer.deinit()
         self.BallTimer.init(mode = Timer.PERIODIC, freq=new_frequency, callback=self._play_shot)
@@ -489,23 +1003,31 @@ class RobbyController:
             raise ImplementationException(f"RobbyController is not in the correct state ({self._status=}). Cannot start playing!")
         try:
             # get the next shot settings from the sequence and set the ball driver accordingly
+            if self._status == STATUS_IDLE:
+                self.reset_cadence()
+                self.feeder_scheduler.reset()
             if self._mode == MODE_PROGRAM:
+                prg = self._get_compiled_program()
                 if self._status == STATUS_IDLE:
-                    self.ShotCycle.reset()
-                shot_settings = self.ShotCycle.get_next_shot()
+                    prg.reset()
+                i = prg.current_index
+                self._status = STATUS_PLAYING
+                # start the ball motors and aim at the first shot (as early as possible)
+                self._prespin_ball_drivers(prg)
+                self._aim(prg.rotator_target[i], prg.tilt_target[i])
+                self._current_interval_ms = prg.interval_ms[i]
             elif self._mode == MODE_DIRECT:
                 shot_settings = self.ContinuousShot
-            self._status = STATUS_PLAYING
-
-            # start the ball motors (as early as possible)
-            self.ball_drivers[shot_settings.BallDriverNumber].update_from_shot(shot_settings)
+                self._status = STATUS_PLAYING
+                # start the ball motors and aim (as early as possible)
+                self.ball_drivers[shot_settings.BallDriverNumber].update_from_shot(shot_settings)
+                self._aim_at_shot(shot_settings)
+                # set the requested ball frequency
+                self._currentBallFrequency = 1.0/shot_settings.Pause
 
             # start the stirrers
             self._start_stirrers()
 
-            # set the requested ball frequency
-            self._currentBallFrequency = 1.0/shot_settings.Pause
-
             # use the timer callback function to play the ball and take care of the timer
             self._play_shot(self.BallTimer)
             # self.BallTimer.init(mode = Timer.PERIODIC, freq=self._currentBallFrequency, callback=self._play_shot)
@@ -525,14 +1047,23 @@ class RobbyController:
             # get the next shot settings from the sequence and set the ball driver accordingly
             # do this first to give the motors some time to spin up
             if self._mode == MODE_PROGRAM:
+                prg = self._get_compiled_program()
                 if self._status == STATUS_IDLE:
-                    self.ShotCycle.reset()
-                shot_settings = self.ShotCycle.get_next_shot()
+                    prg.reset()
+                i = prg.current_index
+                self._status = STATUS_PLAYING
+                # give the ball driver motors time to spin up for the first shot
+                self._prespin_ball_drivers(prg)
+                self._aim(prg.rotator_target[i], prg.tilt_target[i])
+                self._start_stirrers()
+                self._set_next_ball_interval(prg.interval_ms[i])
+                return
             elif self._mode == MODE_DIRECT:
                 shot_settings = self.ContinuousShot
             self._status = STATUS_PLAYING
             # give the ball driver motors time to spin up for the first shot
             self.ball_drivers[shot_settings.BallDriverNumber].update_from_shot(shot_settings)
+            self._aim_at_shot(shot_settings)
             # start the stirrers
             self._start_stirrers()
             # set the requested ball frequency
@@ -552,9 +1083,11 @@ class RobbyController:
     def _stop_playing(self) -> None:
         self._status = STATUS_STOPPING
         errors = []
+        self.power_sequencer.cancel()
         try:
             self.BallTimer.deinit()
             self.BallTimerRunning = False
+            self._cancel_release()
         except Exception as e:
             self._status = STATUS_ERROR
             errors.append(e)
@@ -625,6 +1158,8 @@ class RobbyController:
         self._mode = value
         if self._mode == MODE_DIRECT:
             self.ball_drivers[self.ContinuousShot.BallDriverNumber].update_from_shot(self.ContinuousShot)
+        elif self._mode == MODE_PROGRAM:
+            self.compile_program()
         if self.debug:
             print(f"Mode changed to {self.mode_text} ({self._mode})")
     
@@ -683,7 +1218,14 @@ class RobbyController:
             'status': self._status,
             'status_text': STATUS_TEXTS[self._status],
             'shot_cycle': self.ShotCycle.getStatusData(),
+            'compiled_program': self.CompiledProgram.getStatusData() if self.CompiledProgram else None,
             'continuous_shot': self.ContinuousShot.getConfigData(),
+            'cadence': self.get_cadence_report(),
+            'feeder_scheduler': self.feeder_scheduler.getStatusData(),
+            'critical_path': self.get_critical_path_report()['critical_counts'],
+            'stirrers': self.stirrer_policy.getStatusData(),
+            'power': self.power_sequencer.getStatusData(),
+            'aiming': self.aiming.getStatusData(),
         }
     def getConfigData(self) -> dict:
         return {
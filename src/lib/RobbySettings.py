@@ -9,7 +9,8 @@ if 'micropython' not in sys.version.lower():
 
 class RobbySettings:
     """RobbySettings contains all settings, parameters and label texts for the robot."""
-    MAX_BALL_FREQUENCY = 1.0
+    MAX_BALL_FREQUENCY = 4.0
+    """Upper bound of the balls per second. The actual limit is given by the ball feeders feeding a driver (see FeederScheduler)."""
     LABEL_PARAM_BALL_SPEED = 'BallSpeed'
     LABEL_PARAM_TOPSPIN = 'Topspin'
     LABEL_PARAM_SIDESPIN = 'Sidespin'
@@ -36,6 +37,8 @@ class RobbySettings:
         self.default_topspin = topspin
         self.default_sidespin = sidespin
         self.default_ball_frequency = ballfreq
+        self.spinup_policy = 'warn'
+        """What to do if a program's pause is too short for the ball driver to reach the next speeds: 'warn' or 'throttle' (extend the pause)."""
     
     def __set_ball_speed(self, value: float) -> None:
         if value < 0.0:
@@ -104,6 +107,7 @@ class RobbySettings:
             'default_topspin': self.default_topspin,
             'default_sidespin': self.default_sidespin,
             'default_ballspeed': self.default_ball_speed,
+            'spinup_policy': self.spinup_policy,
         }
     def load_from_config(self, config: dict):
         if 'hostname' in config:
@@ -120,3 +124,5 @@ class RobbySettings:
             self.default_sidespin = float(config['default_sidespin'])
         if 'default_ballspeed' in config:
             self.default_ball_speed = float(config['default_ballspeed'])
+        if 'spinup_policy' in config:
+            self.spinup_policy = str(config['spinup_policy'])
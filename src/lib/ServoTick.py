@@ -0,0 +1,55 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+from machine import Timer
+import time
+
+TICK_MS = 20
+"""tick period, equal to the pulse period of the servos at 50 Hz: the duty cannot take effect any faster"""
+
+class ServoTick:
+    """A single timer driving the movements of all servos, instead of sleeping in the caller.
+       The timer only runs while at least one servo is moving. On each tick every moving servo updates its duty cycle
+       (interpolation) and detects the end of its movement.
+    """
+    def __init__(self, period_ms: int = TICK_MS) -> None:
+        self.period_ms = period_ms
+        self._servos = []
+        self._timer = None
+        self.ticks = 0
+
+    def add(self, servo) -> None:
+        """Registers a moving servo. Its _tick(now_ms) method is called on every tick, until it is removed."""
+        if servo not in self._servos:
+            self._servos.append(servo)
+        if self._timer is None:
+            self._timer = Timer()
+            self._timer.init(mode=Timer.PERIODIC, period=self.period_ms, callback=self._tick)
+
+    def remove(self, servo) -> None:
+        if servo in self._servos:
+            self._servos.remove(servo)
+        if not self._servos and self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
+
+    def _tick(self, timer) -> None:
+        self.ticks += 1
+        now = time.ticks_ms()
+        for servo in list(self._servos): # servos remove themselves when finished
+            try:
+                servo._tick(now)
+            except Exception as e:
+                print(f"ServoTick: error moving servo {servo}: {e}")
+                self.remove(servo)
+
+    def getStatusData(self) -> dict:
+        return {
+            'period_ms': self.period_ms,
+            'moving_servos': len(self._servos),
+            'ticks': self.ticks,
+        }
+
+servo_tick = ServoTick()
+"""The tick shared by all servos of the machine."""
@@ -16,6 +16,7 @@ class Shot:
         self.__vert_angle = v_angle
         self.__bd_number = ball_driver_index
         self.__motor_settings = None
+        self.__motor_settings_version = -1
 
     # def init_for_bd(self, ball_driver: BallDriver.BallDriver, ball_driver_index: int = -1):
     #     """Initializes the shot for a specific ball driver. The bd (or the controller) must take care to call this method before it actually plays the shot."""
@@ -23,7 +24,21 @@ class Shot:
     #     if ball_driver_index >= 0:
     #         self.__bd_number = ball_driver_index
 
+    def __set_motor_settings(self, value):
+        self.__motor_settings = value
+        self.__motor_settings_version = -1
+
+    def __set_motor_settings_version(self, value: int):
+        self.__motor_settings_version = value
+
+    def __set_bd_number(self, value: int):
+        if value != self.__bd_number:
+            # motor settings are specific to the ball driver
+            self.__motor_settings = None
+        self.__bd_number = value
+
     def __set_topspin(self, value: float):
+        self.__motor_settings = None
         if value < 0.0:
             self.__topspin = 0.0
         elif value > 1.0:
@@ -32,6 +47,7 @@ class Shot:
             self.__topspin = value
 
     def __set_sidespin(self, value: float):
+        self.__motor_settings = None
         if value < 0.0:
             self.__sidespin = 0.0
         elif value > 1.0:
@@ -40,6 +56,7 @@ class Shot:
             self.__sidespin = value
 
     def __set_ball_speed(self, value: float):
+        self.__motor_settings = None
         if value < 0.0:
             self.__speed = 0.0
         elif value > 1.0:
@@ -53,11 +70,14 @@ class Shot:
         else:
             self.__speed = value
 
-    BallDriverNumber = property(lambda self: self.__bd_number)
+    BallDriverNumber = property(lambda self: self.__bd_number, __set_bd_number)
     """Get the balldriver index (technical interface)"""
-    MotorSettings = property(lambda self: self.__motor_settings)
-    """Get the motor settings (technical interface)"""
-    BallSpeed = property(lambda self: self.__ball_speed, __set_ball_speed)
+    MotorSettings = property(lambda self: self.__motor_settings, __set_motor_settings)
+    """Get or set the motor settings calculated by the ball driver (technical interface). Reset whenever speed or spin change."""
+    MotorSettingsVersion = property(lambda self: self.__motor_settings_version if self.__motor_settings is not None else -1, __set_motor_settings_version)
+    """Geometry version of the ball driver the motor settings were calculated with (technical interface), -1 if unknown.
+       Set after MotorSettings, since setting those resets it."""
+    BallSpeed = property(lambda self: self.__speed, __set_ball_speed)
     """ball's forward speed"""
     Topspin = property(lambda self: self.__topspin, __set_topspin)
     """ball's rotation around the horizontal axis: -1=max backspin to +1=max topspin"""
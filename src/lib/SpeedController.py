@@ -0,0 +1,236 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List, Union
+from array import array
+from RobbyExceptions import ConfigurationException
+try:
+    from machine import Timer
+except ImportError:
+    Timer = None # host environment: tick() must be called by the caller
+
+class SpeedController:
+    """Closed-loop speed control for the DC motors of a ball driver.
+       A PI controller per motor compares the speed measured by a tachometer with the target speed and adjusts the motor's PWM.
+       The requested motor speed (percent) is used as feed forward, so the controller only has to correct the deviation
+       caused by battery voltage, wear etc. and the motors settle on the target faster than without feedback.
+       A wheel sensor delivers only a few pulses per tick, so the speed is measured over a sliding window of the last
+       window_ticks ticks. Its resolution (one pulse per window) must not be coarser than the ready tolerance,
+       otherwise the measured speed could never be within it.
+    """
+    def __init__(self, motors: list, tachometers: list, max_rpm: List[float], kp: float = 0.02, ki: float = 0.05, tick_ms: int = 50, tolerance_pct: float = 5.0, settle_ticks: int = 3, window_ticks: int = 6, debug=False):
+        """Parameters:
+           motors:        DcMotor objects (or compatible, having set_speed()), one per tachometer.
+           tachometers:   Tachometer objects (or the PulseGenerator stand-in), having count() and pulses_per_rev.
+           max_rpm:       Wheel speed per motor at 100% PWM, used to convert the requested percentage into a target speed.
+           kp, ki:        PI gains in percent PWM per rpm (and per rpm*s).
+           tick_ms:       Fixed control period in ms.
+           tolerance_pct: Max. deviation from the target speed (in percent of max_rpm) which is still considered as ready.
+           settle_ticks:  Number of consecutive ticks all motors must be within tolerance before the driver is ready.
+           window_ticks:  Number of ticks the speed is measured over.
+        """
+        if len(motors) != len(tachometers) or len(motors) != len(max_rpm):
+            raise ValueError("SpeedController requires the same number of motors, tachometers and max_rpm values.")
+        self.debug = debug
+        self.motors = motors
+        self.tachometers = tachometers
+        self.max_rpm = [float(r) for r in max_rpm]
+        self.kp = kp
+        self.ki = ki
+        self.tick_ms = tick_ms
+        self.tolerance_pct = tolerance_pct
+        self.settle_ticks = settle_ticks
+        self.window_ticks = max(int(window_ticks), 1)
+        for i in range(len(motors)):
+            if self.resolution_rpm(i) > self.tolerance_pct / 100.0 * self.max_rpm[i]:
+                raise ConfigurationException(f"SpeedController: the speed of motor #{i} is measured in steps of {self.resolution_rpm(i):.0f} rpm, "
+                                             f"which is coarser than the tolerance of {self.tolerance_pct}% of {self.max_rpm[i]:.0f} rpm. "
+                                             f"Increase tolerance_pct, window_ticks, tick_ms or the pulses per revolution.")
+        self.ready_callback = None
+        """Optional function without parameters, called whenever all motors reached their target speeds."""
+        n = len(motors)
+        self.target_pct = [0.0] * n
+        self.measured_rpm = [0.0] * n
+        self._output_pct = [0] * n
+        self._integral = [0.0] * n
+        self._counts = [array('I', [0] * self.window_ticks) for _ in range(n)]
+        """pulse counts of the last window_ticks ticks per motor (ring buffer)"""
+        self._pos = 0
+        self._ticks = 0
+        """ticks since the start, the window is complete after window_ticks"""
+        self._settled_ticks = 0
+        self._ready = True
+        self._timer = None
+        self.running = False
+
+    def set_targets(self, speeds_pct: List[int]):
+        """Sets new target speeds (percent of max. speed, -100 to +100) for all motors."""
+        for i in range(len(self.target_pct)):
+            if self.target_pct[i] != speeds_pct[i]:
+                self.target_pct[i] = float(speeds_pct[i])
+                self._integral[i] = 0.0
+                self._settled_ticks = 0
+                self._ready = False
+        if not self.running:
+            # without control loop the feed forward is all we can do
+            for i in range(len(self.motors)):
+                self._apply(i, int(self.target_pct[i]))
+
+    def start(self):
+        """Starts the control loop on a periodic timer."""
+        if self.running:
+            return
+        for i in range(len(self.tachometers)):
+            count = self.tachometers[i].count()
+            ring = self._counts[i]
+            for k in range(self.window_ticks):
+                ring[k] = count
+            self._apply(i, int(self.target_pct[i]))
+        self._pos = 0
+        self._ticks = 0
+        self._settled_ticks = 0
+        self._ready = False
+        self.running = True
+        if Timer:
+            self._timer = Timer(period=self.tick_ms, mode=Timer.PERIODIC, callback=self._on_timer)
+        if self.debug:
+            print(f"SpeedController started with {self.tick_ms} ms tick.")
+
+    def stop(self):
+        """Stops the control loop. The motors are not touched, this is up to the owner."""
+        self.running = False
+        if self._timer:
+            self._timer.deinit()
+            self._timer = None
+        for i in range(len(self._output_pct)):
+            self._output_pct[i] = 0
+            self._integral[i] = 0.0
+
+    def _on_timer(self, timer):
+        self.tick()
+
+    def tick(self):
+        """Performs one control step. Called by the timer on the device, or explicitly on the host."""
+        dt_s = self.tick_ms / 1000.0
+        span = self._ticks + 1 if self._ticks < self.window_ticks else self.window_ticks
+        window_s = span * dt_s
+        pos = self._pos
+        # as long as the window is not complete, the readings are too coarse to be considered ready
+        all_within = self._ticks >= self.window_ticks
+        for i in range(len(self.motors)):
+            count = self.tachometers[i].count()
+            ring = self._counts[i]
+            pulses = (count - ring[pos]) & 0xFFFFFFFF
+            ring[pos] = count & 0xFFFFFFFF
+            rpm = pulses * 60.0 / self.tachometers[i].pulses_per_rev / window_s
+            self.measured_rpm[i] = rpm
+            target = self.target_pct[i]
+            target_rpm = abs(target) / 100.0 * self.max_rpm[i]
+            err = target_rpm - rpm
+            if abs(err) > self.tolerance_pct / 100.0 * self.max_rpm[i]:
+                all_within = False
+            if target == 0.0:
+                self._apply(i, 0)
+                continue
+            integral = self._integral[i] + err * dt_s
+            out = abs(target) + self.kp * err + self.ki * integral
+            if out > 100.0:
+                out = 100.0
+            elif out < 0.0:
+                out = 0.0
+            else:
+                # anti windup: only integrate while the output is not saturated
+                self._integral[i] = integral
+            self._apply(i, int(out) if target > 0 else -int(out))
+        self._pos = (pos + 1) % self.window_ticks
+        self._ticks += 1
+        if all_within:
+            self._settled_ticks += 1
+        else:
+            self._settled_ticks = 0
+        was_ready = self._ready
+        self._ready = self._settled_ticks >= self.settle_ticks
+        if self._ready and not was_ready:
+            if self.debug:
+                print(f"SpeedController: target speeds reached ({self.measured_rpm=}).")
+            if self.ready_callback:
+                self.ready_callback()
+
+    def _apply(self, i: int, pwm_pct: int):
+        # Setting a speed on the PCA9685 costs several I2C transfers, so only unchanged values are skipped.
+        if pwm_pct != self._output_pct[i]:
+            self._output_pct[i] = pwm_pct
+            self.motors[i].set_speed(pwm_pct)
+
+    def resolution_rpm(self, i: int) -> float:
+        """Smallest speed difference of motor i the sliding window can resolve (one pulse per window)."""
+        return 60000.0 / self.tachometers[i].pulses_per_rev / (self.tick_ms * self.window_ticks)
+
+    def is_ready(self) -> bool:
+        """True if all motors run within tolerance at their target speeds."""
+        return self._ready
+
+    def getStatusData(self) -> dict:
+        return {
+            'running': self.running,
+            'ready': self._ready,
+            'target_pct': self.target_pct,
+            'measured_rpm': [int(r) for r in self.measured_rpm],
+            'output_pct': self._output_pct,
+            'resolution_rpm': [int(self.resolution_rpm(i)) for i in range(len(self.motors))],
+        }
+
+    def getConfigData(self) -> dict:
+        return {
+            'kp': self.kp,
+            'ki': self.ki,
+            'tick_ms': self.tick_ms,
+            'tolerance_pct': self.tolerance_pct,
+            'settle_ticks': self.settle_ticks,
+            'window_ticks': self.window_ticks,
+            'max_rpm': self.max_rpm,
+            'tachometers': [t.getConfigData() for t in self.tachometers],
+        }
+
+def simulate(controller: SpeedController, duration_ms: int) -> int:
+    """Runs the controller on the host against PulseGenerator stand-ins, which serve as its motors and tachometers.
+       Returns the time in ms until the controller signalled ready, or -1 if it did not settle within duration_ms.
+    """
+    controller.running = True
+    t = 0
+    while t < duration_ms:
+        for gen in controller.tachometers:
+            gen.advance(controller.tick_ms)
+        controller.tick()
+        t += controller.tick_ms
+        if controller.is_ready():
+            return t
+    return -1
+
+def run_speed_control_test(max_rpm: float = 6000.0, duration_ms: int = 3000) -> bool:
+    """Host test: the controller must settle with the default config (1 pulse per revolution) for a range of targets,
+       also with a weakened motor, which the feed forward alone cannot bring to its target.
+    """
+    from Tachometer import PulseGenerator
+    ok = True
+    for load_factor in (1.0, 0.85):
+        for target in (30, 45, 50, 70, 85):
+            gen = PulseGenerator(max_rpm=max_rpm)
+            gen.load_factor = load_factor
+            controller = SpeedController([gen], [gen], [max_rpm])
+            controller.set_targets([target])
+            ready_ms = simulate(controller, duration_ms)
+            if ready_ms < 0:
+                print(f"Speed control did not settle at {target}% (load factor {load_factor}), measured {controller.measured_rpm[0]:.0f} rpm.")
+                ok = False
+    try:
+        SpeedController([PulseGenerator()], [PulseGenerator()], [max_rpm], tolerance_pct=1.0)
+        print("Speed control accepted a tolerance finer than its resolution.")
+        ok = False
+    except ConfigurationException:
+        pass
+    print(f"Speed control test {'passed' if ok else 'FAILED'}.")
+    return ok
@@ -2,31 +2,45 @@
 # 
 # This software is released under the MIT License.
 # https://opensource.org/licenses/MIT
-from machine import Pin
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List, Union
+from machine import Pin, Timer
 import time
+from array import array
 from math import ceil
-from RobbyExceptions import ConfigurationException
+from RobbyExceptions import ConfigurationException, InputDataException, InvalidOperationException
+from StepProfile import StepProfile
+from PioAllocator import allocator
+from IrqEventQueue import event_queue
+from DriveMode import DRIVE_HALF_STEP, PATTERNS, backward_patterns, ticks_per_cycle
+from StepMotorPrograms import PROFILE_SM_FREQ, VARIABLE_SM_FREQ, SEGMENT_PROGRAMS, run_variable_pio, run_profile_pio, \
+    encode_segment, encode_patterns, encode_profile, variable_phase_delay
 
 MODE_UNSET = 0
 MODE_COUNTED = 1
 MODE_PERMANENT = 2
 MODE_INTERVAL = 3
-SM_MIN_FREQ = 1908
-TICKS_PER_CYCLE = 192 # duration of the PIO loop for one cylce of the inner motor (one iteration of the runner code)
+MAX_SEGMENTS = 4 # segments of one move which fit into the TX FIFO of run_segments_pio (the RX FIFO is needed for the position readback)
+PIO_TXF_ADDR = (0x50200010, 0x50300010) # TX FIFO register of SM0 per PIO block (next SMs +4)
+DREQ_PIO_TX = (0, 8) # DMA request of SM0 TX per PIO block (next SMs +1)
+RAMP_INTERVAL_MS = 20 # update interval of the speed ramp in continuous mode
 
 # Installation instructions with ULN2003 Stepper Motor Driver Module
 # - Connect motor to driver module (simply plug in)
 # - Wire the input signals (IN1 to IN4 on the module), beginning from the starting_gp_pin (specified for class constructor) on the pico.
 # - Wire the power supply to driver module, either from pico or from external source.
 class StepMotorPIO:
-    """Class provides the internal functions to control a single stepper motor via PIO and 2 state machines.
+    """Class provides the internal functions to control a single stepper motor via PIO state machines.
        This can be used for alternating back/forth movement (ball pusher) or for constant (or repeating) movement into one direction.  
        The class provides these high-level methods:
        - rotate(): perform an async rotation into one direction until stop() is called
        - rotate_by_angle(): perform an async rotation by the given angle. A callback informs the caller when it is finished.
+       - rotate_segments(): perform several async rotations back and forth in a row, with one callback at the end.
        - stop(): stop all current operation
+       - read_position_steps(): the live absolute position (counted mode), also during a move
     """
-    def __init__(self, mode: int, gear_ratio = 64, inner_motor_steps = 32, correction_steps = -4, starting_gp_pin = 2, consecutive_pins = 4, pio_block_index = 0, runner_freq = 20000, counter_freq = 2000, debug=None):
+    def __init__(self, mode: int, gear_ratio = 64, inner_motor_steps = 32, correction_steps = -4, starting_gp_pin = 2, consecutive_pins = 4, pio_block_index = 0, runner_freq = 20000, counter_freq = 2000, drive_mode = DRIVE_HALF_STEP, debug=None):
         """Parameters:
            mode:              Mode of operation: MODE_COUNTED or MODE_PERMANENT
            gear_ratio:        See specs of the step motor.
@@ -34,18 +48,52 @@ class StepMotorPIO:
            correction_steps:  This value is added to the number of inner steps required for a full rotation and is used to reflect deviations from the motor's theoretical gear ratio.
            starting_gp_pin:   GPIO-Index of the first of the consecutive pins the motor is connected to.
            consecutive_pins:  Total number of consecutive pins the motor is connected to.
-           pio_block_index:   Pico has two pio blocks, so this can be 0 or 1 only (note that not all statemachines might be available dur to internal usage, e.g. for wlan!).
+           pio_block_index:   Preferred pio block (0 or 1), the PioAllocator falls back to the other one if it is full.
            runner_freq:       The frequency (Hz) to operate the state machines for driving the motor forward/backward.
-           counter_freq:      The frequency (Hz) to operate the state machine for controlling the number of motor steps.
+           counter_freq:      Not used anymore, since the steps are counted by the runner itself (kept for config compatibility).
+           drive_mode:        'half', 'full' or 'wave' (see DriveMode). Full step and wave drive make 4 instead of 8 phases per step,
+                              so the motor turns twice as fast at the same runner_freq, which might have to be reduced accordingly.
         """
         self.debug = debug
         self.mode = mode
         self._operating = False
         self._current_direction = 0
-        self._counter_sm = None
+        self._segment_sm = None
         self._runner_fwd_sm = None
-        self._runner_bwd_sm = None
+        self._sm_id = None
+        """id (0-7) of the state machine assigned by the PioAllocator"""
+        self._sm_setup = None
+        """(mode, pio block, first pin, runner freq, counter freq) the current state machines were created for"""
+        self.sm_rebuilds = 0
+        self._last_setup_us = 0
+        """time in us to prepare the state machines for the last move"""
         self._op_complete_callback = None
+        self._move_complete_ref = self._move_complete
+        """bound method created once, so the irq handler can post it without allocating memory"""
+        self._profile_sm = None
+        self._dma = None
+        self._profile_words = None
+        """step words of the running profiled move, must be kept until the DMA transfer is finished"""
+        self._phase = 0
+        """index into the forward patterns of the coil pattern last set by a profiled move"""
+        self.last_profile: Union[StepProfile, None] = None
+        self.position_steps = 0
+        """absolute position in steps at the start of the current move (counted mode), see read_position_steps()"""
+        self._move_segments = []
+        """signed step counts of the running move"""
+        self._move_id = 0
+        """incremented per move, so a deferred completion cannot be mistaken for the one of a later move"""
+        self._profile_word_count = 0
+        self._speed_rpm = 0.0
+        """current speed in continuous mode (the value passed to the state machine last)"""
+        self._target_rpm = 0.0
+        self._ramp_timer = None
+        self.ramp_rpm_per_s = 30.0
+        """acceleration of speed changes in continuous mode, 0 switches the speed immediately"""
+        self.motion_profile = None
+        """Optional acceleration profile for counted moves: dict with max_rpm, accel_rpm_per_s and start_rpm.
+           If not set, moves are performed with the fixed rate given by runner_freq.
+        """
         # basic config
         self.starting_gp_pin = starting_gp_pin
         self.consecutive_pins = consecutive_pins
@@ -55,10 +103,19 @@ class StepMotorPIO:
         self.runner_freq = runner_freq
         self.counter_freq = counter_freq
         self.pio_block_index = min(max(pio_block_index, 0),1)
+        self.drive_mode = drive_mode
         self.adopt_config()
 
     def adopt_config(self):        
+        # the state machines must be rebuilt for the new config on the next move
+        if self._sm_setup is not None:
+            self._set_direction(0)
+            self._sm_setup = None
         # derived config
+        if self.drive_mode not in PATTERNS:
+            raise ConfigurationException(f"Invalid drive mode '{self.drive_mode}', must be one of {list(PATTERNS.keys())}.")
+        self.patterns = PATTERNS[self.drive_mode]
+        self._phase = 0
         self.pins = [Pin(i, Pin.OUT) for i in range(self.starting_gp_pin, self.starting_gp_pin + self.consecutive_pins)]
         self.full_rotation_steps = ((self.gear_ratio * self.inner_motor_steps) + self.correction_steps) / len(self.pins)  # 64*32 = 2048 steps -> 2048-4 / 4 = 511 (a step is a full cycle for the coils)
         self.angle_per_step = 360.0 / self.full_rotation_steps   # 0.7045° per step
@@ -68,64 +125,89 @@ class StepMotorPIO:
             print(f"  {self.inner_motor_steps=}")
             print(f"  {self.full_rotation_steps=}")
             print(f"  {self.angle_per_step=}")
+            print(f"  {self.drive_mode=}")
             print(f"  {self.pins=}")
             print(f"  {self.pio_block_index=}")
             print("StepMotorPIO init complete.")
 
     def v2_create_statemachines(self, runner_freq = 20000, counter_freq = 2000):
-        """Create the statemachines for the specified mode."""
+        """Create the statemachines for the specified mode.
+           The state machine is placed by the PioAllocator, preferrably in the configured PIO block.
+        """
         if self.debug:
             print("create_my_statemachines()")
-        try:
-            #rp2.PIO(self.pio_block_index).remove_program() # clear all programs from PIO block
-            if self.mode == MODE_COUNTED:
-                if self.debug:
-                    print("removing pio programs for counted mode")
-                rp2.PIO(self.pio_block_index).remove_program(trigger_steps)
-                rp2.PIO(self.pio_block_index).remove_program(run_forward_pio)
-                rp2.PIO(self.pio_block_index).remove_program(run_backward_pio)
-            elif self.mode == MODE_PERMANENT:
-                if self.debug:
-                    print("removing pio programs for permanent mode")
-                rp2.PIO(self.pio_block_index).remove_program(run_endless_pio)
-        except Exception as e:
-            if self.debug:
-                print(f"Could not remove PIO programs: {str(e)}")
         # This whole dynamic handling is no longer required, as there are basically just two modes of operation to distinguish:
         # - run endlessly in either direction or
         # - run for specific time in either direction (meaning there steps are counted and callback is possible)
-        self._counter_sm = None
+        allocator.release(self._sm_id) # stops the state machine and unloads the program if no other motor uses it
+        self._sm_id = None
+        self._segment_sm = None
         self._runner_fwd_sm = None
-        self._runner_bwd_sm = None
-        base_sm_index = self.pio_block_index * 4 # PIO0: 0-3; PIO1: 4-7
-        # HOWEVER: PIO1 SM0+SM1 are used for WiFi (sm_index 4-5)!!!
-        if self.pio_block_index == 1 and self.mode == MODE_COUNTED:
-            raise ConfigurationException(f"Cannot operate step motor in counted mode (e.g. ballfeeder) on PIO block 1, as this is partly occupied by WLAN. Change motor config to use pio block 0!")
-        if self.debug:
-            print(f"{base_sm_index=})")
+        self._profile_sm = None
+        owner = f"{type(self).__name__} GP{self.starting_gp_pin}"
         prg_name = ''
         try:
-            if self.mode == MODE_COUNTED:
-                prg_name = 'irq'
-                rp2.PIO(self.pio_block_index).irq(self._irq_handler)
-                prg_name = 'counter_sm'
-                self._counter_sm = rp2.StateMachine(base_sm_index + 0, trigger_steps, freq=counter_freq) # controls the sequences
-                prg_name = 'runner_fwd_sm (counted)'
-                self._runner_fwd_sm = rp2.StateMachine(base_sm_index + 1, run_forward_pio, freq=runner_freq, set_base=self.pins[0]) # performs the steps for a forward sequence
-                prg_name = 'runner_bwd_sm (counted)'
-                self._runner_bwd_sm = rp2.StateMachine(base_sm_index + 2, run_backward_pio, freq=runner_freq, set_base=self.pins[0]) # performs the steps for a backward sequence
+            if self.mode == MODE_COUNTED and self.motion_profile:
+                prg_name = 'run_profile_pio'
+                self._sm_id = allocator.allocate(owner, run_profile_pio, prg_name, preferred_block=self.pio_block_index)
+                # the steps are streamed by DMA
+                self._profile_sm = rp2.StateMachine(self._sm_id, run_profile_pio, freq=PROFILE_SM_FREQ, out_base=self.pins[0])
+                if self._dma is None:
+                    self._dma = rp2.DMA()
+                allocator.register_irq(self._sm_id, self._irq_handler)
+            elif self.mode == MODE_COUNTED:
+                prg_name = 'run_segments_pio'
+                program = SEGMENT_PROGRAMS[self.drive_mode]
+                self._sm_id = allocator.allocate(owner, program, f"{prg_name} ({self.drive_mode})", preferred_block=self.pio_block_index)
+                # counts the steps and drives the coils for all segments of a move, in both directions
+                self._segment_sm = rp2.StateMachine(self._sm_id, program, freq=runner_freq, set_base=self.pins[0])
+                allocator.register_irq(self._sm_id, self._irq_handler)
             elif self.mode == MODE_PERMANENT:
-                prg_name = 'runner_fwd_sm (permanent)'
-                # here we use offset 3, so that it is possible to have 1 feeder and 1 stirrer in the same PIO block
-                self._runner_fwd_sm = rp2.StateMachine(base_sm_index + 3, run_endless_pio, freq=runner_freq, set_base=self.pins[0]) # performs the steps for a forward sequence
+                prg_name = 'run_variable_pio'
+                self._sm_id = allocator.allocate(owner, run_variable_pio, prg_name, preferred_block=self.pio_block_index)
+                # the coil patterns and the speed are passed via the FIFO, so the program is the same for all drive modes
+                self._runner_fwd_sm = rp2.StateMachine(self._sm_id, run_variable_pio, freq=VARIABLE_SM_FREQ, out_base=self.pins[0])
             elif self.mode != MODE_UNSET:
                 raise Exception(f"Invalid mode specified: {self.mode}")
         except Exception as e:
             if self.debug:
                 print(f"Could not create PIO program ({prg_name}): {str(e)}")
             raise e
+        self._sm_setup = (self.mode, self.pio_block_index, self.starting_gp_pin, runner_freq, self._profile_sm is not None)
+        self.sm_rebuilds += 1
         if self.debug:
-            print(f"Created statemachines for {self.mode=} in PIO block {self.pio_block_index}.")
+            print(f"Created statemachines for {self.mode=} on state machine {self._sm_id}.")
+
+    def _prepare_statemachines(self, runner_freq = 20000, counter_freq = 2000):
+        """Prepares the state machines for the next move. They are created only once per config and just restarted
+           for each move, so that a move only costs pushing the step count into the FIFO.
+        """
+        t0 = time.ticks_us()
+        setup = self._sm_setup
+        if setup is None or setup[0] != self.mode or setup[1] != self.pio_block_index or setup[2] != self.starting_gp_pin:
+            self.v2_create_statemachines(runner_freq=runner_freq, counter_freq=counter_freq)
+        elif self._profile_sm:
+            self._profile_sm.restart()
+            # drop step words left over from an interrupted move
+            for _ in range(self._profile_sm.tx_fifo()):
+                self._profile_sm.exec("pull(noblock)")
+        elif self._runner_fwd_sm:
+            # start over at the beginning of the program, which reads the coil patterns first
+            self._runner_fwd_sm.init(run_variable_pio, freq=VARIABLE_SM_FREQ, out_base=self.pins[0])
+        elif setup[3] != runner_freq:
+            # only the speed changed: re-init the runner with the already loaded program
+            self._segment_sm.init(SEGMENT_PROGRAMS[self.drive_mode], freq=runner_freq, set_base=self.pins[0])
+            self._sm_setup = (setup[0], setup[1], setup[2], runner_freq, setup[4])
+        elif self._segment_sm:
+            # a stopped move may have left the state machine in the middle of a segment
+            self._segment_sm.restart()
+            for _ in range(self._segment_sm.tx_fifo()):
+                self._segment_sm.exec("pull(noblock)")
+            for _ in range(self._segment_sm.rx_fifo()):
+                self._segment_sm.get()
+        self._last_setup_us = time.ticks_diff(time.ticks_us(), t0)
+        if self.debug:
+            print(f"State machines prepared in {self._last_setup_us} us ({self.sm_rebuilds} rebuilds so far).")
 
     # def _create_statemachines(self, mode: int, runner_freq = 20000, counter_freq = 2000):
     #     """mode:              mode of operation: MODE_FEEDER, MODE_PERMANENT, MODE_INTERVAL
@@ -181,62 +263,86 @@ class StepMotorPIO:
     #         print(f"Created statemachines for {self.mode=} in PIO block {self.pio_block_index}.")
 
     def rotate(self, speed_rpm: float = 1.0):
-        """Endlessly turns the motor with the specified speed.
-           The direction is dependent on the sign of speed_rpm:
+        """Endlessly turns the motor with the specified speed, or changes the speed of the ongoing rotation.
+           The direction is dependent on the sign of speed_rpm.
+           The speed is ramped with ramp_rpm_per_s, a change of direction ramps down to 0 first.
            
            Parameters:
-           speed_rpm (float): The speed in rotations per minute. Positive value means forward, negative means backwards. Passing 0 will result in no effect at all.
+           speed_rpm (float): The speed in rotations per minute. Positive value means forward, negative means backwards. Passing 0 will ramp the motor down and stop it.
         """
-        # Empiric:
-        # 1 round per 5 sec equals 20kHz
-        # 0.2 rps <=> 20 kHz
-        # 0.2 Hz <=> 20000 Hz
-        # 1 <=> 100000
         if self.debug:
-            print(f"run_forever({speed_rpm=}) called")
+            print(f"rotate({speed_rpm=}) called")
         if self.mode != MODE_PERMANENT:
             raise Exception("rotate() is only allowed in continuous mode!")
-
+        max_rpm = self.max_continuous_rpm()
+        self._target_rpm = min(max(float(speed_rpm), -max_rpm), max_rpm)
+        if self.ramp_rpm_per_s <= 0:
+            self._apply_speed(self._target_rpm)
+            return
+        if self._ramp_timer is None:
+            self._ramp_timer = Timer()
+            self._ramp_timer.init(mode=Timer.PERIODIC, period=RAMP_INTERVAL_MS, callback=self._ramp_step)
+
+    def max_continuous_rpm(self) -> float:
+        """Max. speed in continuous mode, given by the phase rate of the fixed rate programs at runner_freq (24 ticks per phase)."""
+        return self.runner_freq * 60.0 / (24 * len(self.patterns) * self.full_rotation_steps)
+
+    def _ramp_step(self, timer):
+        """Timer callback: moves the speed one increment towards the target speed."""
+        cur = self._speed_rpm
+        target = self._target_rpm
+        if cur * target < 0:
+            target = 0.0 # change of direction: stop first
+        inc = self.ramp_rpm_per_s * RAMP_INTERVAL_MS / 1000.0
+        if abs(target - cur) <= inc:
+            new = target
+        else:
+            new = cur + inc if target > cur else cur - inc
+        if self._runner_fwd_sm and self._runner_fwd_sm.tx_fifo() > 0 and new != 0.0:
+            return # the last speed has not been taken yet (slow speeds take one word per pattern cycle only)
+        self._apply_speed(new)
+        if new == self._target_rpm:
+            self._stop_ramp()
+
+    def _stop_ramp(self):
+        if self._ramp_timer is not None:
+            self._ramp_timer.deinit()
+            self._ramp_timer = None
+
+    def _apply_speed(self, speed_rpm: float):
+        """Passes the speed to the state machine, which is started or stopped as required."""
         if speed_rpm == 0.0:
+            if self._operating:
+                self._set_direction(0)
+            self._speed_rpm = 0.0
+            self._current_direction = 0
             return
-        if self._operating:
-            raise Exception("Ongoing Rotation not yet finished!")
-        self._operating = True
-        
-        try:
-            if speed_rpm < 0.0:
-                self._current_direction = -1
-                speed_rpm = -speed_rpm
-            else:
-                self._current_direction = 1
-
-            # Unfortunately, this formula doesn't make any sense. However, it gives a suitable result
-            freq = ceil(speed_rpm * TICKS_PER_CYCLE * self.full_rotation_steps) # steps per sec
-
-            if self.debug:
-                print(f"{freq=}")
-            if freq > self.runner_freq:
-                freq = self.runner_freq
-                if self.debug:
-                    print(f"Frequency is capped at {freq} Hz")
-            elif freq < SM_MIN_FREQ:
-                freq = SM_MIN_FREQ
+        direction = 1 if speed_rpm > 0 else -1
+        if self._operating and direction != self._current_direction:
+            self._set_direction(0)
+        delay = self.phase_delay(abs(speed_rpm))
+        if not self._operating:
+            self._operating = True
+            try:
+                self._current_direction = direction
+                self._prepare_statemachines(runner_freq=self.runner_freq, counter_freq=self.counter_freq)
+                patterns = self.patterns if direction > 0 else backward_patterns(self.drive_mode)
+                self._runner_fwd_sm.put(encode_patterns(patterns))
+                self._runner_fwd_sm.put(delay)
+                self._set_direction(direction)
                 if self.debug:
-                    print(f"Frequency is raised to lower limit of {freq} Hz")
+                    print(f"Endless operation started ({speed_rpm=}, {delay=}).")
+            except Exception as e:
+                print(f"Error: {e}")
+                self._set_direction(0)
+                raise e
+        else:
+            self._runner_fwd_sm.put(delay) # taken at the start of the next pattern cycle
+        self._speed_rpm = speed_rpm
 
-            # set up the state machines (freq might have changed)
-            self.v2_create_statemachines(runner_freq=freq)
-
-            # activate only the fwd sm
-            if self._runner_fwd_sm:
-                self._runner_fwd_sm.active(1)
-            #self._set_direction(self._current_direction)
-            if self.debug:
-                print(f"Endless operation started ({freq=}, {self._current_direction=}).")
-        except Exception as e:
-            print(f"Error: {e}")
-            self._set_direction(0)
-            raise e
+    def phase_delay(self, speed_rpm: float) -> int:
+        """Delay loop count per phase of run_variable_pio for the given speed (> 0)."""
+        return variable_phase_delay(speed_rpm, self.full_rotation_steps, len(self.patterns))
 
     # def rotate(self, speed_rpm: float):
     #     """Endlessly turns the motor with the specified speed.
@@ -299,32 +405,65 @@ class StepMotorPIO:
         """
         if self.debug:
             print(f"rotate_by_angle() called: {angle} degrees...")
-        if self.mode != MODE_COUNTED:
-            raise Exception("run_forever() is only allowed in counted mode!")
         if angle == 0:
             return
+        self.rotate_segments([self.angle_to_steps(angle)], op_complete_callback)
+
+    def angle_to_steps(self, angle: float) -> int:
+        """Converts an angle into the (signed) number of motor steps as used by rotate_segments()."""
+        return round(angle / self.angle_per_step)
+
+    def estimate_move_ms(self, step_counts: List[int]) -> int:
+        """Theoretical duration of a move by rotate_segments() in ms, without the setup and the completion latency."""
+        cfg = self.motion_profile
+        if self.mode == MODE_COUNTED and cfg:
+            phases = len(self.patterns)
+            scale = self.full_rotation_steps * phases / 60.0 # rpm -> phases/s
+            total_us = 0
+            for c in step_counts:
+                if c != 0:
+                    total_us += StepProfile(abs(c) * phases, float(cfg.get('max_rpm', 15.0)) * scale,
+                                            float(cfg.get('accel_rpm_per_s', 60.0)) * scale, float(cfg.get('start_rpm', 6.0)) * scale).duration_us
+            return total_us // 1000
+        steps = sum([abs(c) for c in step_counts])
+        return steps * (ticks_per_cycle(self.drive_mode) + 1) * 1000 // self.runner_freq # + loop of run_segments_pio
+
+    def rotate_segments(self, step_counts: List[int], op_complete_callback=None):
+        """Performs a move consisting of several segments without any CPU involvement between them, e.g. a whole ball feeder cycle.
+           All segments are queued into the state machine at once, which also reverses the direction between the segments.
+           
+           Parameters:
+           step_counts: Signed number of steps per segment (positive means forward, negative backwards). Segments with 0 steps are skipped.
+           op_complete_callback: Reference onto a 1-parameter function, called once when the last segment is finished. The parameter will hold the reference onto the motor object.
+        """
+        if self.debug:
+            print(f"rotate_segments() called: {step_counts} steps...")
+        if self.mode != MODE_COUNTED:
+            raise Exception("rotate_segments() is only allowed in counted mode!")
+        segments = [int(c) for c in step_counts if c != 0]
+        if not segments:
+            return
+        if len(segments) > MAX_SEGMENTS:
+            raise InputDataException(f"A move can consist of {MAX_SEGMENTS} segments at most, but {len(segments)} were given.")
         if self._operating:
             raise Exception("Ongoing Rotation not yet finished!")
         self._op_complete_callback = op_complete_callback
         self._operating = True
+        self._move_segments = segments
+        self._move_id = (self._move_id + 1) & 0x3fff
         try:
-            steps_to_rotate = round(angle / self.angle_per_step)
-
-            if self.debug:
-                print(f"steps to do: {steps_to_rotate}")
-            #print(f"wait between steps: {self.waitTimeMs} ms")
-            if steps_to_rotate < 0:
-                self._current_direction = -1
-                steps_to_rotate = abs(steps_to_rotate)
-            else:
-                self._current_direction = 1
-
+            self._current_direction = 1 if segments[0] > 0 else -1
             # set up the state machines
-            self.v2_create_statemachines()
-            self._set_direction(self._current_direction)
-            self._counter_sm.put(steps_to_rotate) # this starts the action
+            self._prepare_statemachines(runner_freq=self.runner_freq, counter_freq=self.counter_freq)
+            if self._profile_sm:
+                self._start_profiled_move(segments)
+                return
+            last = len(segments) - 1
+            for i in range(len(segments)):
+                self._segment_sm.put(encode_segment(segments[i], i == last))
+            self._set_direction(self._current_direction) # this starts the action
             if self.debug:
-                print(f"Operation started ({steps_to_rotate=}, {self._current_direction=}).")
+                print(f"Operation started ({segments=}).")
         except Exception as e:
             print(f"Error: {e}")
             self._set_direction(0)
@@ -370,53 +509,187 @@ class StepMotorPIO:
     #         self._set_direction(0)
     #         raise e
 
+    def _start_profiled_move(self, segments: List[int]):
+        """Plans the acceleration profile per segment and streams all of them into the profile SM via DMA."""
+        cfg = self.motion_profile
+        phases = len(self.patterns)
+        scale = self.full_rotation_steps * phases / 60.0 # rpm -> phases/s
+        profiles = [StepProfile(abs(c) * phases, float(cfg.get('max_rpm', 15.0)) * scale,
+                                float(cfg.get('accel_rpm_per_s', 60.0)) * scale, float(cfg.get('start_rpm', 6.0)) * scale)
+                    for c in segments]
+        self.last_profile = profiles[0]
+        words = array('I', [0] * (sum([p.steps for p in profiles]) + 1))
+        offset = 0
+        for i in range(len(profiles)):
+            offset = self.build_profile_words(profiles[i], 1 if segments[i] > 0 else -1, words, offset)
+        words[offset] = self.patterns[self._phase] # delay 0 ends the move
+        self._profile_words = words
+        self._profile_word_count = offset + 1
+        dma = self._dma
+        block = self._sm_id // 4
+        sm_in_block = self._sm_id % 4
+        ctrl = dma.pack_ctrl(size=2, inc_read=True, inc_write=False, treq_sel=DREQ_PIO_TX[block] + sm_in_block)
+        dma.config(read=words, write=PIO_TXF_ADDR[block] + 4 * sm_in_block,
+                   count=len(words), ctrl=ctrl, trigger=True)
+        self._profile_sm.active(1)
+        if self.debug:
+            print(f"Profiled move started ({[p.getStatusData() for p in profiles]}).")
+
+    def build_profile_words(self, profile: StepProfile, direction: int, words, offset: int) -> int:
+        """Encodes the profile for run_profile_pio into words, starting at offset: one word per step with the coil pattern
+           in the lower 4 bits and the remaining delay ticks above. Returns the offset behind the last step.
+        """
+        offset, self._phase = encode_profile(profile.delays_us, self.patterns, self._phase, direction, words, offset)
+        return offset
+
     def _set_direction(self, direction = 0):
-        """Sets the movement direction by activating the according statemachines."""
+        """Activates the state machine of the current mode for the given direction, or deactivates all if direction is 0.
+           In counted mode the direction itself is part of the queued segments.
+        """
         if self.debug:
             print(f"Setting direction to {direction} in PIO block {self.pio_block_index}")
-        if direction > 0:
-            if self._runner_bwd_sm:
-                self._runner_bwd_sm.active(0)
+        if direction != 0:
+            if self._segment_sm:
+                self._segment_sm.active(1)
             if self._runner_fwd_sm:
                 self._runner_fwd_sm.active(1)
-            if self._counter_sm:
-                self._counter_sm.active(1)
-        elif direction < 0:
-            if self._runner_fwd_sm:
-                self._runner_fwd_sm.active(0)
-            if self._runner_bwd_sm:
-                self._runner_bwd_sm.active(1)
-            if self._counter_sm:
-                self._counter_sm.active(1)
         else:
-            if self._counter_sm: 
-                self._counter_sm.active(0)
+            if self._profile_sm:
+                self._profile_sm.active(0)
+            if self._dma:
+                self._dma.active(0)
+            if self._segment_sm: 
+                self._segment_sm.active(0)
             if self._runner_fwd_sm:
                 self._runner_fwd_sm.active(0)
-            if self._runner_bwd_sm:
-                self._runner_bwd_sm.active(0)
             self._operating = False
 
     def stop(self) -> None:
-        """Brings the motor to an immediate halt by deactivating the stepper SMs"""
+        """Brings the motor to an immediate halt by deactivating the stepper SMs (without ramp).
+           The steps performed so far are kept in the absolute position.
+        """
+        self._stop_ramp()
+        self._speed_rpm = 0.0
+        self._target_rpm = 0.0
+        if self._move_segments:
+            self._deactivate_for_readback()
+            self.position_steps += self._elapsed_move_steps()
+            self._move_segments = []
         self._set_direction(0)
         self._op_complete_callback = None
         self._operating = False
 
+    def _deactivate_for_readback(self):
+        """Halts the stepping SM, but keeps its registers and the DMA state for reading the steps performed so far."""
+        if self._profile_sm:
+            self._profile_sm.active(0)
+        if self._segment_sm:
+            self._segment_sm.active(0)
+
+    def read_position_steps(self) -> int:
+        """Returns the absolute position in steps (counted mode), including the progress of a running move.
+           The state machine is not halted for this, so the value is a snapshot of a moving target.
+        """
+        if not self._move_segments:
+            return self.position_steps
+        return self.position_steps + self._elapsed_move_steps()
+
+    def read_position_angle(self) -> float:
+        """Returns the absolute position in degrees, see read_position_steps()."""
+        return self.read_position_steps() * self.angle_per_step
+
+    def reset_position(self, steps: int = 0) -> None:
+        """Defines the current position as the given absolute position, e.g. after the motor was moved into a known position."""
+        if self._operating:
+            raise InvalidOperationException("The position cannot be reset during a move.")
+        self.position_steps = int(steps)
+
+    def get_move_progress(self) -> tuple:
+        """Returns (steps performed, total steps) of the running move, without sign. (0, 0) if no move is running."""
+        if not self._move_segments:
+            return 0, 0
+        total = 0
+        for c in self._move_segments:
+            total += abs(c)
+        return min(self._completed_steps(), total), total
+
+    def _completed_steps(self) -> int:
+        """Number of steps (without sign) of the running move, which have been completed by the state machine."""
+        segments = self._move_segments
+        if self._profile_sm:
+            # each profile word is one phase, the words still in the DMA or TX FIFO have not been performed yet
+            pending = self._dma.count + self._profile_sm.tx_fifo()
+            return max(self._profile_word_count - 1 - pending, 0) // len(self.patterns)
+        sm = self._segment_sm
+        for _ in range(2):
+            queued = sm.tx_fifo()
+            # X holds the remaining steps - 1 of the current segment, see run_segments_pio
+            sm.exec("mov(isr, x)")
+            sm.exec("push(noblock)")
+            x = sm.get()
+            if sm.tx_fifo() == queued:
+                break # no segment boundary in between
+        index = len(segments) - queued - 1
+        if index < 0:
+            return 0 # the first segment has not been pulled yet
+        done = 0
+        for i in range(index):
+            done += abs(segments[i])
+        # X is 0xffffffff at the segment boundaries (after the last step and until the next segment is loaded)
+        remaining = x + 1 if x < 0x40000000 else 0
+        return done + max(abs(segments[index]) - remaining, 0)
+
+    def _elapsed_move_steps(self) -> int:
+        """Signed number of steps the running move has performed so far."""
+        done = self._completed_steps()
+        elapsed = 0
+        for c in self._move_segments:
+            n = min(abs(c), done)
+            elapsed += n if c > 0 else -n
+            done -= n
+            if done == 0:
+                break
+        return elapsed
+
     def _irq_handler(self, pio):
-        """Handle the interrupt from the step counter SM if the operation is complete."""
+        """Handle the interrupt from the segment (or profile) SM when the last segment of a move is complete.
+           Runs in interrupt context, so the completion is only queued and handled in _move_complete().
+           The SM waits for the next segment in the meantime, without moving the motor.
+        """
+        event_queue.post(self._move_complete_ref, self._move_id)
+
+    def _move_complete(self, move_id: int):
+        """Deferred completion of a move: updates the position, deactivates the SMs and calls back the caller."""
         if self.debug:
-            print(f"Operation completed. {pio=}")
+            print(f"Operation completed. {move_id=}")
+        if move_id != self._move_id or not self._operating:
+            return # stopped (and maybe restarted) in the meantime
+        for c in self._move_segments:
+            self.position_steps += c
+        self._move_segments = []
         self._operating = False
         self._set_direction(0) # deactivate SMs
         if self._op_complete_callback:
             self._op_complete_callback(self)
 
     def getStatusData(self) -> dict:
+        position = self.read_position_steps()
+        done, total = self.get_move_progress()
         return {
             'mode': self.mode,
             'current_direction': self._current_direction,
             'operating': self._operating,
+            'speed_rpm': self._speed_rpm,
+            'target_rpm': self._target_rpm,
+            'setup_us': self._last_setup_us,
+            'sm_rebuilds': self.sm_rebuilds,
+            'sm_id': self._sm_id,
+            'phases_per_cycle': len(self.patterns),
+            'position_steps': position,
+            'position_angle': position * self.angle_per_step,
+            'move_steps_done': done,
+            'move_steps_total': total,
+            'last_profile': self.last_profile.getStatusData() if self.last_profile else None,
         }
     def getConfigData(self) -> dict:
         return {
@@ -429,6 +702,9 @@ class StepMotorPIO:
             'runner_freq': self.runner_freq,
             'counter_freq': self.counter_freq,
             'pio_block_index': self.pio_block_index,
+            'drive_mode': self.drive_mode,
+            'ramp_rpm_per_s': self.ramp_rpm_per_s,
+            'motion_profile': self.motion_profile,
         }
     def setConfigData(self, data: dict) -> dict:
         if self.debug:
@@ -457,6 +733,17 @@ class StepMotorPIO:
         tmp = data.get('pio_block_index')
         if tmp is not None:
             self.pio_block_index = int(tmp)
+        tmp = data.get('drive_mode')
+        if tmp is not None:
+            self.drive_mode = str(tmp)
+        tmp = data.get('ramp_rpm_per_s')
+        if tmp is not None:
+            self.ramp_rpm_per_s = float(tmp)
+        tmp = data.get('motion_profile')
+        if tmp is not None:
+            if tmp and not hasattr(rp2, 'DMA'):
+                raise ConfigurationException("Motion profiles require a MicroPython firmware with rp2.DMA support.")
+            self.motion_profile = tmp if tmp else None
         self.adopt_config()
         return self.getConfigData()
 
@@ -467,66 +754,6 @@ def trigger_steps_endless():
     irq(block, rel(6))      # trigger step and wait
     wrap()
 
-@rp2.asm_pio(set_init=rp2.PIO.OUT_LOW)
-def trigger_steps():
-    # Counts the steps backwards, triggering execution via IRQ6 and raises IRQ0 if reaching step#0.
-    # Number of steps must be put into TX FIFO before
-    pull(block)             # read the number of steps into OSR (blocking until value is available)
-    mov(x, osr)             # store number of steps into X
-    label("next_step")
-    irq(block, rel(6))      # trigger step and wait
-    jmp(x_dec, "next_step") # decrease X and repeat if still >0
-    irq(rel(0))             # signal that requested operation is finished
-    wrap()
-
-@rp2.asm_pio(set_init=(rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW))
-def run_endless_pio():
-    #[1,0,0,0],[1,1,0,0],[0,1,0,0],[0,1,1,0],[0,0,1,0],[0,0,1,1],[0,0,0,1],[1,0,0,1]
-    #duration(delay=23): 192 (TICKS_PER_CYCLE)
-    delay = 23
-    #wait(1, irq, rel(5)) # wait for the trigger-irq
-    set(pins, 8) [delay]  # 0b1000
-    set(pins, 12)[delay]  # 0b1100
-    set(pins, 4) [delay]  # 0b0100
-    set(pins, 6) [delay]  # 0b0110
-    set(pins, 2) [delay]  # 0b0010
-    set(pins, 3) [delay]  # 0b0011
-    set(pins, 1) [delay]  # 0b0001
-    set(pins, 9) [delay]  # 0b1001
-    wrap()
-
-@rp2.asm_pio(set_init=(rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW))
-def run_forward_pio():
-    #[1,0,0,0],[1,1,0,0],[0,1,0,0],[0,1,1,0],[0,0,1,0],[0,0,1,1],[0,0,0,1],[1,0,0,1]
-    #duration(delay=23): 192 (TICKS_PER_CYCLE)
-    delay = 23
-    wait(1, irq, rel(5)) # wait for the trigger-irq
-    set(pins, 8) [delay]  # 0b1000
-    set(pins, 12)[delay]  # 0b1100
-    set(pins, 4) [delay]  # 0b0100
-    set(pins, 6) [delay]  # 0b0110
-    set(pins, 2) [delay]  # 0b0010
-    set(pins, 3) [delay]  # 0b0011
-    set(pins, 1) [delay]  # 0b0001
-    set(pins, 9) [delay]  # 0b1001
-    wrap()
-   
-@rp2.asm_pio(set_init=(rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW))
-def run_backward_pio():
-    # basically reverse of [1,0,0,0],[1,1,0,0],[0,1,0,0],[0,1,1,0],[0,0,1,0],[0,0,1,1],[0,0,0,1],[1,0,0,1]
-    #duration(delay=23): 192 (TICKS_PER_CYCLE)
-    delay = 23
-    wait(1, irq, rel(4)) # wait for the trigger-irq
-    set(pins, 1) [delay]  # 0b0001
-    set(pins, 3) [delay]  # 0b0011
-    set(pins, 2) [delay]  # 0b0010
-    set(pins, 6) [delay]  # 0b0110
-    set(pins, 4) [delay]  # 0b0100
-    set(pins, 12)[delay]  # 0b1100
-    set(pins, 8) [delay]  # 0b1000
-    set(pins, 9) [delay]  # 0b1001
-    wrap()
-
 def run_endless_test(mot: StepMotorPIO, duration=10, speed=1, dir=1):
     """This tests runs the motor permanently for the specified time.
     """
@@ -570,6 +797,24 @@ def reverse_direction(mot: StepMotorPIO, current_repeats: int, angle: float):
     else:
         print("Final callback reached.")
 
+def run_setup_latency_test(mot: StepMotorPIO, repeats=10, angle=10.0):
+    """Compares the setup latency per move (counted mode) when rebuilding the state machines for every move (former behavior)
+       with reusing the persistent ones. Returns both averages in us.
+    """
+    results = []
+    for rebuild in (True, False):
+        total = 0
+        for i in range(repeats):
+            if rebuild:
+                mot._sm_setup = None
+            mot.rotate_by_angle(angle if i % 2 == 0 else -angle)
+            total += mot._last_setup_us
+            while mot._operating:
+                time.sleep_ms(10)
+        results.append(total // repeats)
+    print(f"Setup latency per move: {results[0]} us with rebuild, {results[1]} us persistent.")
+    return results
+
 if __name__ == "__main__":
     mot = StepMotorPIO(MODE_COUNTED)
     try:
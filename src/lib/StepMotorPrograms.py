@@ -0,0 +1,126 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+"""PIO programs of the StepMotorPIO and their word formats.
+   They are kept separately, so they can be assembled and run by the PioEmulator on the host as well.
+"""
+try:
+    import rp2
+except ImportError:
+    from PioEmulator import rp2 # host environment: the programs are assembled for the emulator
+from DriveMode import DRIVE_HALF_STEP, PATTERNS, backward_patterns
+
+TICKS_PER_CYCLE = 192 # duration of the PIO loop for one cylce of the inner motor in half step mode (one iteration of the runner code)
+PROFILE_SM_FREQ = 1000000 # 1 tick per us, so step delays of a profile can be passed in us
+PROFILE_LOOP_TICKS = 6 # ticks of run_profile_pio per step besides the delay loop
+VARIABLE_SM_FREQ = 1000000 # 1 tick per us for run_variable_pio
+VARIABLE_PHASE_TICKS = 4 # ticks of run_variable_pio per phase besides the delay loop
+VARIABLE_WORD_TICKS = 3 # ticks of run_variable_pio per pattern word besides the phases
+VARIABLE_WORD_PHASES = 8 # phases (4 bit coil patterns) per pattern word of run_variable_pio
+
+@rp2.asm_pio(out_init=(rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW), out_shiftdir=rp2.PIO.SHIFT_RIGHT)
+def run_variable_pio():
+    # Endless rotation with the speed taken from the TX FIFO (continuous mode).
+    # 1st word: 8 coil patterns of 4 bits (see encode_patterns()), kept in the ISR for the whole rotation.
+    # Further words: delay loop count per phase, taken at the start of a pattern word. Without a new word the last one is kept.
+    #duration: (delay + 4) per phase + 3 per pattern word
+    pull(block)
+    mov(isr, osr)           # coil patterns
+    wrap_target()
+    pull(noblock)           # new delay or, if there is none, a copy of X (the current delay)
+    mov(x, osr)
+    mov(osr, isr)           # coil patterns of the next 8 phases
+    label("phase")
+    out(pins, 4)
+    mov(y, x)
+    label("delay")
+    jmp(y_dec, "delay")
+    jmp(not_osre, "phase")
+    wrap()
+
+def encode_patterns(patterns) -> int:
+    """Packs the coil patterns of one cycle into the pattern word of run_variable_pio (first pattern in bits 0-3).
+       Cycles with 4 phases are repeated to fill the 8 patterns of the word.
+    """
+    word = 0
+    for i in range(VARIABLE_WORD_PHASES):
+        word |= patterns[i % len(patterns)] << (4 * i)
+    return word
+
+def encode_segment(steps: int, last: bool) -> int:
+    """Encodes a segment for run_segments_pio: bit 0 direction (1: forward), bits 1-30 number of steps - 1, bit 31 last segment of the move."""
+    word = ((abs(steps) - 1) << 1) | (1 if steps > 0 else 0)
+    if last:
+        word |= 0x80000000
+    return word
+
+def _segments_program(drive_mode: str):
+    """Creates the program for counted moves (see run_segments_pio) with the coil patterns of the drive mode."""
+    forward = PATTERNS[drive_mode]
+    backward = backward_patterns(drive_mode)
+    @rp2.asm_pio(set_init=(rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW), out_shiftdir=rp2.PIO.SHIFT_RIGHT)
+    def run_segments_pio():
+        # Performs the segments of a move (see encode_segment()) and raises IRQ0 after the last one.
+        # X always holds the remaining steps - 1 of the current segment, it is read via exec of mov(isr, x) and push.
+        # half step forward:  [1,0,0,0],[1,1,0,0],[0,1,0,0],[0,1,1,0],[0,0,1,0],[0,0,1,1],[0,0,0,1],[1,0,0,1]
+        # backward: reverse order
+        #duration(delay=23): 24 per phase + 1 per step (loop), 193 in half step mode
+        delay = 23
+        label("next_segment")
+        pull(block)             # wait for the next segment
+        out(y, 1)               # direction
+        out(x, 30)              # number of steps - 1
+        jmp(not_y, "backward")
+        label("forward")
+        for pattern in forward:
+            set(pins, pattern) [delay]
+        jmp(x_dec, "forward")
+        jmp("segment_done")
+        label("backward")
+        for pattern in backward:
+            set(pins, pattern) [delay]
+        jmp(x_dec, "backward")
+        label("segment_done")
+        out(y, 1)               # last segment?
+        jmp(not_y, "next_segment")
+        irq(rel(0))             # signal that requested operation is finished
+        wrap()
+    return run_segments_pio
+
+SEGMENT_PROGRAMS = {mode: _segments_program(mode) for mode in PATTERNS}
+run_segments_pio = SEGMENT_PROGRAMS[DRIVE_HALF_STEP]
+
+@rp2.asm_pio(out_init=(rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW, rp2.PIO.OUT_LOW), out_shiftdir=rp2.PIO.SHIFT_RIGHT)
+def run_profile_pio():
+    # Performs one phase per word from the TX FIFO (see encode_profile()):
+    # bits 0-3: coil pattern, bits 4-31: delay ticks until the next step. A delay of 0 ends the move and raises IRQ0.
+    label("next_step")
+    pull(block)             # wait for the next step
+    out(pins, 4)            # set the coils
+    out(x, 28)              # delay ticks
+    jmp(not_x, "done")
+    label("delay")
+    jmp(x_dec, "delay")
+    jmp("next_step")
+    label("done")
+    irq(rel(0))             # signal that requested operation is finished
+    wrap()
+
+def variable_phase_delay(speed_rpm: float, full_rotation_steps: float, phases_per_cycle: int) -> int:
+    """Delay loop count per phase of run_variable_pio for the given speed (> 0)."""
+    steps_per_s = speed_rpm / 60.0 * full_rotation_steps
+    word_ticks = VARIABLE_SM_FREQ * VARIABLE_WORD_PHASES / (phases_per_cycle * steps_per_s)
+    return max(int((word_ticks - VARIABLE_WORD_TICKS) / VARIABLE_WORD_PHASES) - VARIABLE_PHASE_TICKS, 0)
+
+def encode_profile(delays_us, patterns, phase: int, direction: int, words, offset: int) -> tuple:
+    """Encodes the step delays of a profile for run_profile_pio into words, starting at offset: one word per phase with the
+       coil pattern in the lower 4 bits and the remaining delay ticks above. phase is the index of the pattern set last.
+       Returns the offset behind the last phase and the index of the last pattern.
+    """
+    n = len(patterns)
+    for i in range(len(delays_us)):
+        phase = (phase + direction) % n
+        delay = delays_us[i] - PROFILE_LOOP_TICKS
+        words[offset + i] = (max(delay, 1) << 4) | patterns[phase]
+    return offset + len(delays_us), phase
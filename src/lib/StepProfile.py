@@ -0,0 +1,72 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List
+from array import array
+from math import sqrt
+from RobbyExceptions import ConfigurationException
+
+class StepProfile:
+    """Trapezoidal speed profile (accelerate / cruise / decelerate) of a stepper move.
+       The profile is a table with the duration of every single step in us, which can be streamed to a PIO program.
+       For short moves the cruising speed is not reached and the profile becomes a triangle.
+    """
+    def __init__(self, steps: int, max_speed: float, accel: float, start_speed: float) -> None:
+        """Parameters:
+           steps:       number of steps to move (>= 0).
+           max_speed:   cruising speed in steps/s.
+           accel:       acceleration (and deceleration) in steps/s².
+           start_speed: speed in steps/s the motor can start with (and stop from) without stalling.
+        """
+        if max_speed <= 0 or accel <= 0 or start_speed <= 0:
+            raise ConfigurationException(f"StepProfile: speeds and acceleration must be positive ({max_speed=}, {accel=}, {start_speed=}).")
+        self.steps = int(steps)
+        self.max_speed = float(max_speed)
+        self.accel = float(accel)
+        self.start_speed = min(float(start_speed), self.max_speed)
+        self.delays_us = array('I', [0] * self.steps)
+        """duration of each step in us"""
+        self.accel_steps = 0
+        """number of steps until the cruising speed is reached (equal to the number of decelerating steps)"""
+        self.duration_us = 0
+        self._plan()
+
+    def _plan(self) -> None:
+        v0_sq = self.start_speed * self.start_speed
+        two_a = 2.0 * self.accel
+        v_max = self.max_speed
+        n = self.steps
+        total = 0
+        accel_steps = 0
+        for i in range(n):
+            # speed reachable after i steps from the start, and from which the stop can still be reached
+            s = i if i < n - 1 - i else n - 1 - i
+            v = sqrt(v0_sq + two_a * s)
+            if v >= v_max:
+                v = v_max
+            elif i < n - 1 - i:
+                accel_steps += 1
+            d = int(1000000.0 / v + 0.5)
+            self.delays_us[i] = d
+            total += d
+        self.accel_steps = accel_steps
+        self.duration_us = total
+
+    def getStatusData(self) -> dict:
+        return {
+            'steps': self.steps,
+            'accel_steps': self.accel_steps,
+            'duration_ms': self.duration_us // 1000,
+            'max_speed': self.max_speed,
+        }
+
+def plan_move(angle: float, steps_per_rev: float, max_rpm: float, accel_rpm_per_s: float, start_rpm: float) -> StepProfile:
+    """Plans the profile for a move by the given angle (the sign is ignored, direction is up to the caller).
+       Speeds are given for the output shaft in rotations per minute.
+    """
+    steps = int(abs(angle) / 360.0 * steps_per_rev + 0.5)
+    scale = steps_per_rev / 60.0 # rpm -> steps/s
+    return StepProfile(steps, max_rpm * scale, accel_rpm_per_s * scale, start_rpm * scale)
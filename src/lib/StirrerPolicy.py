@@ -0,0 +1,225 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+import sys
+if 'micropython' not in sys.version.lower():
+    from typing import List, Union
+from machine import Timer
+import time
+from RobbyExceptions import ConfigurationException
+
+POLICY_CONTINUOUS = 'continuous'
+"""the stirrers run during the whole session (former behaviour)"""
+POLICY_DUTY = 'duty'
+"""the stirrers only run around the ball releases and after missed balls"""
+POLICIES = (POLICY_CONTINUOUS, POLICY_DUTY)
+
+class StirrerPolicy:
+    """Decides when the ball stirrers of the machine run.
+       With the duty policy, the controller passes the upcoming ball releases (offsets in ms) after every release. Each
+       release gets a stir window from lead_ms before to tail_ms after it, a missed ball one of miss_ms from now on.
+       Windows closer than min_idle_ms are merged, so the motors are not stopped just to be started again. A single
+       one-shot timer switches the stirrers at the window boundaries, in between they are idle.
+       The runtime of the stirrers is recorded, the energy is estimated from the configured power while running and idle.
+    """
+    def __init__(self, ball_stirrers: list, policy: str = POLICY_DUTY, lead_ms: int = 400, tail_ms: int = 200,
+                 miss_ms: int = 1500, min_idle_ms: int = 500, power_w: float = 2.5, idle_power_w: float = 0.0, debug=False) -> None:
+        """Parameters:
+           ball_stirrers: the stirrers of the machine (the list is referenced, so later changes are taken into account).
+           policy:        'continuous' or 'duty', see POLICIES.
+           lead_ms:       time the stirrers start before a release.
+           tail_ms:       time the stirrers keep running after a release.
+           miss_ms:       time the stirrers run after a feeder missed a ball.
+           min_idle_ms:   shorter pauses between two windows are bridged.
+           power_w:       estimated electrical power of one stirrer while running (e.g. coil voltage * current of the stepper).
+           idle_power_w:  estimated electrical power of one stirrer while idle (holding current, driver board).
+        """
+        self.ball_stirrers = ball_stirrers
+        self.debug = debug
+        self.policy = policy
+        self.lead_ms = lead_ms
+        self.tail_ms = tail_ms
+        self.miss_ms = miss_ms
+        self.min_idle_ms = min_idle_ms
+        self.power_w = power_w
+        self.idle_power_w = idle_power_w
+        if policy not in POLICIES:
+            raise ConfigurationException(f"Invalid stirrer policy '{policy}', must be one of {POLICIES}.")
+        self._windows = []
+        """planned stir windows [start, end] in ticks_ms, sorted and not overlapping"""
+        self._timer = None
+        self._running = False
+        self._active = False
+        """True during a session (between session_start() and session_stop())"""
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.session_ms = 0
+        self.run_ms = 0
+        self.starts = 0
+        """number of times the stirrers were switched on"""
+        self.misses = 0
+        self._session_t0 = time.ticks_ms()
+        self._run_t0 = self._session_t0
+
+    def session_start(self) -> None:
+        """Called when the machine starts playing. Continuous stirrers start right away, duty cycled ones are planned."""
+        if self._active:
+            return
+        self._active = True
+        self.reset_stats()
+        self._windows = []
+        if self.policy == POLICY_CONTINUOUS:
+            self._switch(True)
+        else:
+            # the balls have been resting in the pool: loosen them before the first release
+            self.plan([self.lead_ms])
+
+    def session_stop(self) -> None:
+        """Called when the machine stops: stops the stirrers and closes the runtime accounting."""
+        if self._timer is not None:
+            self._timer.deinit()
+        self._windows = []
+        self._switch(False)
+        if self._active:
+            self.session_ms += time.ticks_diff(time.ticks_ms(), self._session_t0)
+            self._session_t0 = time.ticks_ms()
+        self._active = False
+
+    def plan(self, upcoming_ms: list) -> None:
+        """Plans the stir windows for the upcoming ball releases, given as offsets from now in ms (ascending).
+           Windows of releases which are no longer upcoming (e.g. after a change of the program) are dropped,
+           a window which is running is kept until its end.
+        """
+        if self.policy != POLICY_DUTY or not self._active:
+            return
+        now = time.ticks_ms()
+        windows = [w for w in self._windows if time.ticks_diff(w[0], now) <= 0 < time.ticks_diff(w[1], now)]
+        for offset in upcoming_ms:
+            self._add_window(windows, time.ticks_add(now, max(offset - self.lead_ms, 0)), time.ticks_add(now, offset + self.tail_ms))
+        self._windows = windows
+        self._update(None)
+
+    def ball_missed(self) -> None:
+        """Called when a feeder missed a ball: the stirrers run for miss_ms to loosen the balls in the pool."""
+        self.misses += 1
+        if self.policy == POLICY_CONTINUOUS or not self._active:
+            for bs in self.ball_stirrers:
+                bs.burst(self.miss_ms)
+            return
+        now = time.ticks_ms()
+        self._add_window(self._windows, now, time.ticks_add(now, self.miss_ms))
+        self._update(None)
+
+    def _add_window(self, windows: list, start: int, end: int) -> None:
+        """Inserts the window into the sorted list, merging it with windows closer than min_idle_ms."""
+        k = 0
+        while k < len(windows) and time.ticks_diff(windows[k][1], start) < -self.min_idle_ms:
+            k += 1
+        while k < len(windows) and time.ticks_diff(windows[k][0], end) <= self.min_idle_ms:
+            w = windows.pop(k)
+            if time.ticks_diff(w[0], start) < 0:
+                start = w[0]
+            if time.ticks_diff(w[1], end) > 0:
+                end = w[1]
+        windows.insert(k, [start, end])
+
+    def _update(self, timer) -> None:
+        """Switches the stirrers according to the windows and arms the timer for the next boundary."""
+        if not self._active:
+            return
+        now = time.ticks_ms()
+        while self._windows and time.ticks_diff(self._windows[0][1], now) <= 0:
+            self._windows.pop(0)
+        if not self._windows:
+            self._switch(False)
+            return
+        start, end = self._windows[0]
+        run = time.ticks_diff(start, now) <= 0
+        self._switch(run)
+        delay = time.ticks_diff(end if run else start, now)
+        if self._timer is None:
+            self._timer = Timer()
+        self._timer.init(mode=Timer.ONE_SHOT, period=max(delay, 1), callback=self._update)
+
+    def _switch(self, run: bool) -> None:
+        if run == self._running:
+            return
+        now = time.ticks_ms()
+        if run:
+            self.starts += 1
+            self._run_t0 = now
+        else:
+            self.run_ms += time.ticks_diff(now, self._run_t0)
+        self._running = run
+        if self.debug:
+            print(f"StirrerPolicy: stirrers {'started' if run else 'stopped'}.")
+        for bs in self.ball_stirrers:
+            try:
+                if run:
+                    bs.start()
+                else:
+                    bs.stop()
+            except Exception as e:
+                print(f"StirrerPolicy: error switching BallStirrer #{bs.bs_index}: {e}")
+
+    def getStatusData(self) -> dict:
+        """Runtime of the stirrers in the current (or last) session and the estimated energy, compared with continuous stirring."""
+        now = time.ticks_ms()
+        session_ms = self.session_ms + (time.ticks_diff(now, self._session_t0) if self._active else 0)
+        run_ms = self.run_ms + (time.ticks_diff(now, self._run_t0) if self._running else 0)
+        n = len(self.ball_stirrers)
+        energy_j = n * (run_ms * self.power_w + (session_ms - run_ms) * self.idle_power_w) / 1000.0
+        continuous_j = n * session_ms * self.power_w / 1000.0
+        return {
+            'policy': self.policy,
+            'running': self._running,
+            'session_ms': session_ms,
+            'run_ms': run_ms,
+            'duty_cycle': run_ms / session_ms if session_ms > 0 else None,
+            'starts': self.starts,
+            'misses': self.misses,
+            'planned_windows': len(self._windows),
+            'energy_j': energy_j,
+            'continuous_energy_j': continuous_j,
+            'saved_energy_j': continuous_j - energy_j,
+        }
+
+    def getConfigData(self) -> dict:
+        return {
+            'policy': self.policy,
+            'lead_ms': self.lead_ms,
+            'tail_ms': self.tail_ms,
+            'miss_ms': self.miss_ms,
+            'min_idle_ms': self.min_idle_ms,
+            'power_w': self.power_w,
+            'idle_power_w': self.idle_power_w,
+        }
+
+    def setConfigData(self, data: dict) -> None:
+        tmp = data.get('policy')
+        if tmp is not None:
+            if tmp not in POLICIES:
+                raise ConfigurationException(f"Invalid stirrer policy '{tmp}', must be one of {POLICIES}.")
+            if self._active:
+                raise ConfigurationException("The stirrer policy cannot be changed while the machine is playing.")
+            self.policy = tmp
+        tmp = data.get('lead_ms')
+        if tmp is not None:
+            self.lead_ms = int(tmp)
+        tmp = data.get('tail_ms')
+        if tmp is not None:
+            self.tail_ms = int(tmp)
+        tmp = data.get('miss_ms')
+        if tmp is not None:
+            self.miss_ms = int(tmp)
+        tmp = data.get('min_idle_ms')
+        if tmp is not None:
+            self.min_idle_ms = int(tmp)
+        tmp = data.get('power_w')
+        if tmp is not None:
+            self.power_w = float(tmp)
+        tmp = data.get('idle_power_w')
+        if tmp is not None:
+            self.idle_power_w = float(tmp)
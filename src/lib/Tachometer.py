@@ -0,0 +1,113 @@
+# Copyright (c) 2025 Reiner Nikulski
+#
+# This software is released under the MIT License.
+# https://opensource.org/licenses/MIT
+try:
+    import rp2
+    from machine import Pin
+except ImportError:
+    rp2 = None # host environment: only the PulseGenerator stand-in can be used
+from PioAllocator import allocator
+
+# Installation instructions for a hall or optical sensor on a ball driver wheel
+# - Mount one or more magnets/reflective marks on the wheel (pulses_per_rev).
+# - Connect the sensor's open collector output to a free GP-pin on the pico (input_pin), the internal pull-up is enabled.
+class Tachometer:
+    """Counts the pulses of a wheel sensor in a PIO state machine, so that no pulse gets lost while the cpu is busy.
+       The counter runs freely, readings are taken by count() and converted into speeds by the caller.
+    """
+    def __init__(self, input_pin: int, pulses_per_rev: int = 1, pio_block_index: int = 0, sm_index: int = 3, debug=False):
+        """Parameters:
+           input_pin:       GP-pin number the sensor output is connected to.
+           pulses_per_rev:  Number of pulses the sensor emits per wheel revolution.
+           pio_block_index: Preferred pio block (0 or 1), the PioAllocator falls back to the other one if it is full.
+           sm_index:        Preferred state machine within the pio block (0-3), used if it is still free.
+        """
+        self.debug = debug
+        self.input_pin = input_pin
+        self.pulses_per_rev = max(int(pulses_per_rev), 1)
+        self.pio_block_index = min(max(pio_block_index, 0), 1)
+        self.sm_index = min(max(sm_index, 0), 3)
+        self._sm = None
+        self._sm_id = None
+        self.adopt_config()
+
+    def adopt_config(self):
+        """(Re)creates the counting state machine with the current configuration."""
+        allocator.release(self._sm_id)
+        pin = Pin(self.input_pin, Pin.IN, Pin.PULL_UP)
+        self._sm_id = allocator.allocate(f"Tachometer GP{self.input_pin}", count_pulses_pio, 'count_pulses_pio', self.pio_block_index, self.sm_index)
+        self._sm = rp2.StateMachine(self._sm_id, count_pulses_pio, in_base=pin)
+        self._sm.active(1)
+        if self.debug:
+            print(f"Tachometer on GP{self.input_pin} counting on state machine {self._sm_id}.")
+
+    def count(self) -> int:
+        """Returns the total number of pulses counted so far (wraps at 32 bits)."""
+        # X is counted down from 0, so it holds the negative pulse count
+        self._sm.exec("mov(isr, x)")
+        self._sm.exec("push()")
+        return (-self._sm.get()) & 0xFFFFFFFF
+
+    def stop(self):
+        """Stops counting and frees the state machine."""
+        allocator.release(self._sm_id)
+        self._sm_id = None
+        self._sm = None
+
+    def getConfigData(self) -> dict:
+        return {
+            'type': type(self).__name__,
+            'input_pin': self.input_pin,
+            'pulses_per_rev': self.pulses_per_rev,
+            'pio_block_index': self.pio_block_index,
+            'sm_index': self.sm_index,
+        }
+
+class PulseGenerator:
+    """Host-side stand-in for the Tachometer, e.g. for testing the speed control without hardware.
+       It emulates a motor with wheel following its PWM setting with a first order lag, so it can be used in place of
+       both, the DcMotor (set_speed()) and the Tachometer (count()).
+       The caller advances the time explicitly, which keeps the simulation deterministic.
+    """
+    def __init__(self, pulses_per_rev: int = 1, max_rpm: float = 6000.0, time_constant_ms: float = 300.0):
+        self.pulses_per_rev = max(int(pulses_per_rev), 1)
+        self.max_rpm = max_rpm
+        self.time_constant_ms = time_constant_ms
+        self.rpm = 0.0
+        self.pwm_pct = 0
+        self.load_factor = 1.0
+        """Factor < 1.0 emulates a weak battery or a worn wheel: the same PWM setting results in a lower speed."""
+        self._pulses = 0.0
+
+    def set_speed(self, speed: int):
+        self.pwm_pct = speed
+
+    def advance(self, dt_ms: float):
+        """Advance the simulated wheel by dt_ms with the current PWM setting."""
+        target = abs(self.pwm_pct) / 100.0 * self.max_rpm * self.load_factor
+        alpha = min(dt_ms / self.time_constant_ms, 1.0) if self.time_constant_ms > 0 else 1.0
+        self.rpm += (target - self.rpm) * alpha
+        self._pulses += self.rpm / 60000.0 * dt_ms * self.pulses_per_rev
+
+    def count(self) -> int:
+        return int(self._pulses) & 0xFFFFFFFF
+
+    def stop(self):
+        pass
+
+    def getConfigData(self) -> dict:
+        return {
+            'type': type(self).__name__,
+            'pulses_per_rev': self.pulses_per_rev,
+        }
+
+if rp2:
+    @rp2.asm_pio()
+    def count_pulses_pio():
+        # Counts rising edges on the input pin by decrementing X (X is never reset, the reader takes differences).
+        wait(0, pin, 0)         # wait for low level
+        wait(1, pin, 0)         # wait for the rising edge
+        jmp(x_dec, "counted")   # decrement X, the jump target is the same in both cases
+        label("counted")
+        wrap()
@@ -63,6 +63,7 @@ class WebServer:
                             '^[0-9]+$': {
                                 'dispense': lambda bf: controller.ball_feeders[int(bf)].dispense(),
                                 'prepare': lambda bf: controller.ball_feeders[int(bf)].prepare_after_mount(),
+                                'tune': lambda bf: controller.API.bf_tune(int(bf)),
                                 'stop': lambda bf: controller.ball_feeders[int(bf)].stop(),
                                 'motors': {
                                     '^[0-9]+$': {
@@ -97,6 +98,8 @@ class WebServer:
                         'system': {
                             'config': lambda data: controller.adopt_general_settings(data['settings']),
                             'mode': lambda data: controller.API.set_mode(data.get('mode', -1), data.get('mode_text', '')),
+                            'aiming': lambda data: controller.API.set_aiming_table(data.get('table_file', ''), bool(data.get('save', True))),
+                            'power': lambda data: controller.API.set_power_config(data),
                         },
                         'balldrivers': {
                             '^[0-9]+$': {
@@ -125,6 +128,7 @@ class WebServer:
                                 },
                                 '/default/': lambda bs: {},
                             },
+                            'policy': lambda data: controller.API.bs_set_policy(data),
                         },
                         'ballfeeders': {
                             '^[0-9]+$': {
@@ -160,6 +164,12 @@ class WebServer:
                             'config': controller.getConfigData,
                             'mode': controller.API.get_mode,
                             'status': controller.getStatusData,
+                            'pio': controller.API.get_pio_allocation,
+                            'events': controller.API.get_irq_event_stats,
+                            'cadence': controller.API.get_cadence_report,
+                            'criticalpath': controller.API.get_critical_path_report,
+                            'power': controller.API.get_power_status,
+                            'aiming': controller.API.get_aiming,
                             '/default/': controller.getStatusData,
                         },
                         'balldrivers': {
@@ -192,11 +202,20 @@ class WebServer:
                                 '/default/': lambda bs: controller.ball_stirrers[int(bs)].getStatusData(),
                             },
                             'config': lambda: [bs.getConfigData() for bs in controller.ball_stirrers],
+                            'policy': controller.API.bs_get_policy_status,
                         },
                         'ballfeeders': {
                             '^[0-9]+$': {
                                 'config': lambda bf: controller.ball_feeders[int(bf)].getConfigData(),
                                 'status': lambda bf: controller.ball_feeders[int(bf)].getStatusData(),
+                                'sensor': lambda bf: controller.API.bf_get_sensor_status(int(bf)),
+                                'motors': {
+                                    '^[0-9]+$': {
+                                        'position': lambda bf, m: controller.API.bf_get_motor_position(int(bf), int(m)),
+                                        'status': lambda bf, m: controller.ball_feeders[int(bf)].motors[int(m)].getStatusData(),
+                                        '/default/': lambda bf, m: controller.ball_feeders[int(bf)].motors[int(m)].getStatusData(),
+                                    },
+                                },
                                 '/default/': lambda bf: controller.ball_feeders[int(bf)].getStatusData(),
                             },
                             'config': lambda: [bf.getConfigData() for bf in controller.ball_feeders],
@@ -204,7 +223,7 @@ class WebServer:
                         'machinerotators': {
                             '^[0-9]+$': {
                                 'config': lambda bf: controller.API.mr_get_config(int(bf)),
-                                #'status': lambda bf: controller.API.get_machine_rotator_status(int(bf)),
+                                'status': lambda mr: controller.API.mr_get_status(int(mr)),
                                 '/default/': lambda bf: controller.API.mr_get_config(int(bf)),
                             },
                             'config': lambda: controller.API.mr_get_config(-1),
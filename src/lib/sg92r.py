@@ -1,6 +1,7 @@
 
 from machine import Pin, PWM
 import time
+from ServoTick import servo_tick
 
 # DEFAULTS:
 # The typical range for the sg92r servo is 0 to 180 degrees, which corresponds 
@@ -17,7 +18,7 @@ class Sg92r:
     The SG92R is a PWM controlled servo, which can usually rotate 90° in both directions. It is connected to one PWM GPIO pin of the microcontroller.
     Parameters:
     """
-    def __init__(self, control_pin: int=0, freq=FREQ, t_low=T_LOW_DEFAULT, t_high=T_HIGH_DEFAULT, halfspan_angle=HALFSPAN_ANGLE, sec_per_degree=0.1/60.0, debug=False):
+    def __init__(self, control_pin: int=0, freq=FREQ, t_low=T_LOW_DEFAULT, t_high=T_HIGH_DEFAULT, halfspan_angle=HALFSPAN_ANGLE, sec_per_degree=0.1/60.0, sweep_speed_dps=0.0, debug=False):
         """Initializes the Sg92r servo motor with the given parameters.
         Args:
             control_pin (int): The GPIO pin number to be used for PWM (default: 0).
@@ -26,6 +27,8 @@ class Sg92r:
             t_high (float): Upper limit of the time of the PWM signal in milliseconds (default: 2.0).
             halfspan_angle (int): Maximum angle in both directions of the servo in degrees (default: 90).
             sec_per_degree (float): Motion time of the servo in seconds per degree (default: 0.1sec/60.0°).
+            sweep_speed_dps (float): If > 0, the duty cycle is interpolated, so that the servo sweeps with this speed in degrees per second
+                                     (limited by sec_per_degree). If 0, the servo moves with its own speed.
             debug (bool): If True, enables debug mode.
         """
 
@@ -36,7 +39,15 @@ class Sg92r:
         self._t_high = min(t_high, T_HIGH)
         self._freq = freq
         self._halfspan_angle = halfspan_angle
-        self.current_angle = 0.0 # current angle of the servo in degrees
+        self._sweep_speed_dps = sweep_speed_dps
+        self.current_angle = 0.0 # current angle of the servo in degrees (estimated while moving)
+        self.target_angle = 0.0
+        self._start_angle = 0.0
+        self._move_t0 = 0
+        self._move_ms = 0
+        self._moving = False
+        self._interpolate = False
+        self._op_complete_callback = None
         self._derive_attributes()
 
     def _derive_attributes(self):
@@ -45,6 +56,7 @@ class Sg92r:
         self._duty_halfspan = (self._t_high - self._t_low) / self._t_pulse * 65535 / 2
         self._duty_neutral = self._t_low / self._t_pulse * 65535 + self._duty_halfspan
         self._pwm = PWM(Pin(self._control_pin), freq=self._freq, duty_u16=int(self._duty_neutral))
+        self.current_angle = self.target_angle = 0.0 # the pwm starts in neutral position
         if self.debug:
             print("Sg92r:")
             print(f"  {self._control_pin=}")
@@ -58,14 +70,20 @@ class Sg92r:
             print(f"  {self._duty_neutral=}")
             print("Sg92r init complete.")
     
-    def rotate_by_angle(self, angle: float, op_complete_callback=None):
+    def rotate_by_angle(self, angle: float, op_complete_callback=None, duration_ms: int = 0):
         """Move the sg92r servo to an angle between its min and max angle.
+        The call returns immediately, the movement is tracked by the shared servo tick (see ServoTick).
+        A new call during a movement redirects the servo from its current (estimated) angle, the callback of the
+        superseded movement is not called.
         Args:
             angle (float): The angle to move the servo to, in degrees. 
                            Positive values are clockwise, negative values are counter-clockwise.  
-            op_complete_callback (callable, optional): This function is there for compatibility with the method signature of the StepMotorPIO class. 
-                                                       It is ignored, as the servo does not report back its position (is not encoded) or controls the movement, but rather moves immediately.
-                                                       If an argument is specified here, then a waiting time is calculated based on the angle and the sec_per_degree attribute and the call is blocking for that amount of time.
+            op_complete_callback (callable, optional): Reference onto a 1-parameter function for callback when the movement is finished.
+                                                       The parameter will hold the reference onto the motor object.
+                                                       As the servo does not report back its position (is not encoded), the end of the
+                                                       movement is calculated from the angle and the sec_per_degree attribute (or the sweep speed).
+            duration_ms (int, optional): Stretches the movement to this duration by interpolating the duty cycle, e.g. to arrive
+                                         at the same time as other motors. Ignored if the servo needs longer anyways.
         """
         # The typical range for the sg92r servo is 0 to 180 degrees, which corresponds to a 
         # duty cycle of 1ms (-90°) to 2ms (+90°) at a frequency of 50Hz (20ms pulse width).
@@ -73,22 +91,62 @@ class Sg92r:
             angle = self._halfspan_angle
         elif angle < -self._halfspan_angle:
             angle = -self._halfspan_angle
-        duty_cycle = int(angle / self._halfspan_angle * self._duty_halfspan + self._duty_neutral)
         if self.debug:
-            print("Current duty cycle:", self._pwm.duty_u16(), "/ angle: ", (self._pwm.duty_u16() - self._duty_neutral) / self._duty_halfspan * self._halfspan_angle)
-            print("Moving to", angle, 'deg / duty', duty_cycle)
-        #time.sleep(.1)
-        self._pwm.duty_u16(duty_cycle)
-        if op_complete_callback:
-            wait_time = abs(angle-self.current_angle) * self._sec_per_degree
-            time.sleep(wait_time)
-        else:
-            # TODO: Check if this is really required or if it is slowing down the operation unnecessarily.
-            time.sleep(self._t_pulse / 1000)  # Wait one pulse cycle to ensure the servo has time to adopt the change.
+            print("Current duty cycle:", self._pwm.duty_u16(), "/ angle: ", self.current_angle)
+            print("Moving to", angle, 'deg / duty', self._angle_to_duty(angle))
+        self._op_complete_callback = op_complete_callback
+        self._start_angle = self.current_angle
+        self.target_angle = angle
+        self._move_ms = self.move_duration_ms(angle)
+        self._interpolate = self._sweep_speed_dps > 0
+        if duration_ms > self._move_ms:
+            self._move_ms = duration_ms
+            self._interpolate = True
+        self._move_t0 = time.ticks_ms()
+        if not self._interpolate:
+            self._pwm.duty_u16(self._angle_to_duty(angle))
+        self._moving = True
+        servo_tick.add(self)
+
+    def move_duration_ms(self, angle: float, from_angle=None) -> int:
+        """Time needed to move from the current angle (or from_angle) to the given one: by the sweep speed if set, otherwise by the servo's own speed.
+           The result is at least one pulse period, so that the servo has time to adopt the change."""
+        delta = abs(angle - (self.current_angle if from_angle is None else from_angle))
+        sec = delta * self._sec_per_degree
+        if self._sweep_speed_dps > 0:
+            sec = max(sec, delta / self._sweep_speed_dps)
+        return max(int(sec * 1000), int(self._t_pulse))
+
+    def _angle_to_duty(self, angle: float) -> int:
+        return int(angle / self._halfspan_angle * self._duty_halfspan + self._duty_neutral)
+
+    def _tick(self, now_ms: int):
+        """Called by the servo tick while moving: interpolates the angle and finishes the movement."""
+        elapsed = time.ticks_diff(now_ms, self._move_t0)
+        if elapsed >= self._move_ms:
+            self.current_angle = self.target_angle
+            if self._interpolate:
+                self._pwm.duty_u16(self._angle_to_duty(self.target_angle))
+            self._moving = False
+            servo_tick.remove(self)
+            if self._op_complete_callback is not None:
+                callback = self._op_complete_callback
+                self._op_complete_callback = None
+                callback(self)
+            return
+        self.current_angle = self._start_angle + (self.target_angle - self._start_angle) * elapsed / self._move_ms
+        if self._interpolate:
+            self._pwm.duty_u16(self._angle_to_duty(self.current_angle))
+
+    def is_moving(self) -> bool:
+        return self._moving
 
     def getStatusData(self) -> dict:
         return {
             'current_duty': self._pwm.duty_u16(),
+            'current_angle': self.current_angle,
+            'target_angle': self.target_angle,
+            'moving': self._moving,
         }
     def getConfigData(self) -> dict:
         return {
@@ -99,6 +157,7 @@ class Sg92r:
             'freq': self._freq,
             'control_pin': self._control_pin,
             'sec_per_degree': self._sec_per_degree,
+            'sweep_speed_dps': self._sweep_speed_dps,
         }
     def setConfigData(self, data: dict) -> dict:
         """Sets the object's attributes based on the configuration data.
@@ -128,6 +187,9 @@ class Sg92r:
         tmp = data.get('sec_per_degree')
         if tmp:
             self._sec_per_degree = float(tmp)
+        tmp = data.get('sweep_speed_dps')
+        if tmp is not None:
+            self._sweep_speed_dps = float(tmp)
         self._derive_attributes()
         return self.getConfigData()
 